@@ -4,6 +4,11 @@ import time
 import threading
 import logging
 import sys
+import wire_format
+from fragmentation import Fragmenter, Reassembler, RECEIVE_BUFFER_SIZE
+from sliding_window import SendWindow
+from retransmission import RttEstimator
+from delta_encoding import DeltaEncoder
 from metrics import MetricCollector 
 
 class NMS_Agent:
@@ -13,42 +18,69 @@ class NMS_Agent:
         self.tcp_port = tcp_port
         self.agent_id = None 
 
+        # Binary wire format version agreed with the server at registration (None means JSON)
+        self.wire_version = None
+
         # Instantiate the MetricCollector
         self.metric_collector = MetricCollector()
 
         # UDP socket for NetTask
         self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
+        # Messages larger than one datagram travel in fragments both ways
+        self.fragmenter = Fragmenter()
+        self.reassembler = Reassembler()
+
+        # Smoothed RTT to the server, setting the timeouts of registration and metrics delivery
+        self.rtt = RttEstimator()
+
+        # Sequence-numbered samples in flight, retransmitted only when their ACK is overdue
+        self.metrics_window = SendWindow(self.transmit_metrics, rtt=self.rtt)
+
+        # Samples are sent as changes since the last acknowledged one when the server supports it
+        self.delta_encoder = DeltaEncoder()
+
+        # Task being collected and the thread collecting it
+        self.current_task = None
+        self.collector_thread = None
+
+        # Samples waiting to be sent as one batch
+        self.pending_batch = []
+
         # TCP socket for AlertFlow
         self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
 ############################################################################################################################################################################################
 
-    def register_with_server(self, max_retries=3, timeout=5):
+    def register_with_server(self, max_retries=5):
         """
         Handles the registration process with the server.
         Sends an ACK after receiving the agent_id.
-        Retries if no response is received within the timeout.
+        Retries if no response is received within the retransmission timeout, which doubles on every attempt.
         """
-        register_message = {"message": "register"}
+        register_message = {"message": "register", "wire_versions": list(wire_format.SUPPORTED_VERSIONS)}
 
         for attempt in range(1, max_retries + 1):
             try:
                 # Send the registration request
+                sent_at = time.monotonic()
                 self.udp_socket.sendto(json.dumps(register_message).encode(), (self.server_address, self.udp_port))
                 print(f"Attempt {attempt}: Sent registration request to server at {self.server_address}")
 
                 # Set the timeout for waiting for a response
-                self.udp_socket.settimeout(timeout)
+                self.udp_socket.settimeout(self.rtt.timeout(attempt - 1))
 
                 # Wait for a response from the server
-                response, addr = self.udp_socket.recvfrom(1024)
-                response_message = json.loads(response.decode())
+                response_message, addr = self.receive_message()
 
                 # Check if registration was successful
                 if response_message.get("status") == "registered":
+                    # Only an answer to the first request is a reliable RTT sample
+                    if attempt == 1:
+                        self.rtt.sample(time.monotonic() - sent_at)
                     self.agent_id = response_message.get("agent_id")
-                    print(f"Agent {self.agent_id} successfully registered")
+                    self.wire_version = response_message.get("wire_version")
+                    print(f"Agent {self.agent_id} successfully registered (wire format: {f'binary v{self.wire_version}' if self.wire_version else 'JSON'})")
 
                     # Send ACK back to the server
                     ack_message = {"message": "registration_ack", "agent_id": self.agent_id}
@@ -69,18 +101,56 @@ class NMS_Agent:
         print("[ERROR] Failed to register agent after maximum retries.")
         return False
     
+############################################################################################################################################################################################
+
+    def receive_message(self):
+        """
+        Receives the next whole message from the server, reassembling fragmented ones.
+        Raises socket.timeout if the socket timeout expires first.
+        """
+        while True:
+            data, addr = self.udp_socket.recvfrom(RECEIVE_BUFFER_SIZE)
+            if self.reassembler.is_fragment(data):
+                data = self.reassembler.add(data, addr)
+                if data is None:
+                    continue
+            return wire_format.decode(data), addr
+
+    def send_datagrams(self, payload, address):
+        """
+        Sends an encoded message, in fragments if it does not fit in one datagram.
+        """
+        for datagram in self.fragmenter.fragment(payload):
+            self.udp_socket.sendto(datagram, address)
+
 ############################################################################################################################################################################################
 
     def receive_task(self):
+        """
+        Receives everything the server sends: tasks, which (re)start the metrics collection in its
+        own thread, and metrics ACKs, which are handed to the send window. Samples whose ACK is
+        overdue are retransmitted between messages.
+        """
         print(f"Listening for tasks from {self.server_address}")
         while True:
             try:
-                # Set timeout to avoid indefinite blocking
-                self.udp_socket.settimeout(15)
+                # Retransmit overdue samples and wake up in time for the next timeout
+                timeout = self.metrics_window.retransmit_due()
+                self.udp_socket.settimeout(15 if timeout is None else max(timeout, 0.05))
 
                 # Wait for messages from the server
-                data, server = self.udp_socket.recvfrom(1024)
-                message = json.loads(data.decode())
+                message, server = self.receive_message()
+
+                if message.get("message") == "metrics_ack":
+                    if message.get("agent_id") == self.agent_id:
+                        acknowledged = self.metrics_window.acknowledge(message.get("ack"), message.get("sack", ()))
+                        if acknowledged:
+                            seq, metrics = acknowledged[-1]
+                            self.delta_encoder.acknowledged(seq, metrics if isinstance(metrics, list) else [metrics])
+                        # The server could not rebuild a delta: send whole samples until a new base is acknowledged
+                        if message.get("resync"):
+                            self.delta_encoder.resync()
+                    continue
 
                 # Ignore messages that are not tasks
                 if "task_id" not in message:
@@ -90,13 +160,16 @@ class NMS_Agent:
                 print(f"Received task: {message}")
 
                 # Send an ACK to the server
-                self.send_task_ack(message.get("task_id"), server)
+                self.send_task_ack(message.get("task_id"), server, message.get("task_hash"))
 
-                # Start collecting metrics based on the task
-                self.collect_metrics(message)
+                # Start collecting metrics based on the task, or switch the running collection to it
+                self.current_task = message
+                if self.collector_thread is None:
+                    self.collector_thread = threading.Thread(target=self.collect_metrics, daemon=True)
+                    self.collector_thread.start()
 
             except socket.timeout:
-                print("No task received within timeout period, continuing to listen...")
+                continue
             except json.JSONDecodeError:
                 print("[ERROR] Received malformed message. Ignoring and continuing to listen.")
             except Exception as e:
@@ -106,7 +179,7 @@ class NMS_Agent:
 
 ############################################################################################################################################################################################
 
-    def send_task_ack(self, task_id, address):
+    def send_task_ack(self, task_id, address, task_hash=None):
         if not task_id:
             print("[ERROR] No task ID found to send ACK.")
             return
@@ -116,22 +189,27 @@ class NMS_Agent:
             "task_id": task_id,
             "agent_id": self.agent_id
         }
+        # Tells the server which version of the task is acknowledged
+        if task_hash is not None:
+            ack_message["task_hash"] = task_hash
         self.udp_socket.sendto(json.dumps(ack_message).encode(), address)
         print(f"Sent ACK for task_id {task_id} to server.")
 
 ############################################################################################################################################################################################
 
-    def collect_metrics(self, task):
+    def collect_metrics(self):
         while True:
             try:
+                task = self.current_task
                 print(f"Collecting metrics for task ID: {task.get('task_id')}")
 
                 # Collect all metrics, including CPU and RAM usage
                 metrics = self.metric_collector.collect_all_metrics(task)
+                metrics["collected_at"] = time.time()
                 print(f"Metrics collected: {metrics}")
 
-                # Send metrics to the server
-                self.send_metrics(metrics)
+                # Send metrics to the server, never waiting for the network
+                self.send_metrics(metrics, task)
 
                 # Check for alert conditions
                 self.check_alerts(metrics, task)
@@ -145,68 +223,50 @@ class NMS_Agent:
 
 ############################################################################################################################################################################################
 
-    def send_metrics(self, metrics, max_retries=3):
-        retries = 0
-        while retries < max_retries:
-            try:
-                metrics_message = {
-                    "agent_id": self.agent_id,
-                    "metrics": metrics
-                }
-                self.udp_socket.sendto(json.dumps(metrics_message).encode(), (self.server_address, self.udp_port))
-                print(f"Metrics sent successfully (attempt {retries + 1}): {metrics_message}")
-
-                # Wait for ACK from server
-                if self.wait_for_ack_udp():
-                    print(f"Metrics ACK received successfully from server.")
-                    return  # Exit the function if ACK is received
-                else:
-                    print(f"[ERROR] Metrics ACK not received from server (attempt {retries + 1}). Retrying...")
-            except Exception as e:
-                print(f"[ERROR] Failed to send metrics (attempt {retries + 1}): {e}")
-
-            # Increment the retry counter
-            retries += 1
-
-        # If maximum retries are reached
-        print(f"[ERROR] Failed to send metrics after {max_retries} attempts. Giving up.")
-
-
+    def send_metrics(self, metrics, task):
+        """
+        Hands a sample to the send window: it is sent at once when the window has room and queued
+        otherwise. ACKs and retransmissions are handled by the receiving thread.
+        When the task asks for batches (batch_size samples and/or every batch_interval seconds),
+        samples are grouped first and each batch travels as one message with one ACK.
+        """
+        batch_size = task.get("batch_size") or 1
+        batch_interval = task.get("batch_interval")
+        if batch_size <= 1 and not batch_interval:
+            self.metrics_window.send(metrics)
+            return
 
-############################################################################################################################################################################################
+        self.pending_batch.append(metrics)
+        batch_full = batch_size > 1 and len(self.pending_batch) >= batch_size
+        batch_due = batch_interval and metrics["collected_at"] - self.pending_batch[0]["collected_at"] >= batch_interval
+        if batch_full or batch_due:
+            batch, self.pending_batch = self.pending_batch, []
+            self.metrics_window.send(batch)
 
-    def wait_for_ack_udp(self, max_retries=3):
-        retries = 0
-        while retries < max_retries:
-            try:
-                # Configura timeout para aguardar o ACK
-                self.udp_socket.settimeout(15)  
-                ack_data, _ = self.udp_socket.recvfrom(1024)
-                
-                # Decodifica a mensagem recebida
-                ack_message = json.loads(ack_data.decode())
-                
-                # Verifica se o ACK é válido
-                if ack_message.get("message") == "metrics_ack" and ack_message.get("agent_id") == self.agent_id:
-                    logging.info(f"Received valid ACK: {ack_message}")
-                    return True
-                else:
-                    logging.warning(f"Unexpected ACK content: {ack_message}")
-            except socket.timeout:
-                # Timeout ao aguardar ACK, incrementa tentativa
-                retries += 1
-                logging.error(f"No ACK received. Retry {retries}/{max_retries}")
-            except json.JSONDecodeError:
-                # Caso a mensagem seja malformada
-                logging.error("Received malformed ACK. Failed to parse JSON.")
-                return False
-            finally:
-                # Restaura timeout para estado padrão
-                self.udp_socket.settimeout(None)
-        
-        # Se todas as tentativas falharem
-        logging.error("Failed to receive ACK after maximum retries.")
-        return False
+    def transmit_metrics(self, seq, metrics):
+        try:
+            metrics_message = {
+                "agent_id": self.agent_id,
+                "seq": seq,
+                # Lets the server place every sample in time without relying on synchronized clocks
+                "sent_at": time.time()
+            }
+            samples = metrics if isinstance(metrics, list) else [metrics]
+            if self.wire_version is not None and self.wire_version >= wire_format.DELTA_VERSION:
+                base_seq, samples = self.delta_encoder.encode(seq, samples)
+                if base_seq is not None:
+                    metrics_message["base"] = base_seq
+            if self.wire_version is None or self.wire_version >= wire_format.WINDOW_VERSION:
+                metrics_message["window_start"] = self.metrics_window.window_start()
+            if isinstance(metrics, list):
+                metrics_message["batch"] = samples
+            else:
+                metrics_message["metrics"] = samples[0]
+            # Binary when negotiated at registration, JSON otherwise
+            self.send_datagrams(wire_format.encode(metrics_message, self.wire_version), (self.server_address, self.udp_port))
+            print(f"Metrics {seq} sent successfully: {metrics_message}")
+        except Exception as e:
+            print(f"[ERROR] Failed to send metrics {seq}: {e}")
 
 ############################################################################################################################################################################################
 
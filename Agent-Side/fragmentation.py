@@ -0,0 +1,144 @@
+import time
+import struct
+import itertools
+import threading
+from collections import OrderedDict
+
+# NetTask fragmentation, shared by NMS_Agent and NMS_Server.
+#
+# A payload (JSON or binary wire format) larger than MAX_DATAGRAM is split into fragments, each
+# a datagram starting with FRAGMENT_MAGIC, the message ID, the fragment index and the fragment
+# count, followed by a slice of the payload. Payloads that fit in one datagram are sent as they
+# are, so peers that predate fragmentation still understand every message that fits.
+
+FRAGMENT_MAGIC = 0xA8
+FRAGMENT_HEADER = struct.Struct("!BIHH")
+
+# Keeps datagrams below the IPv6 minimum MTU, so they are never split by IP fragmentation
+MAX_DATAGRAM = 1200
+
+# Large enough for any UDP datagram
+RECEIVE_BUFFER_SIZE = 65535
+
+class FragmentationError(ValueError):
+    pass
+
+############################################################################################################################################################################################
+
+class Fragmenter:
+    """
+    Splits payloads into datagrams of at most `max_datagram` bytes, numbering every message.
+    """
+
+    def __init__(self, max_datagram=MAX_DATAGRAM):
+        if max_datagram <= FRAGMENT_HEADER.size:
+            raise ValueError("Datagram size too small for a fragment header")
+
+        self.max_datagram = max_datagram
+        self.chunk_size = max_datagram - FRAGMENT_HEADER.size
+        self.message_ids = itertools.count(int(time.time() * 1000) & 0xFFFFFFFF)
+        self.lock = threading.Lock()
+
+    def fragment(self, payload):
+        """
+        Returns the datagrams carrying a payload: the payload itself when it fits, fragments otherwise.
+        """
+        if len(payload) <= self.max_datagram:
+            return [payload]
+
+        count = -(-len(payload) // self.chunk_size)
+        if count > 0xFFFF:
+            raise FragmentationError(f"Payload of {len(payload)} bytes needs too many fragments")
+
+        with self.lock:
+            message_id = next(self.message_ids) & 0xFFFFFFFF
+
+        view = memoryview(payload)
+        return [
+            FRAGMENT_HEADER.pack(FRAGMENT_MAGIC, message_id, index, count) + view[first:first + self.chunk_size]
+            for index, first in enumerate(range(0, len(payload), self.chunk_size))
+        ]
+
+############################################################################################################################################################################################
+
+class Reassembler:
+    """
+    Collects fragments per (sender address, message ID) until every fragment of a message has arrived.
+    Partial messages are dropped after `timeout` seconds, and at most `max_messages` partial messages
+    and `max_message_size` bytes per message are kept, so lost fragments cannot exhaust memory.
+    """
+
+    def __init__(self, timeout=5.0, max_messages=256, max_message_size=1024 * 1024):
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.max_message_size = max_message_size
+
+        # (address, message_id) -> [first_seen, count, {index: bytes}, size], oldest first
+        self.partial = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.completed = 0
+        self.expired = 0
+        self.dropped = 0
+
+    def is_fragment(self, data):
+        return len(data) > 0 and data[0] == FRAGMENT_MAGIC
+
+    def add(self, data, address):
+        """
+        Adds a fragment (bytes or a memoryview, copied as needed). Returns the whole payload once
+        the last missing fragment arrives, None otherwise.
+        """
+        if len(data) < FRAGMENT_HEADER.size:
+            self.dropped += 1
+            return None
+        _, message_id, index, count = FRAGMENT_HEADER.unpack_from(data, 0)
+        if count == 0 or index >= count:
+            self.dropped += 1
+            return None
+
+        now = time.monotonic()
+        key = (address, message_id)
+        with self.lock:
+            self.expire(now)
+
+            entry = self.partial.get(key)
+            if entry is None:
+                if len(self.partial) >= self.max_messages:
+                    self.partial.popitem(last=False)
+                    self.dropped += 1
+                entry = self.partial[key] = [now, count, {}, 0]
+            elif entry[1] != count:
+                del self.partial[key]
+                self.dropped += 1
+                return None
+
+            fragments = entry[2]
+            if index not in fragments:
+                fragments[index] = bytes(data[FRAGMENT_HEADER.size:])
+                entry[3] += len(fragments[index])
+            if entry[3] > self.max_message_size:
+                del self.partial[key]
+                self.dropped += 1
+                return None
+            if len(fragments) < count:
+                return None
+
+            del self.partial[key]
+            self.completed += 1
+        return b"".join(fragments[position] for position in range(count))
+
+    def expire(self, now):
+        """
+        Drops the partial messages older than the timeout. Must be called with the lock held.
+        """
+        while self.partial:
+            key, entry = next(iter(self.partial.items()))
+            if now - entry[0] < self.timeout:
+                break
+            del self.partial[key]
+            self.expired += 1
+
+    def stats(self):
+        with self.lock:
+            return {"reassembling": len(self.partial), "reassembled": self.completed, "expired": self.expired, "dropped": self.dropped}
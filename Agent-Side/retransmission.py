@@ -0,0 +1,85 @@
+import threading
+
+# Adaptive retransmission timeouts for NetTask handshakes, shared by NMS_Agent and NMS_Server.
+#
+# Every peer gets a smoothed RTT and RTT variance updated from the ACKs it sends back (Jacobson/
+# Karels, as in TCP), and the retransmission timeout is SRTT + 4 * RTTVAR, doubled on every retry.
+# Following Karn's algorithm, only ACKs of messages sent once are used as RTT samples.
+
+class RttEstimator:
+    """
+    Smoothed RTT, RTT variance and retransmission timeout (RTO) of one peer.
+    Until the first sample, the RTO is `initial_rto`.
+    """
+
+    ALPHA = 1 / 8  # Gain of the smoothed RTT
+    BETA = 1 / 4   # Gain of the RTT variance
+    K = 4
+
+    def __init__(self, initial_rto=1.0, min_rto=0.05, max_rto=60.0, granularity=0.01):
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.granularity = granularity
+
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.samples = 0
+        self.lock = threading.Lock()
+
+############################################################################################################################################################################################
+
+    def sample(self, rtt):
+        """
+        Updates the estimates with the round-trip time of a message that was sent only once.
+        """
+        with self.lock:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+                self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+            self.rto = min(max(self.srtt + max(self.granularity, self.K * self.rttvar), self.min_rto), self.max_rto)
+            self.samples += 1
+
+    def timeout(self, attempt=0):
+        """
+        Returns the timeout of the given attempt (0 is the first transmission), with exponential backoff.
+        """
+        return min(self.rto * 2 ** attempt, self.max_rto)
+
+############################################################################################################################################################################################
+
+    def stats(self):
+        with self.lock:
+            return {
+                "srtt_ms": None if self.srtt is None else round(self.srtt * 1000, 2),
+                "rttvar_ms": None if self.rttvar is None else round(self.rttvar * 1000, 2),
+                "rto_ms": round(self.rto * 1000, 2),
+                "samples": self.samples,
+            }
+
+############################################################################################################################################################################################
+
+class RttEstimators:
+    """
+    One RttEstimator per peer, created on first use with the given settings.
+    """
+
+    def __init__(self, **settings):
+        self.settings = settings
+        self.estimators = {}
+        self.lock = threading.Lock()
+
+    def get(self, peer):
+        with self.lock:
+            estimator = self.estimators.get(peer)
+            if estimator is None:
+                estimator = self.estimators[peer] = RttEstimator(**self.settings)
+            return estimator
+
+    def stats(self):
+        with self.lock:
+            estimators = list(self.estimators.items())
+        return {peer: estimator.stats() for peer, estimator in estimators}
@@ -0,0 +1,223 @@
+import time
+import bisect
+import threading
+from collections import OrderedDict, deque
+from retransmission import RttEstimator
+
+# Sequence-numbered metrics delivery, shared by NMS_Agent and NMS_Server.
+#
+# The agent numbers every sample and keeps up to `window` of them in flight. The server answers
+# every sample with a metrics_ack carrying the cumulative ACK (every seq <= "ack" is stored) and
+# selective ACKs ("sack", ranges of stored seqs above it), so the agent only retransmits the gaps.
+# Every sample also carries the oldest seq still in flight ("window_start"), so a server without
+# state for the agent (restarted) starts its window there and still accepts the earlier seqs.
+
+# Selective ACK ranges sent back per ACK
+MAX_SACK_RANGES = 8
+
+class SendWindow:
+    """
+    Agent side: numbers samples, keeps up to `window` unacknowledged ones in flight and queues the
+    rest in a bounded backlog, dropping the oldest queued sample when it is full, so the collector
+    never waits on the network. Samples are sent with `transmit(seq, sample)`, and retransmitted
+    after the RTO of `rtt`, which ACKs of samples sent once keep up to date.
+    """
+
+    def __init__(self, transmit, window=32, backlog=1024, rtt=None):
+        self.transmit = transmit
+        self.window = window
+        self.rtt = rtt or RttEstimator()
+
+        self.next_seq = 1
+        # seq -> [sample, sent_at, attempts], oldest first
+        self.in_flight = OrderedDict()
+        self.backlog = deque(maxlen=backlog)
+        self.lock = threading.Lock()
+
+        self.sent = 0
+        self.retransmitted = 0
+        self.dropped = 0
+
+############################################################################################################################################################################################
+
+    def send(self, sample):
+        """
+        Sends a sample right away if the window has room, otherwise queues it.
+        """
+        with self.lock:
+            if len(self.backlog) == self.backlog.maxlen:
+                self.dropped += 1
+            self.backlog.append(sample)
+            ready = self.fill()
+        self.transmit_all(ready)
+
+    def fill(self):
+        """
+        Moves queued samples into the window. Must be called with the lock held.
+        """
+        ready = []
+        now = time.monotonic()
+        while self.backlog and len(self.in_flight) < self.window:
+            seq = self.next_seq
+            self.next_seq += 1
+            sample = self.backlog.popleft()
+            self.in_flight[seq] = [sample, now, 1]
+            ready.append((seq, sample))
+        self.sent += len(ready)
+        return ready
+
+    def transmit_all(self, ready):
+        for seq, sample in ready:
+            self.transmit(seq, sample)
+
+############################################################################################################################################################################################
+
+    def acknowledge(self, ack, sack=()):
+        """
+        Handles a metrics_ack: forgets every sample covered by the cumulative or selective ACKs
+        and sends queued samples into the freed window. An ACK without a seq (servers that predate
+        sequence numbers) acknowledges the oldest sample in flight.
+        Returns the acknowledged (seq, sample) pairs, oldest first.
+        """
+        now = time.monotonic()
+        sent_at = None
+        with self.lock:
+            if ack is None:
+                acknowledged = [self.in_flight.popitem(last=False)] if self.in_flight else []
+            else:
+                acknowledged = [
+                    (seq, self.in_flight.pop(seq)) for seq in list(self.in_flight)
+                    if seq <= ack or any(first <= seq <= last for first, last in sack)
+                ]
+            # RTT sample from the newest sample that was sent only once (Karn's algorithm)
+            for _, (_, entry_sent_at, attempts) in acknowledged:
+                if attempts == 1 and (sent_at is None or entry_sent_at > sent_at):
+                    sent_at = entry_sent_at
+            ready = self.fill()
+        if sent_at is not None:
+            self.rtt.sample(now - sent_at)
+        self.transmit_all(ready)
+        return [(seq, entry[0]) for seq, entry in acknowledged]
+
+    def window_start(self):
+        """
+        Returns the oldest seq in flight, or the next seq with nothing in flight.
+        """
+        with self.lock:
+            return next(iter(self.in_flight), self.next_seq)
+
+############################################################################################################################################################################################
+
+    def retransmission_timeout(self, attempts):
+        return self.rtt.timeout(attempts - 1)
+
+    def retransmit_due(self):
+        """
+        Retransmits the in-flight samples whose timeout expired, with exponential backoff per sample.
+        Returns the number of seconds until the next timeout, or None with nothing in flight.
+        """
+        now = time.monotonic()
+        due = []
+        next_deadline = None
+        with self.lock:
+            for seq, entry in self.in_flight.items():
+                deadline = entry[1] + self.retransmission_timeout(entry[2])
+                if deadline <= now:
+                    entry[1] = now
+                    entry[2] += 1
+                    due.append((seq, entry[0]))
+                    deadline = now + self.retransmission_timeout(entry[2])
+                if next_deadline is None or deadline < next_deadline:
+                    next_deadline = deadline
+            self.retransmitted += len(due)
+        self.transmit_all(due)
+        return None if next_deadline is None else max(0.0, next_deadline - now)
+
+############################################################################################################################################################################################
+
+    def stats(self):
+        with self.lock:
+            return {
+                "next_seq": self.next_seq,
+                "in_flight": len(self.in_flight),
+                "backlog": len(self.backlog),
+                "sent": self.sent,
+                "retransmitted": self.retransmitted,
+                "dropped": self.dropped,
+                **self.rtt.stats(),
+            }
+
+############################################################################################################################################################################################
+
+class ReceiveWindow:
+    """
+    Server side: tracks which seqs of one agent were accepted (queued for storage) and which were
+    acknowledged (stored), so retransmitted duplicates are not stored twice and every ACK carries
+    the cumulative ACK plus selective ACK ranges.
+    """
+
+    def __init__(self):
+        self.cumulative = None  # Every seq <= cumulative is acknowledged
+        self.acked = []         # Sorted acknowledged seqs above cumulative
+        self.pending = set()    # Accepted seqs not acknowledged yet
+        self.lock = threading.Lock()
+
+        self.duplicates = 0
+
+############################################################################################################################################################################################
+
+    def accept(self, seq, window_start=None):
+        """
+        Returns True if the sample is new and should be stored, False for a duplicate.
+        `window_start` is the oldest seq the agent has in flight, when it sends it.
+        """
+        with self.lock:
+            if self.cumulative is None:
+                # The first sample seen sets the start of the window (the server may have restarted).
+                # Seqs sent before it may still be in flight, so the agent's window start is used when known
+                start = seq if window_start is None else min(seq, window_start)
+                self.cumulative = start - 1
+            if seq <= self.cumulative or seq in self.pending or self.is_acked(seq):
+                self.duplicates += 1
+                return False
+            self.pending.add(seq)
+            return True
+
+    def reject(self, seq):
+        """
+        Forgets an accepted sample that could not be queued, so its retransmission is accepted.
+        """
+        with self.lock:
+            self.pending.discard(seq)
+
+    def is_acked(self, seq):
+        position = bisect.bisect_left(self.acked, seq)
+        return position < len(self.acked) and self.acked[position] == seq
+
+    def acknowledge(self, seq):
+        """
+        Marks an accepted sample as stored and advances the cumulative ACK over contiguous seqs.
+        """
+        with self.lock:
+            self.pending.discard(seq)
+            if seq > self.cumulative and not self.is_acked(seq):
+                bisect.insort(self.acked, seq)
+            while self.acked and self.acked[0] == self.cumulative + 1:
+                self.cumulative = self.acked.pop(0)
+
+############################################################################################################################################################################################
+
+    def ack_message(self, agent_id):
+        """
+        Returns the metrics_ack for the current state: cumulative ACK and selective ACK ranges.
+        """
+        with self.lock:
+            ranges = []
+            for seq in self.acked:
+                if ranges and ranges[-1][1] == seq - 1:
+                    ranges[-1][1] = seq
+                elif len(ranges) < MAX_SACK_RANGES:
+                    ranges.append([seq, seq])
+                else:
+                    break
+            return {"message": "metrics_ack", "agent_id": agent_id, "ack": self.cumulative, "sack": ranges}
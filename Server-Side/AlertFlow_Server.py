@@ -4,7 +4,7 @@ import json
 import logging
 
 class AlertFlow:
-    def __init__(self, host, tcp_port, logger=None):
+    def __init__(self, host, tcp_port, logger=None, storage=None):
         self.host = host
         self.tcp_port = tcp_port
         self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -14,18 +14,27 @@ class AlertFlow:
         # Use the provided logger or the root logger
         self.logger = logger or logging.getLogger()
 
+        # Received alerts are kept in the storage's alert journal
+        self.storage = storage
+
         self.logger.info(f"AlertFlow listening on {self.tcp_port}")
 
 ############################################################################################################################################################################################
 
     def handle_connection(self, conn, addr):
         """
-        Handles an incoming TCP connection.
+        Handles an incoming TCP connection and stores the received alert.
         """
         try:
             data = conn.recv(1024)
             alert = json.loads(data.decode())
             self.logger.error(f"Received alert from {addr}: {alert}")
+
+            # Agents send {"alert": "<alert as a JSON string>"}
+            if isinstance(alert.get("alert"), str) and alert["alert"].startswith("{"):
+                alert = json.loads(alert["alert"])
+            if self.storage:
+                self.storage.store_alerts_in_file(alert.get("agent_id"), alert)
         except Exception as e:
             self.logger.error(f"Failed while handling connection from {addr}: {e}")
         finally:
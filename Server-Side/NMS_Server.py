@@ -1,6 +1,7 @@
 import threading
 import socket
-import json
+import time
+import os
 import logging
 import curses
 from NetTask_Server import NetTask
@@ -8,10 +9,17 @@ from AlertFlow_Server import AlertFlow
 from parse_json import TaskConfig
 from UI_Server import UIServer
 from storage import Storage
-from threading import Thread, Timer, Lock
+from write_behind import WriteBehindBuffer
+from sliding_window import ReceiveWindow
+from delta_encoding import DeltaDecoder
+from task_dispatch import TaskDispatcher
+from agent_registry import AgentRegistry
+import wire_format
+from threading import Thread
 
 class NMS_Server:
-    def __init__(self, udp_port, tcp_port):
+    def __init__(self, udp_port, tcp_port, durability=WriteBehindBuffer.ACK_ON_ENQUEUE, storage_backend=Storage.BACKEND_JSON, net_workers=1,
+                 registry_path="agent_registry.jsonl"):
         self.host = self.local_ip()
 
         # Initialize the logger early
@@ -19,17 +27,43 @@ class NMS_Server:
         self.configure_logging()
 
         # Pass the root logger to dependencies
-        self.net_task = NetTask(self.host, udp_port, logging.getLogger())
-        self.alert_flow = AlertFlow(self.host, tcp_port, logging.getLogger())
-        self.storage = Storage(logging.getLogger())
+        # With net_workers > 1, NetTask receives and decodes on that many SO_REUSEPORT sockets, all but one in their own process
+        self.net_task = NetTask(self.host, udp_port, logging.getLogger(), net_workers)
+        self.storage = Storage(logging.getLogger(), backend=storage_backend)
+        self.alert_flow = AlertFlow(self.host, tcp_port, logging.getLogger(), self.storage)
+
+        # Registered agents, indexed by ID and by address and kept on disk, so a restarted server
+        # keeps serving them without a new registration
+        self.agent_registry = AgentRegistry(registry_path, logger=logging.getLogger())
+
+        # Metrics are queued here and written to disk in batches by a background thread
+        self.write_buffer = WriteBehindBuffer(self.storage, durability, logger=logging.getLogger())
+
+        # Receive state of sequence-numbered metrics, bases of delta-encoded samples and time of the
+        # last stored sample, per agent
+        self.metrics_windows = {}
+        self.delta_decoders = {}
+        self.metrics_windows_lock = threading.Lock()
+        self.last_sample_times = {}
+
+        # Samples are backdated to their collection time by at most the longest batch wait plus this
+        # margin (seconds) for delivery and retransmissions, see set_max_backdate()
+        self.backdate_margin = 10.0
+        self.max_backdate = self.backdate_margin
+        self.storage.compactor.max_backdate = self.max_backdate
 
         self.task_config = None
         self.task_path = None
 
-        # Timer and lock for task dispatch
-        self.task_timer = None
-        self.task_delay = 10
-        self.timer_lock = threading.Lock()
+        # The task configuration file is checked for changes this often (seconds) and reloaded
+        self.config_poll_interval = 1.0
+        self.task_file_state = None
+
+        # Agents whose task delivery failed (every retransmission lost) get it again this often (seconds)
+        self.task_retry_interval = 30.0
+
+        # Delivers tasks and matches their ACKs on the NetTask event loop, whatever the number of agents
+        self.task_dispatcher = TaskDispatcher(self.net_task, logging.getLogger())
 
         self.server_thread = None
         self.ui = UIServer(self)
@@ -52,6 +86,8 @@ class NMS_Server:
         server_ip = socket.gethostbyname(self.host)
         logging.info(f"Starting NMS_Server on IP: {server_ip}")
         threading.Thread(target=self.alert_flow.start).start()
+        self.write_buffer.start()
+        self.storage.compactor.start()
 
         try:
             #Start the server thread
@@ -72,40 +108,62 @@ class NMS_Server:
 
         # Ensure task_config is loaded after UI provides it
         if self.task_path:
+            self.task_file_state = self.file_state(self.task_path)
             self.task_config = self.load_task_config(self.task_path)
             logging.info(f"Task configuration loaded")
             if not self.task_config:
                 logging.error("Failed to load Task configuration")
+            else:
+                self.set_max_backdate(self.task_config)
 
         # Start AlertFlow in a separate thread
         #Thread(target=self.alert_flow.start, daemon=True).start()
 
-        # Main loop for UDP (NetTask) communication
-        while True:
-            try:
-                message, addr = self.net_task.receive_message()
-                logging.info(f"Received message from {addr}: {message}")
-                if message:
-                    self.process_message(message, addr)
-            except Exception as e:
-                logging.error(f"Failed to process message: {e}")
+        # Event loop for UDP (NetTask) communication, every message is handled by process_message
+        self.net_task.serve(self.process_message, self.on_loop_start)
 
 ############################################################################################################################################################################################
 
     def stop(self):
         self.net_task.close()
         self.alert_flow.close()
+        self.write_buffer.close()
+        self.storage.close()
+        self.agent_registry.close()
         logging.info("NMS_Server stopped")
 
+############################################################################################################################################################################################
+
+    def on_loop_start(self):
+        self.resume_agents()
+        if self.task_path:
+            self.net_task.loop.call_later(self.config_poll_interval, self.watch_task_config)
+        self.net_task.loop.call_later(self.task_retry_interval, self.retry_tasks)
+
+    def resume_agents(self):
+        """
+        Runs once the event loop starts: agents reloaded from the registry are served as registered,
+        and those whose task is missing or out of date get the current one right away.
+        """
+        agents = self.agent_registry.registered()
+        if agents:
+            logging.info(f"Resuming {len(agents)} registered agents from the agent registry.")
+            if self.task_config:
+                self.net_task.spawn(self.send_task_to_agents())
+
 ############################################################################################################################################################################################
 
     def process_message(self, message, addr):
+        """
+        Handles a message on the NetTask event loop. Handshakes run as their own coroutines,
+        so nothing here waits on an agent.
+        """
+        logging.info(f"Received message from {addr}: {message}")
         try:
             message_type = message.get("message")
             if message_type == "register":
-                self.register_agent(message, addr)
-                self.schedule_task_dispatch()
-            elif "metrics" in message:
+                self.net_task.spawn(self.register_agent(message, addr))
+            elif "metrics" in message or "batch" in message:
                 self.process_metrics(message, addr)
             elif message_type == "task_ack":
                 self.process_task_ack(message)
@@ -116,175 +174,252 @@ class NMS_Server:
 
 ############################################################################################################################################################################################
 
-    def schedule_task_dispatch(self):
-        with self.timer_lock:
-            if self.task_timer:
-                self.task_timer.cancel()
-            if self.task_config:
-                self.task_timer = Timer(self.task_delay, self.send_task_to_agents)
-                self.task_timer.start()
-
-############################################################################################################################################################################################
-
-    def register_agent(self, message, addr, max_retries=3, wait_time=5):
+    async def register_agent(self, message, addr, max_retries=5):
         """
-        Registers an agent and waits for acknowledgment (ACK).
+        Registers an agent and waits for acknowledgment (ACK) without blocking other agents.
         Cancels registration if no ACK is received within the timeout.
-        Ignores subsequent registration packets from the same agent.
+        A register message from an agent whose handshake is running only gets the reply again, and one
+        from a registered agent (restarted) starts a new handshake under the same ID.
         """
-        with self.timer_lock:
-            # Check if the agent is already registered
-            for agent_id, agent_addr in self.net_task.registered_agents.items():
-                if agent_addr == addr:
-                    logging.info(f"Agent already registered with ID {agent_id} at {addr}. Ignoring subsequent registration.")
-                    return  # Ignore the registration packet
-
-            # Assign a new agent ID
-            agent_id = str(len(self.net_task.registered_agents) + 1)
-            self.net_task.registered_agents[agent_id] = addr
-
-            # Create a dedicated ACK socket
-            ack_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            ack_port = self.net_task.udp_port + 2  # Use a different port offset for ACK
-            ack_socket.bind((self.net_task.host, ack_port))
-            ack_socket.settimeout(wait_time)
-            logging.info(f"Dedicated ACK socket created for registration, listening on port {ack_port}")
-
-            # Send registration message and wait for ACK
-            ack_received = False
-            for attempt in range(max_retries):
-                registration_message = {"status": "registered", "agent_id": agent_id}
-                try:
-                    ack_socket.sendto(json.dumps(registration_message).encode(), addr)
-                    logging.info(f"Sent registration message to agent {agent_id} at {addr} (Attempt {attempt + 1})")
-
-                    # Wait for ACK
-                    try:
-                        data, recv_addr = ack_socket.recvfrom(1024)
-                        ack_message = json.loads(data.decode())
-
-                        if (
-                            ack_message.get("message") == "registration_ack" and
-                            ack_message.get("agent_id") == agent_id and
-                            recv_addr == addr
-                        ):
-                            logging.info(f"Received ACK from agent {agent_id}. Registration confirmed.")
-                            ack_received = True
-                            break
-                        else:
-                            logging.warning(f"Unexpected ACK message: {ack_message} or address mismatch.")
-                    except socket.timeout:
-                        logging.warning(f"No ACK received from agent {agent_id}. Retrying...")
-                except Exception as e:
-                    logging.error(f"Error while sending registration message or waiting for ACK: {e}")
+        agent_id, state = self.agent_registry.begin(addr)
 
-            # Handle failed registration
-            if not ack_received:
-                logging.error(f"Failed to receive ACK from agent {agent_id}. Canceling registration.")
-                del self.net_task.registered_agents[agent_id]
-
-            # Close the ACK socket
-            ack_socket.close()
-            logging.info(f"Dedicated ACK socket for registration closed.")
+        # Agents offering the binary wire format get the highest version both sides support, others keep JSON
+        wire_version = wire_format.negotiate(message.get("wire_versions"))
+        registration_message = {"status": "registered", "agent_id": agent_id, "wire_version": wire_version}
 
+        if state == AgentRegistry.PENDING:
+            # The agent missed the reply: answer at once instead of waiting for the retransmission timeout
+            logging.info(f"Registration of agent {agent_id} at {addr} already in progress, sending the reply again.")
+            self.net_task.send_message(registration_message, addr)
+            return
+        if state == AgentRegistry.REGISTERED:
+            logging.info(f"Agent {agent_id} at {addr} registered again, restarting its registration.")
+            self.reset_metrics_session(agent_id)
+
+        # Send registration message and wait for ACK
+        if await self.net_task.send_with_retransmission(registration_message, addr, "registration_ack", agent_id, max_retries):
+            logging.info(f"Received ACK from agent {agent_id}. Registration confirmed (wire format: {f'binary v{wire_version}' if wire_version else 'JSON'}).")
+            self.agent_registry.confirm(agent_id)
+            # Only the new agent gets the task, right away
+            await self.send_task_to_agents([agent_id])
+        else:
+            # Handle failed registration
+            logging.error(f"Failed to receive ACK from agent {agent_id}. Canceling registration.")
+            self.agent_registry.cancel(agent_id)
 
 ############################################################################################################################################################################################
 
-    def send_task_to_agents(self, max_retries=3, wait_time=5):
+    async def send_task_to_agents(self, agent_ids=None):
         """
-        Sends tasks to registered agents in parallel threads.
-        Each thread waits for acknowledgment (ACK) and handles retransmissions.
+        Sends tasks to the given registered agents (all of them by default) concurrently, skipping the
+        agents that already acknowledged the same task (same content hash), so only new or outdated
+        agents get a packet. The task dispatcher handles every agent's ACK and retransmissions.
         """
         if not self.task_config:
             logging.error("Failed to load Task configuration. Cannot send tasks.")
             return
 
-        # Create the dedicated ACK socket
-        ack_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        ack_port = self.net_task.udp_port + 1  # Use a port offset for ACK
-        ack_socket.bind((self.net_task.host, ack_port))
-        ack_socket.settimeout(wait_time)
-        logging.info(f"ACK socket created and listening on port {ack_port}")
-
-        def send_task_to_agent(agent_id, agent_address, task_data):
-            retries = 0
-            ack_received = False
-
-            while retries < max_retries and not ack_received:
-                # Send the task to the agent´
-                ack_socket.sendto(json.dumps(task_data).encode(),agent_address)
-                #self.net_task.send_message(task_data, agent_address, agent_id=agent_id)
-                logging.info(f"Sent task to agent {agent_id} with address {agent_address} (Attempt {retries + 1})")
-
-                try:
-                    # Wait for a response for a fixed amount of time
-                    data, addr = ack_socket.recvfrom(1024)
-                    message = json.loads(data.decode())
-
-                    # Check if the message is an ACK
-                    if message.get("message") == "task_ack" and message.get("task_id") == task_data["task_id"]:
-                        logging.info(f"Received ACK for task {task_data['task_id']} from agent {agent_id}.")
-                        ack_received = True
-                        break
-                    else:
-                        logging.warning(f"Received unexpected message: {message} from agent {agent_id}. Retrying...")
-                except socket.timeout:
-                    logging.warning(f"No ACK received from agent {agent_id} for task {task_data['task_id']}. Retrying...")
-                    retries += 1
-                except Exception as e:
-                    logging.error(f"Error while waiting for ACK: {e}")
-                    retries += 1
-
-            if not ack_received:
-                logging.error(f"Failed to receive ACK from agent {agent_id} after {max_retries} retries.")
-
-        # Prepare task data for each agent
-        threads = []
-        for agent_id, agent_address in self.net_task.registered_agents.items():
-            # Find the matching device in the task configuration
-            device = next((d for d in self.task_config.devices if d.device_id == agent_id), None)
-            if device:
-                task_data = {
-                    "task_id": self.task_config.task_id,
-                    "frequency": self.task_config.frequency,
-                    "device_id": device.device_id,
-                    "device_metrics": vars(device.device_metrics),
-                    "link_metrics": vars(device.link_metrics),
-                    "alertflow_conditions": vars(device.alertflow_conditions),
-                }
-                # Start a thread to handle task transmission for each agent
-                thread = threading.Thread(target=send_task_to_agent, args=(agent_id, agent_address, task_data), daemon=True)
-                thread.start()
-                threads.append(thread)
+        agents = self.agent_registry.registered()
+        if agent_ids is not None:
+            agents = {agent_id: agents[agent_id] for agent_id in agent_ids if agent_id in agents}
+
+        # Look up the ready-made task of each agent's device
+        tasks = []
+        for agent_id, agent_address in agents.items():
+            task = self.task_config.task(agent_id)
+            if task:
+                payload, task_hash = task
+                if self.agent_registry.task_hash(agent_id) == task_hash:
+                    continue
+                tasks.append((agent_id, agent_address, self.task_config.task_id, payload, task_hash))
             else:
                 logging.warning(f"No matching device found in task configuration for agent {agent_id}.")
 
-        # Wait for all threads to finish
-        for thread in threads:
-            thread.join()
+        # Wait for all deliveries to finish
+        if not tasks:
+            return
+        results = await self.task_dispatcher.dispatch(tasks)
+        for (agent_id, _, _, _, task_hash), acknowledged in zip(tasks, results):
+            if acknowledged:
+                self.agent_registry.assign_task(agent_id, task_hash)
+        logging.info(f"Tasks acknowledged by {sum(results)} of {len(results)} agents.")
 
-        # Close the ACK socket after all tasks are processed
-        ack_socket.close()
-        logging.info("ACK socket closed.")
+    def retry_tasks(self):
+        """
+        Runs on the event loop every `task_retry_interval` seconds and sends the current task again to
+        the registered agents that have not acknowledged it, such as those whose delivery ran out of retries.
+        """
+        try:
+            if self.task_config:
+                self.net_task.spawn(self.send_task_to_agents())
+        finally:
+            self.net_task.loop.call_later(self.task_retry_interval, self.retry_tasks)
+
+############################################################################################################################################################################################
+
+    def file_state(self, file_path):
+        try:
+            stat = os.stat(file_path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def watch_task_config(self):
+        """
+        Runs on the event loop every `config_poll_interval` seconds and reloads the task
+        configuration when its file changed.
+        """
+        try:
+            state = self.file_state(self.task_path)
+            if state is not None and state != self.task_file_state:
+                self.task_file_state = state
+                self.reload_task_config()
+        except Exception as e:
+            logging.error(f"Failed to reload Task configuration: {e}")
+        finally:
+            self.net_task.loop.call_later(self.config_poll_interval, self.watch_task_config)
+
+    def reload_task_config(self):
+        """
+        Parses the changed task configuration, compares the task of every device with the current
+        one and sends the new task only to the agents whose task changed. A configuration that
+        fails to parse is ignored and the current one is kept.
+        """
+        task_config = self.load_task_config(self.task_path)
+        if not task_config:
+            logging.error("Changed Task configuration could not be loaded, keeping the current one.")
+            return
+
+        old_hashes = {}
+        if self.task_config:
+            old_hashes = {device_id: task_hash for device_id, (_, task_hash) in self.task_config.tasks.items()}
+        new_hashes = {device_id: task_hash for device_id, (_, task_hash) in task_config.tasks.items()}
+
+        changed = [device_id for device_id, task_hash in new_hashes.items() if old_hashes.get(device_id) != task_hash]
+        removed = [device_id for device_id in old_hashes if device_id not in new_hashes]
+        self.task_config = task_config
+        self.set_max_backdate(task_config)
+        logging.info(f"Task configuration reloaded: {len(changed)} device(s) changed or added, {len(removed)} removed.")
+        for device_id in removed:
+            logging.warning(f"Device {device_id} was removed from the task configuration, its agent keeps its current task.")
+
+        if changed:
+            self.net_task.spawn(self.send_task_to_agents(changed))
 
 ############################################################################################################################################################################################
 
     def process_metrics(self, message, addr):
         agent_id = message.get("agent_id")
         metrics = message.get("metrics")
-        if agent_id and metrics:
-            logging.info(f"Received metrics from agent {agent_id}: {metrics}")
-
-            # Store metrics using Storage
-            self.storage.store_metrics_in_file(agent_id, metrics)
-
-            # Send acknowledgment for metrics
-            ack = {"message": "metrics_ack", "agent_id": agent_id}
-            self.net_task.send_message(ack, addr)
-            logging.info(f"Sent metrics ACK to agent {agent_id}")
+        samples = message.get("batch") or ([metrics] if metrics is not None else None)
+        seq = message.get("seq")
+        if agent_id and samples:
+            logging.info(f"Received {len(samples)} metrics sample(s) from agent {agent_id}: {samples}")
+            self.agent_registry.touch(agent_id)
+
+            # Sequence-numbered samples are stored once: duplicates only get the current ACK back
+            window = None
+            if seq is not None:
+                window = self.get_metrics_window(agent_id)
+                if not window.accept(seq, message.get("window_start")):
+                    logging.info(f"Duplicate metrics {seq} from agent {agent_id}, sending current ACK.")
+                    self.net_task.send_message(window.ack_message(agent_id), addr)
+                    return
+
+                # Rebuild whole samples from delta encoding. Without the base (lost keyframe, server
+                # restart) the message is dropped and the agent asked to resync with whole samples
+                samples = self.get_delta_decoder(agent_id).decode(seq, message.get("base"), samples)
+                if samples is None:
+                    logging.warning(f"Unknown base {message.get('base')} for metrics {seq} from agent {agent_id}, asking for a resync.")
+                    window.reject(seq)
+                    self.net_task.send_message({**window.ack_message(agent_id), "resync": True}, addr)
+                    return
+
+            # Stamp every sample with the server time it was collected at
+            self.stamp_samples(agent_id, samples, message.get("sent_at"))
+
+            # Queue metrics for the write-behind flusher, which decides when the ACK is sent.
+            # Without room in the queue the sample is not acknowledged and the agent retransmits it
+            def send_ack():
+                # Only accepted samples go to the in-memory view and move the agent's last sample
+                # time, so a rejected and retransmitted batch is not counted twice
+                with self.metrics_windows_lock:
+                    self.last_sample_times[agent_id] = max(self.last_sample_times.get(agent_id, 0.0), samples[-1]["timestamp"])
+                for sample in samples:
+                    self.storage.store_metrics(agent_id, sample)
+
+                if window is None:
+                    ack = {"message": "metrics_ack", "agent_id": agent_id}
+                else:
+                    window.acknowledge(seq)
+                    ack = window.ack_message(agent_id)
+                self.net_task.send_message(ack, addr)
+                logging.info(f"Sent metrics ACK to agent {agent_id}")
+
+            def reject():
+                # The seq was not stored, so its retransmission must not be taken for a duplicate
+                logging.warning(f"Metrics from agent {agent_id} not stored, skipping ACK.")
+                if window is not None:
+                    window.reject(seq)
+
+            # A batch is queued, stored and acknowledged as a whole
+            if not self.write_buffer.submit_batch(agent_id, samples, send_ack, reject):
+                reject()
         else:
             logging.warning(f"Invalid metrics message: {message}")
 
+    def stamp_samples(self, agent_id, samples, sent_at):
+        """
+        Sets the timestamp of every sample to the server receive time, minus how long before sending
+        the agent collected it (both read on the agent's clock, so clock skew between the agent and
+        the server does not matter). Timestamps never go back past the last accepted sample, so stored
+        samples stay in time order, and never go further back than `max_backdate`, so they never land
+        in an already rolled-up bucket.
+        """
+        received_at = time.time()
+        with self.metrics_windows_lock:
+            last = self.last_sample_times.get(agent_id, 0.0)
+        for sample in samples:
+            collected_at = sample.pop("collected_at", None)
+            if sent_at is not None and collected_at is not None:
+                timestamp = received_at - min(max(0.0, sent_at - collected_at), self.max_backdate)
+            else:
+                timestamp = received_at
+            last = sample["timestamp"] = max(timestamp, last)
+
+    def set_max_backdate(self, task_config):
+        """
+        Bounds how far back samples are stamped from the batching of the task configuration, and has
+        the compactor wait as long before rolling up a bucket. Samples delayed longer than that (kept
+        in an agent's backlog, or retransmitted many times) are stamped `max_backdate` before receipt.
+        """
+        self.max_backdate = task_config.batch_span() + self.backdate_margin
+        self.storage.compactor.max_backdate = self.max_backdate
+
+    def reset_metrics_session(self, agent_id):
+        """
+        Forgets the receive window and the delta bases of an agent that restarted: its seqs start
+        again from 1, and the old window would take them for duplicates of samples already stored.
+        The last sample time is kept, so the agent's new samples are still stored after its old ones.
+        """
+        with self.metrics_windows_lock:
+            self.metrics_windows.pop(agent_id, None)
+            self.delta_decoders.pop(agent_id, None)
+
+    def get_metrics_window(self, agent_id):
+        with self.metrics_windows_lock:
+            window = self.metrics_windows.get(agent_id)
+            if window is None:
+                window = self.metrics_windows[agent_id] = ReceiveWindow()
+            return window
+
+    def get_delta_decoder(self, agent_id):
+        with self.metrics_windows_lock:
+            decoder = self.delta_decoders.get(agent_id)
+            if decoder is None:
+                decoder = self.delta_decoders[agent_id] = DeltaDecoder()
+            return decoder
+
 ############################################################################################################################################################################################
 
     def process_task_ack(self, message):
@@ -292,6 +427,8 @@ class NMS_Server:
         task_id = message.get("task_id")
         if agent_id and task_id:
             logging.info(f"Received ACK for task {task_id} from agent {agent_id}.")
+            self.agent_registry.touch(agent_id)
+            self.task_dispatcher.acknowledge(agent_id, task_id, message.get("task_hash"))
         else:
             logging.warning(f"Invalid task ACK message: {message}")
 
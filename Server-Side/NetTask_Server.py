@@ -1,80 +1,454 @@
 import socket
 import json
+import asyncio
 import logging
+import multiprocessing
+import wire_format
+from buffer_pool import BufferPool
+from fragmentation import Fragmenter, Reassembler
+from retransmission import RttEstimators
+
+def open_udp_socket(host, port, reuse_port=False):
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if reuse_port:
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    udp_socket.bind((host, port))
+    return udp_socket
+
+def decode_datagram(reassembler, data, addr):
+    """
+    Returns the message of a datagram, or None while the other fragments of its message are missing.
+    Raises when the datagram cannot be decoded.
+    """
+    if reassembler.is_fragment(data):
+        data = reassembler.add(data, addr)
+        if data is None:
+            return None
+
+    # Binary datagrams are decoded straight from the buffer, JSON ones copied once into the str the parser needs
+    return wire_format.decode(data)
+
+############################################################################################################################################################################################
+
+class NetTaskWorker:
+    """
+    The main UDP socket on the NetTask port, served by its own asyncio event loop.
+    Every datagram is handled as soon as it arrives: ACKs complete the handshake waiting for them
+    (registrations, tasks) and every other message goes to the handler, so a slow or silent
+    agent never holds up the messages of the others.
+    Datagrams are received with recvfrom_into into pooled buffers, one per wakeup, and decoded from a memoryview.
+    """
+
+    # Datagrams read per wakeup before yielding to timers and other callbacks
+    MAX_READS = 64
+
+    def __init__(self, net_task, udp_socket, buffers):
+        self.net_task = net_task
+        self.udp_socket = udp_socket
+        self.buffers = buffers
+        self.logger = net_task.logger
+
+        # Fragments of messages larger than one datagram, reassembled per sender
+        self.reassembler = Reassembler()
+
+        self.loop = None
+
+        # Handshakes waiting for an ACK: (ack type, agent_id, task_id, address) -> future
+        self.pending_acks = {}
+
+        self.datagrams = 0
+        self.bytes = 0
+        self.errors = 0
+
+############################################################################################################################################################################################
+
+    def run(self, on_start=None):
+        """
+        Runs the event loop in the calling thread until the NetTask is closed.
+        `on_start` is called on the loop once it is running.
+        """
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.loop.add_reader(self.udp_socket.fileno(), self.read_datagrams)
+        for ingest_process in self.net_task.ingest_processes:
+            self.loop.add_reader(ingest_process.fileno, ingest_process.read_batches)
+        if on_start is not None:
+            self.loop.call_soon(on_start)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+############################################################################################################################################################################################
+
+    def read_datagrams(self):
+        """
+        Reads the queued datagrams into a pooled buffer and handles them one at a time.
+        """
+        pair = self.buffers.acquire()
+        buffer, view = pair
+        try:
+            for _ in range(self.MAX_READS):
+                try:
+                    size, addr = self.udp_socket.recvfrom_into(buffer)
+                except (BlockingIOError, InterruptedError):
+                    return
+                except OSError as e:
+                    self.errors += 1
+                    self.logger.error(f"Failed to receive UDP message: {e}")
+                    return
+                self.datagram_received(view[:size], addr)
+        finally:
+            self.buffers.release(pair)
+
+    def datagram_received(self, data, addr):
+        self.datagrams += 1
+        self.bytes += len(data)
+
+        try:
+            message = decode_datagram(self.reassembler, data, addr)
+        except Exception as e:
+            self.errors += 1
+            self.logger.error(f"Failed to receive UDP message: {e}")
+            return
+        if message is not None:
+            self.message_received(message, addr)
+
+    def message_received(self, message, addr):
+        """
+        Handles a decoded message, received on this socket or forwarded by an ingest process.
+        """
+        # ACKs complete the handshake waiting for them
+        waiter = self.pending_acks.get(self.net_task.ack_key(message, addr))
+        if waiter is not None:
+            if not waiter.done():
+                waiter.set_result(message)
+            return
+
+        try:
+            self.net_task.handler(message, addr)
+        except Exception as e:
+            self.errors += 1
+            self.logger.error(f"Failed to process message: {e}")
+
+############################################################################################################################################################################################
+
+    def send(self, data, address):
+        """
+        Sends a datagram from the socket. Safe to call from any thread.
+        """
+        self.udp_socket.sendto(data, address)
+
+############################################################################################################################################################################################
+
+    async def send_with_retransmission(self, message, address, ack_message_type, agent_id, retries):
+        key = (ack_message_type, str(agent_id), message.get("task_id"), address)
+        # A handshake already in progress for the same ACK is shared rather than replaced
+        waiter = self.pending_acks.setdefault(key, self.loop.create_future())
+        rtt = self.net_task.rtt.get(address)
+
+        try:
+            for attempt in range(retries):
+                sent_at = self.loop.time()
+                self.net_task.send_message(message, address)
+                self.logger.info(f"Sent message to {address}, waiting for ACK ({ack_message_type}) (Attempt {attempt + 1}).")
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter), rtt.timeout(attempt))
+                    self.logger.info(f"Received ACK for {ack_message_type} from agent {agent_id}")
+                    # Karn's algorithm: the ACK of a retransmitted message could answer any of the copies
+                    if attempt == 0:
+                        rtt.sample(self.loop.time() - sent_at)
+                    return True
+                except asyncio.TimeoutError:
+                    self.logger.warning(f"No ACK received for {ack_message_type} from agent {agent_id}, retrying ({attempt + 1}/{retries})...")
+        finally:
+            if self.pending_acks.get(key) is waiter:
+                del self.pending_acks[key]
+
+        self.logger.error(f"Failed to receive ACK for {ack_message_type} from agent {agent_id} after {retries} attempts")
+        return False
+
+############################################################################################################################################################################################
+
+    def stats(self):
+        return {
+            "worker": 0,
+            "datagrams": self.datagrams,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "pending_acks": len(self.pending_acks),
+            **self.buffers.stats(),
+            **self.reassembler.stats(),
+        }
+
+    def shutdown(self):
+        self.loop.remove_reader(self.udp_socket.fileno())
+        for ingest_process in self.net_task.ingest_processes:
+            self.loop.remove_reader(ingest_process.fileno)
+        self.udp_socket.close()
+        self.loop.stop()
+
+    def close(self):
+        if self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.shutdown)
+        else:
+            self.udp_socket.close()
+
+############################################################################################################################################################################################
+
+def run_ingest_process(host, port, connection, buffers, buffer_size):
+    """
+    Body of an ingest process: binds another SO_REUSEPORT socket on the NetTask port, then receives,
+    reassembles and decodes datagrams, and sends them over `connection` in batches of
+    (counters, [(message, addr)], [error]), one batch per wakeup.
+    The first batch, sent once the socket is bound, has no messages.
+    """
+    try:
+        udp_socket = open_udp_socket(host, port, reuse_port=True)
+    except OSError as e:
+        connection.send((None, [], [f"Failed to bind port {port}: {e}"]))
+        return
+
+    buffers = BufferPool(buffers, buffer_size)
+    reassembler = Reassembler()
+    counters = {"datagrams": 0, "bytes": 0, "errors": 0}
+
+    try:
+        connection.send(({**counters, **buffers.stats(), **reassembler.stats()}, [], []))
+        buffer, view = buffers.acquire()
+        while True:
+            messages = []
+            errors = []
+            # Block for the first datagram, then take whatever else is queued
+            flags = 0
+            for _ in range(NetTaskWorker.MAX_READS):
+                try:
+                    size, addr = udp_socket.recvfrom_into(buffer, 0, flags)
+                except BlockingIOError:
+                    break
+                flags = socket.MSG_DONTWAIT
+                counters["datagrams"] += 1
+                counters["bytes"] += size
+                try:
+                    message = decode_datagram(reassembler, view[:size], addr)
+                except Exception as e:
+                    counters["errors"] += 1
+                    errors.append(str(e))
+                    continue
+                if message is not None:
+                    messages.append((message, addr))
+            connection.send(({**counters, **buffers.stats(), **reassembler.stats()}, messages, errors))
+    except (KeyboardInterrupt, OSError, EOFError):
+        # Interrupted with the server, or the server is gone
+        pass
+    finally:
+        udp_socket.close()
+
+class IngestProcess:
+    """
+    An extra SO_REUSEPORT socket on the NetTask port, read by its own process so receiving and decoding
+    run on another core. The kernel keeps every agent address on the same socket, so fragments are
+    reassembled where they arrive. Decoded messages are forwarded to the main loop, which handles them
+    like its own: the registry, receive windows and storage stay in the main process.
+    """
+
+    # Seconds to wait for the process to bind its socket
+    START_TIMEOUT = 10
+
+    def __init__(self, net_task, index, buffers, buffer_size):
+        self.net_task = net_task
+        self.index = index
+        self.logger = net_task.logger
+
+        context = multiprocessing.get_context("spawn")
+        self.connection, self.child_connection = context.Pipe(duplex=False)
+        self.fileno = self.connection.fileno()
+        self.process = context.Process(
+            target=run_ingest_process, args=(net_task.host, net_task.udp_port, self.child_connection, buffers, buffer_size), daemon=True
+        )
+
+        self.counters = {}
+        self.batches = 0
+        self.closed = False
+
+############################################################################################################################################################################################
+
+    def start(self):
+        """
+        Starts the process and waits until its socket is bound.
+        Returns False if it could not bind it in time.
+        """
+        self.process.start()
+        self.child_connection.close()
+        if not self.connection.poll(self.START_TIMEOUT):
+            self.logger.error(f"NetTask worker {self.index} did not start in {self.START_TIMEOUT}s.")
+            return False
+        counters, _, errors = self.connection.recv()
+        for error in errors:
+            self.logger.error(f"NetTask worker {self.index}: {error}")
+        self.counters = counters or {}
+        return counters is not None
+
+    def read_batches(self):
+        """
+        Hands the messages of the batches waiting in the pipe to the main worker.
+        """
+        worker = self.net_task.worker
+        try:
+            for _ in range(NetTaskWorker.MAX_READS):
+                if not self.connection.poll():
+                    return
+                self.counters, messages, errors = self.connection.recv()
+                self.batches += 1
+                for error in errors:
+                    self.logger.error(f"Failed to receive UDP message on worker {self.index}: {error}")
+                for message, addr in messages:
+                    worker.message_received(message, addr)
+        except (EOFError, OSError) as e:
+            worker.loop.remove_reader(self.fileno)
+            if not self.closed:
+                self.logger.error(f"NetTask worker {self.index} stopped: {e!r}")
+
+############################################################################################################################################################################################
+
+    def stats(self):
+        return {
+            "worker": self.index,
+            "pid": self.process.pid,
+            "alive": self.process.is_alive(),
+            "batches": self.batches,
+            **self.counters,
+        }
+
+    def close(self):
+        self.closed = True
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(1)
+        self.connection.close()
+
+############################################################################################################################################################################################
 
 class NetTask:
-    def __init__(self, host, udp_port, logger=None):
+    """
+    NetTask over UDP. The main socket is read by one event loop in the thread calling serve(), which
+    also runs the server's coroutines (registrations, task dispatch) and handles every message.
+    With `workers` > 1, `workers` - 1 ingest processes bind SO_REUSEPORT sockets to the same port, and
+    the kernel spreads the agents across all the sockets by flow hash; the processes only receive and
+    decode, and every reply is sent from the main socket.
+    """
+
+    def __init__(self, host, udp_port, logger=None, workers=1, buffers=8, buffer_size=65535):
         self.host = host
-        self.udp_port = udp_port
-        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.udp_socket.bind((self.host, self.udp_port))
-        
+
         # Use the provided logger or the root logger
         self.logger = logger or logging.getLogger()
 
-        self.logger.info(f"NetTask listening on {self.udp_port}")
+        if workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+            self.logger.warning("SO_REUSEPORT is not available on this platform, using a single NetTask worker.")
+            workers = 1
+
+        udp_socket = open_udp_socket(host, udp_port, reuse_port=workers > 1)
+        udp_socket.setblocking(False)
+        self.worker = NetTaskWorker(self, udp_socket, BufferPool(buffers, buffer_size))
+        self.udp_socket = self.worker.udp_socket
+
+        # The ingest processes bind the actual port, even when an ephemeral one (0) was asked for
+        self.udp_port = self.udp_socket.getsockname()[1]
+        self.ingest_processes = [IngestProcess(self, index, buffers, buffer_size) for index in range(1, workers)]
+
+        self.logger.info(f"NetTask listening on {self.udp_port} with {workers} worker(s)")
+
+        self.handler = None
+
+        # Messages larger than one datagram (tasks with many devices) are sent in fragments
+        self.fragmenter = Fragmenter()
 
-        self.registered_agents = {}
+        # Smoothed RTT and retransmission timeout per agent address, used by every handshake
+        self.rtt = RttEstimators()
 
-    def receive_message(self, timeout=None):
+############################################################################################################################################################################################
+
+    @property
+    def loop(self):
+        return self.worker.loop
+
+    def serve(self, handler, on_start=None):
         """
-        Receives a message over UDP with optional timeout.
-        
-        :param timeout: Timeout in seconds (None means no timeout).
-        :return: message and address if received, otherwise (None, None).
+        Starts the ingest processes, then runs the event loop in the calling thread until close() is called.
+        `handler(message, addr)` is called on the loop for every message that is not an
+        awaited ACK, whichever socket received it, so it must not block.
+        `on_start()` is called on the loop once it is running.
+        """
+        self.handler = handler
+        for ingest_process in list(self.ingest_processes):
+            if not ingest_process.start():
+                ingest_process.close()
+                self.ingest_processes.remove(ingest_process)
+        self.worker.run(on_start)
+
+    def spawn(self, coroutine):
+        """
+        Schedules a coroutine on the main event loop. Safe to call from any thread.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+############################################################################################################################################################################################
+
+    def ack_key(self, message, address):
+        return (message.get("message"), str(message.get("agent_id")), message.get("task_id"), address)
+
+############################################################################################################################################################################################
+
+    def send_message(self, message, address, agent_id=None):
+        """
+        Sends a message over UDP. Safe to call from any thread.
         """
         try:
-            if timeout is not None:
-                self.udp_socket.settimeout(timeout)  # Set timeout for receiving the message
-
-            data, addr = self.udp_socket.recvfrom(1024)
-            message = json.loads(data.decode())
-            return message, addr
-        except socket.timeout:
-            self.logger.warning(f"Timeout reached while waiting for a message.")
-            return None, None
+            payload = json.dumps(message).encode()
         except Exception as e:
-            self.logger.error(f"Failed to receive UDP message: {e}")
-            return None, None
+            self.logger.error(f"Failed to send UDP message to {address}: {e}")
+            return
+        self.send_payload(payload, address)
 
-    def send_message(self, message, address, agent_id=None):
+    def send_payload(self, payload, address):
         """
-        Sends a message over UDP.
+        Sends an already serialized message, in fragments if needed. Safe to call from any thread.
         """
         try:
-            self.udp_socket.sendto(json.dumps(message).encode(), address)
+            for datagram in self.fragmenter.fragment(payload):
+                self.worker.send(datagram, address)
             self.logger.info(f"Message sent to {address}")
         except Exception as e:
             self.logger.error(f"Failed to send UDP message to {address}: {e}")
 
-    def send_with_retransmission(self, message, address, ack_message_type, retries=3, timeout=5):
-        """
-        Sends a message with retransmission if no ACK is received.
-        """
-        for attempt in range(retries):
-            try:
-                self.send_message(message, address)
-                self.logger.info(f"Sent message to {address}, waiting for ACK ({ack_message_type}).")
-
-                # Start the timeout only after sending the message
-                self.udp_socket.settimeout(timeout)
-
-                # Wait for ACK
-                ack_data, _ = self.udp_socket.recvfrom(1024)
-                ack = json.loads(ack_data.decode())
-                if ack.get("message") == ack_message_type and ack.get("agent_id") == message.get("agent_id"):
-                    self.logger.info(f"Received ACK for {ack_message_type} from agent {ack.get('agent_id')}")
-                    return True  # Stop retrying once ACK is received
-            except socket.timeout:
-                self.logger.warning(f"No ACK received for {ack_message_type}, retrying ({attempt + 1}/{retries})...")
-            except Exception as e:
-                self.logger.error(f"Failed retransmission: {e}")
-        self.logger.error(f"Failed to receive ACK for {ack_message_type} after {retries} attempts")
-        return False
+############################################################################################################################################################################################
+
+    async def send_with_retransmission(self, message, address, ack_message_type, agent_id, retries=5):
+        """
+        Sends a message and waits for its ACK without blocking the loop, retransmitting on timeout.
+        Timeouts follow the agent's measured RTT (Jacobson/Karels) with exponential backoff.
+        The ACK must come from `address` with the same agent_id (and task_id, if the message has one).
+        Returns True once the ACK is received.
+        """
+        return await self.worker.send_with_retransmission(message, address, ack_message_type, agent_id, retries)
+
+############################################################################################################################################################################################
+
+    def stats(self):
+        """
+        Returns the counters of every socket, to see how agents are spread across them.
+        """
+        return [self.worker.stats()] + [ingest_process.stats() for ingest_process in self.ingest_processes]
+
+############################################################################################################################################################################################
 
     def close(self):
         """
-        Closes the UDP socket.
+        Closes the UDP sockets, stops the event loop and the ingest processes.
         """
-        self.udp_socket.close()
-        self.logger.info("NetTask socket closed")
\ No newline at end of file
+        self.worker.close()
+        for ingest_process in self.ingest_processes:
+            ingest_process.close()
+        self.logger.info("NetTask socket closed")
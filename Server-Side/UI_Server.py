@@ -1,6 +1,7 @@
 import curses
 import os
-import json
+import time
+from alert_journal import ALERT_TYPES
 
 
 class UIServer:
@@ -45,7 +46,11 @@ class UIServer:
         menu = [
             "View Message Log",
             "View Storage",
+            "View Metric History",
+            "View Alerts",
             "View Registered Agents",
+            "View Storage Statistics",
+            "View NetTask Statistics",
             "Exit"
         ]
         selected_index = 0
@@ -73,8 +78,16 @@ class UIServer:
                     self.view_message_log(stdscr)
                 elif menu[selected_index] == "View Storage":
                     self.view_storage(stdscr)
+                elif menu[selected_index] == "View Metric History":
+                    self.view_metric_history(stdscr)
+                elif menu[selected_index] == "View Alerts":
+                    self.view_alerts(stdscr)
                 elif menu[selected_index] == "View Registered Agents":
                     self.view_registered_agents(stdscr)
+                elif menu[selected_index] == "View Storage Statistics":
+                    self.view_storage_stats(stdscr)
+                elif menu[selected_index] == "View NetTask Statistics":
+                    self.view_net_stats(stdscr)
                 elif menu[selected_index] == "Exit":
                     break
 
@@ -169,56 +182,26 @@ class UIServer:
 
         def get_agents():
             """
-            Dynamically retrieves the list of agents based on the files in the `metrics_storage` folder.
+            Dynamically retrieves the list of agents with metrics stored in the `metrics_storage` folder.
             """
-            storage_folder = "metrics_storage"
-            if not os.path.exists(storage_folder):
-                return []
-
-            agents = []
-            for file_name in os.listdir(storage_folder):
-                if file_name.startswith("agent") and file_name.endswith("_metrics_collected.json"):
-                    # Extract agent number from the file name
-                    agent_number = file_name.replace("agent", "").replace("_metrics_collected.json", "")
-                    agents.append(f"Agent {agent_number} Metrics")
-            return agents
-
-        def load_metrics(agent_id):
-            """
-            Loads metrics for a specific agent from the `metrics_storage` folder.
-            """
-            storage_folder = "metrics_storage"
-            file_name = f"agent{agent_id}_metrics_collected.json"
-            file_path = os.path.join(storage_folder, file_name)
+            return [f"Agent {agent_number} Metrics" for agent_number in self.server.storage.list_stored_agents()]
 
-            if not os.path.exists(file_path):
-                return f"Metrics file for Agent {agent_id} not found."
-
-            try:
-                with open(file_path, "r") as file:
-                    return json.load(file)
-            except json.JSONDecodeError as e:
-                return f"Error decoding JSON for Agent {agent_id}: {e}"
-            except Exception as e:
-                return f"Error reading file for Agent {agent_id}: {e}"
-
-        def format_metrics(metrics, indent=0):
+        def format_entry(entry, indent=0):
             """
-            Recursively formats metrics for better readability with separators and spacing.
+            Formats a single metrics entry for better readability with separators and spacing.
             """
-            formatted = []
             separator = "=" * 50  # Separator for clarity
-            for i, entry in enumerate(metrics):
-                formatted.append(separator)
-                formatted.append(f"Entry {i + 1}:")
-                if isinstance(entry, dict):
-                    formatted.extend(format_dict(entry, indent + 4))
-                else:
-                    formatted.append(" " * indent + str(entry))
-                formatted.append(separator)
+            timestamp = entry.get("timestamp") if isinstance(entry, dict) else None
+            title = f"Entry received at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))}:" if timestamp else "Entry:"
+
+            formatted = [separator, title]
+            if isinstance(entry, dict):
+                formatted.extend(format_dict(entry, indent + 4))
+            else:
+                formatted.append(" " * indent + str(entry))
+            formatted.append(separator)
             return formatted
 
-
         def format_dict(data, indent=0):
             """
             Helper function to format dictionaries recursively.
@@ -239,32 +222,6 @@ class UIServer:
             return formatted
 
 
-        def display_menu(stdscr, options, title="Select an Option"):
-            """
-            Displays a menu and allows the user to choose an option.
-            """
-            current_index = 0
-            while True:
-                stdscr.clear()
-                max_y, max_x = stdscr.getmaxyx()
-                stdscr.addstr(0, 0, title.center(max_x), curses.A_BOLD)
-                for i, option in enumerate(options):
-                    if i == current_index:
-                        stdscr.addstr(i + 2, 0, f"> {option}", curses.A_REVERSE)
-                    else:
-                        stdscr.addstr(i + 2, 0, f"  {option}")
-                stdscr.refresh()
-
-                key = stdscr.getch()
-                if key in (ord('q'), ord('Q')):  # Quit
-                    return None
-                elif key in (curses.KEY_UP, ord('k')) and current_index > 0:  # Up
-                    current_index -= 1
-                elif key in (curses.KEY_DOWN, ord('j')) and current_index < len(options) - 1:  # Down
-                    current_index += 1
-                elif key in (ord('\n'), ord('\r')):  # Enter
-                    return options[current_index]
-
         # Retrieve agent list dynamically
         agents = get_agents()
         if not agents:
@@ -273,27 +230,92 @@ class UIServer:
             return
 
         # Menu to select agent
-        agent_id = display_menu(stdscr, agents, "Select Agent")
+        agent_id = self.display_menu(stdscr, agents, "Select Agent")
         if not agent_id:
             return
 
         # Extract agent number
         agent_number = agent_id.split()[1]
+        storage = self.server.storage
 
-        # Load metrics for the selected agent
-        metrics = load_metrics(agent_number)
-
-        # Check if an error occurred
-        if isinstance(metrics, str):  # Error message
-            content = [metrics]
-        else:
-            content = format_metrics(metrics)
-
-        # Paginate and display metrics
         max_y, max_x = stdscr.getmaxyx()
         content_height = max_y - 4
-        pages = [content[i:i + content_height] for i in range(0, len(content), content_height)]
-        current_page = 0
+
+        def load_page(position, backward=False):
+            """
+            Reads only the entries needed to fill one screen, starting at `position`
+            (or ending right before it when going backwards).
+            Returns the lines to display and the positions of the first and next entries.
+            """
+            # Every entry takes at least 3 lines, so this many entries always fill a page
+            entries = storage.read_metrics_page(agent_number, position, max(1, content_height // 3), backward)
+            if backward:
+                # Keep the newest entries that fit, ending at `position`
+                kept = []
+                used = 0
+                for entry_position, entry in reversed(entries):
+                    lines = format_entry(entry)
+                    if kept and used + len(lines) > content_height:
+                        break
+                    kept.insert(0, (entry_position, lines))
+                    used += len(lines)
+                if not kept:
+                    return None
+                first_position = kept[0][0]
+                next_position = position
+            else:
+                kept = []
+                used = 0
+                for entry_position, entry in entries:
+                    lines = format_entry(entry)
+                    if kept and used + len(lines) > content_height:
+                        break
+                    kept.append((entry_position, lines))
+                    used += len(lines)
+                if not kept:
+                    return None
+                first_position = kept[0][0]
+                # The next page starts right after the last entry shown
+                following = storage.read_metrics_page(agent_number, kept[-1][0], 2)
+                next_position = following[1][0] if len(following) > 1 else storage.metrics_end_position(agent_number)
+
+            content = [line for _, lines in kept for line in lines][:content_height]
+            return content, first_position, next_position
+
+        def prompt_time():
+            """
+            Asks for a time to jump to: minutes ago (e.g. "10") or "YYYY-MM-DD HH:MM[:SS]".
+            """
+            curses.echo()
+            prompt = "Jump to (minutes ago or YYYY-MM-DD HH:MM[:SS]): "
+            try:
+                stdscr.addstr(max_y - 1, 0, prompt.ljust(max_x - 1), curses.color_pair(1))
+                answer = stdscr.getstr(max_y - 1, len(prompt)).decode("utf-8").strip()
+            except curses.error:
+                answer = ""
+            curses.noecho()
+
+            if not answer:
+                return None
+            try:
+                return time.time() - float(answer) * 60
+            except ValueError:
+                pass
+            for time_format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
+                try:
+                    return time.mktime(time.strptime(answer, time_format))
+                except ValueError:
+                    pass
+            return None
+
+        try:
+            page = load_page(storage.metrics_start_position(agent_number))
+        except Exception as e:
+            self.display_popup(stdscr, "Error", f"Error reading metrics for Agent {agent_number}: {e}")
+            return
+        if page is None:
+            page = (["No metrics stored for this agent."], 0, 0)
+        content, first_position, next_position = page
 
         while True:
             stdscr.clear()
@@ -305,15 +327,17 @@ class UIServer:
                 pass
 
             # Display the content for the current page
-            for i, line in enumerate(pages[current_page]):
+            for i, line in enumerate(content):
                 try:
                     stdscr.addstr(i + 2, 0, line[:max_x])  # Truncate to terminal width
                 except curses.error:
                     pass
 
             # Footer with navigation options
-            footer = "Press 'n' for next page, 'p' for previous, or 'q' to quit."
-            page_info = f"Page {current_page + 1}/{len(pages)}"
+            footer = "'n' next, 'p' previous, 'b' beginning, 'e' end, 't' jump to time, 'q' quit."
+            end_position = storage.metrics_end_position(agent_number)
+            progress = 100 * next_position // end_position if end_position else 100
+            page_info = f"Position: {progress}% of stored metrics"
             try:
                 stdscr.addstr(max_y - 2, 0, page_info.ljust(max_x), curses.color_pair(1))
                 stdscr.addstr(max_y - 1, 0, footer.ljust(max_x), curses.color_pair(1))
@@ -324,24 +348,195 @@ class UIServer:
 
             # Handle user input
             key = stdscr.getch()
+            page = None
             if key in (ord('q'), ord('Q')):  # Quit
                 break
-            elif key in (ord('n'), ord('N')) and current_page < len(pages) - 1:  # Next page
-                current_page += 1
-            elif key in (ord('p'), ord('P')) and current_page > 0:  # Previous page
-                current_page -= 1
+            elif key in (ord('n'), ord('N')) and next_position < end_position:  # Next page
+                page = load_page(next_position)
+            elif key in (ord('p'), ord('P')):  # Previous page
+                page = load_page(first_position, backward=True)
+            elif key in (ord('b'), ord('B')):  # Beginning
+                page = load_page(storage.metrics_start_position(agent_number))
+            elif key in (ord('e'), ord('E')):  # End
+                page = load_page(end_position, backward=True)
+            elif key in (ord('t'), ord('T')):  # Jump to time
+                timestamp = prompt_time()
+                if timestamp is not None:
+                    page = load_page(storage.seek_metrics_time(agent_number, timestamp)) or load_page(end_position, backward=True)
+
+            if page:
+                content, first_position, next_position = page
+
+    def view_metric_history(self, stdscr):
+        """
+        Displays one metric of an agent over a time range. Recent ranges are read from memory,
+        longer ones from the raw columns or a rollup tier, and full resolution from the compressed archive.
+        """
+        storage = self.server.storage
+        agents = storage.list_stored_agents()
+        if not agents:
+            self.display_popup(stdscr, "Error", "No agents found in the metrics_storage folder.")
+            return
+
+        agent = self.display_menu(stdscr, [f"Agent {agent_id}" for agent_id in agents], "Select Agent")
+        if not agent:
+            return
+        agent_id = agent.split()[1]
+
+        metrics = storage.metric_names(agent_id)
+        if not metrics:
+            self.display_popup(stdscr, "Error", f"No numeric metrics stored for Agent {agent_id}.")
+            return
+        metric = self.display_menu(stdscr, metrics, "Select Metric")
+        if not metric:
+            return
+
+        ranges = {"Last 5 minutes": 300, "Last hour": 3600, "Last 24 hours": 24 * 3600, "Last 30 days": 30 * 24 * 3600, "Last year": 365 * 24 * 3600}
+        full_resolution_range = "Last 30 days, full resolution"
+        choice = self.display_menu(stdscr, list(ranges) + [full_resolution_range], "Select Time Range")
+        if not choice:
+            return
+
+        sample_interval = self.server.task_config.frequency if self.server.task_config else 1
+        start = time.time() - ranges.get(choice, 30 * 24 * 3600)
+        try:
+            source, rows = storage.metric_history(agent_id, metric, start, sample_interval=sample_interval,
+                                                  full_resolution=choice == full_resolution_range)
+        except Exception as e:
+            self.display_popup(stdscr, "Error", f"Error reading {metric} for Agent {agent_id}: {e}")
+            return
+
+        lines = [
+            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))}  " + ", ".join(f"{name}: {value:g}" for name, value in fields.items())
+            for timestamp, fields in rows
+        ]
+        self.display_pages(stdscr, f"Agent {agent_id} - {metric} - {choice} (from {source})", lines or ["No samples in this range."])
+
+    def view_alerts(self, stdscr):
+        """
+        Displays the stored alerts of an agent and/or an alert type over a time range, looked up in the alert journal indexes.
+        """
+        storage = self.server.storage
+        agent = self.display_menu(stdscr, ["All agents"] + [f"Agent {agent_id}" for agent_id in storage.list_stored_agents()], "Select Agent")
+        if not agent:
+            return
+        alert_type = self.display_menu(stdscr, ["All alert types"] + list(ALERT_TYPES), "Select Alert Type")
+        if not alert_type:
+            return
+        ranges = {"Last hour": 3600, "Last 24 hours": 24 * 3600, "Last 7 days": 7 * 24 * 3600, "All": None}
+        choice = self.display_menu(stdscr, list(ranges), "Select Time Range")
+        if not choice:
+            return
+
+        agent_id = agent.split()[1] if agent != "All agents" else None
+        alert_type = alert_type if alert_type != "All alert types" else None
+        start = time.time() - ranges[choice] if ranges[choice] else None
+        alerts = storage.query_alerts(agent_id, alert_type, start)
+
+        lines = [
+            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(alert.get('timestamp', 0)))}  Agent {alert.get('agent_id')}: {alert.get('alert')}  "
+            + ", ".join(f"{key}: {value}" for key, value in alert.items() if key not in ("timestamp", "agent_id", "alert"))
+            for alert in alerts
+        ]
+        self.display_pages(stdscr, f"Alerts - {agent} - {alert_type or 'all types'} - {choice}", lines or ["No alerts in this range."])
 
     def view_registered_agents(self, stdscr):
         """
         Displays registered agents.
         """
+        last_seen = self.server.agent_registry.last_seen()
         content = "\n".join(
-            [f"Agent {agent_id}: {addr}" for agent_id, addr in self.server.net_task.registered_agents.items()]
+            [f"Agent {agent_id}: {addr}" + (f", last seen {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_seen[agent_id]))}" if last_seen.get(agent_id) else "")
+             for agent_id, addr in self.server.agent_registry.registered().items()]
         )
         if not content:
             content = "No agents registered yet."
         self.display_popup(stdscr, "Registered Agents", content)
 
+    def view_storage_stats(self, stdscr):
+        """
+        Displays the write-behind buffer counters.
+        """
+        stats = self.server.write_buffer.stats()
+        content = "\n".join(
+            f"{key}: {value * 1000:.2f} ms" if key.endswith("latency") else f"{key}: {value}"
+            for key, value in stats.items()
+        )
+        self.display_popup(stdscr, "Storage Statistics", content)
+
+    def view_net_stats(self, stdscr):
+        """
+        Displays the counters of every NetTask socket, to see how agents are spread across them,
+        the RTT of every agent address and the task dispatch counters and latencies.
+        """
+        lines = [", ".join(f"{key}: {value}" for key, value in stats.items()) for stats in self.server.net_task.stats()]
+        lines.extend(
+            f"{addr}: " + ", ".join(f"{key}: {value}" for key, value in stats.items())
+            for addr, stats in self.server.net_task.rtt.stats().items()
+        )
+        lines.append("Task dispatch: " + ", ".join(f"{key}: {value}" for key, value in self.server.task_dispatcher.stats().items()))
+        lines.extend(
+            f"Agent {agent_id}: task ACK after {latency} ms"
+            for agent_id, latency in self.server.task_dispatcher.agent_latencies().items()
+        )
+        self.display_popup(stdscr, "NetTask Statistics", "\n".join(lines))
+
+    def display_menu(self, stdscr, options, title="Select an Option"):
+        """
+        Displays a menu and allows the user to choose an option.
+        """
+        current_index = 0
+        while True:
+            stdscr.clear()
+            max_y, max_x = stdscr.getmaxyx()
+            stdscr.addstr(0, 0, title.center(max_x), curses.A_BOLD)
+            for i, option in enumerate(options):
+                if i == current_index:
+                    stdscr.addstr(i + 2, 0, f"> {option}", curses.A_REVERSE)
+                else:
+                    stdscr.addstr(i + 2, 0, f"  {option}")
+            stdscr.refresh()
+
+            key = stdscr.getch()
+            if key in (ord('q'), ord('Q')):  # Quit
+                return None
+            elif key in (curses.KEY_UP, ord('k')) and current_index > 0:  # Up
+                current_index -= 1
+            elif key in (curses.KEY_DOWN, ord('j')) and current_index < len(options) - 1:  # Down
+                current_index += 1
+            elif key in (ord('\n'), ord('\r')):  # Enter
+                return options[current_index]
+
+    def display_pages(self, stdscr, title, lines):
+        """
+        Displays lines one page at a time, starting with the newest page.
+        """
+        max_y, max_x = stdscr.getmaxyx()
+        content_height = max(1, max_y - 4)
+        pages = [lines[i:i + content_height] for i in range(0, len(lines), content_height)]
+        current_page = len(pages) - 1
+        footer = "Press 'n' for next page, 'p' for previous, or 'q' to quit."
+
+        while True:
+            stdscr.clear()
+            try:
+                stdscr.addstr(0, 0, title.center(max_x)[:max_x], curses.A_BOLD)
+                for i, line in enumerate(pages[current_page]):
+                    stdscr.addstr(i + 2, 0, line[:max_x])
+                stdscr.addstr(max_y - 2, 0, f"Page {current_page + 1}/{len(pages)}".ljust(max_x), curses.color_pair(1))
+                stdscr.addstr(max_y - 1, 0, footer.ljust(max_x), curses.color_pair(1))
+            except curses.error:
+                pass
+            stdscr.refresh()
+
+            key = stdscr.getch()
+            if key in (ord('q'), ord('Q')):  # Quit
+                break
+            elif key in (ord('n'), ord('N')) and current_page < len(pages) - 1:  # Next page
+                current_page += 1
+            elif key in (ord('p'), ord('P')) and current_page > 0:  # Previous page
+                current_page -= 1
+
     def display_popup(self, stdscr, title, content):
         """
         Displays a popup window with the provided content.
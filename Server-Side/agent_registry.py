@@ -0,0 +1,204 @@
+import time
+import logging
+import threading
+from journal import Journal
+
+class AgentRegistry:
+    """
+    Registered agents and the state of their registration handshake.
+    An agent is PENDING from its first register message until its registration_ack arrives, and
+    REGISTERED afterwards. Agents are indexed both by ID and by address, so a register message is
+    matched to its agent without scanning, and IDs come from a counter that only goes up, so an ID
+    freed by a failed registration is never handed out again.
+
+    With a `file_path`, registered agents (ID, address, hash of the task they acknowledged, last
+    time they were heard from) are kept in an append-only journal: every change appends one record
+    and the latest record of an agent wins. The journal is reloaded on start, so after a server
+    restart known agents are served right away, without registering again. It is rewritten with one
+    record per agent once most of its records are stale.
+    """
+
+    PENDING = "pending"
+    REGISTERED = "registered"
+
+    def __init__(self, file_path=None, last_seen_interval=60.0, logger=None):
+        # Last-seen times are only written when they moved by more than this, to keep writes rare
+        self.last_seen_interval = last_seen_interval
+
+        # Use the provided logger or the root logger
+        self.logger = logger or logging.getLogger()
+
+        # agent_id -> [address, state, task_hash, last_seen, last_seen written to the journal]
+        self.agents = {}
+        # address -> agent_id
+        self.address_index = {}
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+        self.journal = None
+        self.records = 0
+        if file_path:
+            self.load(file_path)
+            self.journal = Journal(file_path, logger=self.logger)
+
+############################################################################################################################################################################################
+
+    def load(self, file_path):
+        """
+        Rebuilds the registered agents from the journal.
+        """
+        for record in Journal.read_file(file_path, logger=self.logger):
+            self.records += 1
+            agent_id = record.get("agent_id")
+            if agent_id is None:
+                continue
+            if agent_id.isdigit():
+                self.next_id = max(self.next_id, int(agent_id) + 1)
+
+            previous = self.agents.pop(agent_id, None)
+            if previous is not None and self.address_index.get(previous[0]) == agent_id:
+                del self.address_index[previous[0]]
+            if record.get("removed"):
+                continue
+
+            address = tuple(record["address"])
+            last_seen = record.get("last_seen")
+            self.agents[agent_id] = [address, self.REGISTERED, record.get("task_hash"), last_seen, last_seen]
+            self.address_index[address] = agent_id
+
+        if self.agents:
+            self.logger.info(f"Loaded {len(self.agents)} registered agents from {file_path}.")
+
+    def write(self, agent_id, entry=None):
+        """
+        Appends the current record of an agent (or its removal) to the journal. Must be called with the lock held.
+        """
+        if self.journal is None:
+            return
+        if entry is None:
+            record = {"agent_id": agent_id, "removed": True}
+        else:
+            record = {"agent_id": agent_id, "address": list(entry[0]), "task_hash": entry[2], "last_seen": entry[3]}
+            entry[4] = entry[3]
+        try:
+            self.journal.append(record)
+            self.records += 1
+            if self.records > 2 * len(self.agents) + 64:
+                self.compact()
+        except OSError as e:
+            self.logger.error(f"Failed to write the agent registry: {e}")
+
+    def compact(self):
+        """
+        Rewrites the journal with one record per registered agent. Must be called with the lock held.
+        """
+        # The highest ID handed out comes first, so IDs stay monotonic across restarts
+        records = [{"agent_id": str(self.next_id - 1), "removed": True}] if self.next_id > 1 else []
+        records.extend(
+            {"agent_id": agent_id, "address": list(entry[0]), "task_hash": entry[2], "last_seen": entry[3]}
+            for agent_id, entry in self.agents.items() if entry[1] == self.REGISTERED
+        )
+        self.journal.rewrite(records)
+        self.records = len(records)
+
+############################################################################################################################################################################################
+
+    def begin(self, address):
+        """
+        Starts the registration handshake of the agent at `address`.
+        Returns (agent_id, previous state): None for a new agent, which gets the next ID, PENDING while
+        its handshake is already running, and REGISTERED for a registered agent registering again
+        (restarted), which keeps its ID and goes back to PENDING without its task.
+        """
+        with self.lock:
+            agent_id = self.address_index.get(address)
+            if agent_id is None:
+                agent_id = str(self.next_id)
+                self.next_id += 1
+                self.agents[agent_id] = [address, self.PENDING, None, time.time(), None]
+                self.address_index[address] = agent_id
+                return agent_id, None
+
+            entry = self.agents[agent_id]
+            state = entry[1]
+            entry[1] = self.PENDING
+            entry[2] = None
+            return agent_id, state
+
+    def confirm(self, agent_id):
+        """
+        Completes the handshake once the registration_ack arrives.
+        """
+        with self.lock:
+            entry = self.agents.get(agent_id)
+            if entry is not None:
+                entry[1] = self.REGISTERED
+                entry[3] = time.time()
+                self.write(agent_id, entry)
+
+    def cancel(self, agent_id):
+        """
+        Forgets an agent whose handshake failed.
+        """
+        with self.lock:
+            entry = self.agents.pop(agent_id, None)
+            if entry is not None and self.address_index.get(entry[0]) == agent_id:
+                del self.address_index[entry[0]]
+            if entry is not None:
+                self.write(agent_id)
+
+############################################################################################################################################################################################
+
+    def assign_task(self, agent_id, task_hash):
+        """
+        Records the task an agent acknowledged.
+        """
+        with self.lock:
+            entry = self.agents.get(agent_id)
+            if entry is not None and entry[1] == self.REGISTERED:
+                entry[2] = task_hash
+                entry[3] = time.time()
+                self.write(agent_id, entry)
+
+    def task_hash(self, agent_id):
+        with self.lock:
+            entry = self.agents.get(agent_id)
+            return entry[2] if entry is not None else None
+
+    def touch(self, agent_id):
+        """
+        Updates the last time an agent was heard from, writing it only every `last_seen_interval` seconds.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.agents.get(agent_id)
+            if entry is None:
+                return
+            entry[3] = now
+            if entry[1] == self.REGISTERED and (entry[4] is None or now - entry[4] >= self.last_seen_interval):
+                self.write(agent_id, entry)
+
+############################################################################################################################################################################################
+
+    def registered(self):
+        """
+        Returns the registered agents (agent_id -> address), without those still in their handshake.
+        """
+        with self.lock:
+            return {agent_id: entry[0] for agent_id, entry in self.agents.items() if entry[1] == self.REGISTERED}
+
+    def last_seen(self):
+        """
+        Returns the last time every registered agent was heard from (agent_id -> epoch seconds).
+        """
+        with self.lock:
+            return {agent_id: entry[3] for agent_id, entry in self.agents.items() if entry[1] == self.REGISTERED}
+
+    def stats(self):
+        with self.lock:
+            pending = sum(1 for entry in self.agents.values() if entry[1] == self.PENDING)
+            return {"registered": len(self.agents) - pending, "pending": pending, "next_id": self.next_id, "journal_records": self.records}
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
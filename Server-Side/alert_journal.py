@@ -0,0 +1,108 @@
+import os
+import time
+import bisect
+import logging
+import threading
+from journal import Journal
+
+# Alert types sent by the agents
+ALERT_TYPES = ("cpu_usage", "ram_usage", "packets_recv", "packet_loss", "jitter")
+
+class AlertJournal:
+    """
+    Append-only journal of the alerts received over AlertFlow, with in-memory indexes by agent,
+    by alert type and by both. Every index keeps (timestamp, offset) pairs in time order, so a
+    query such as "all jitter alerts in the last hour" is a bisect plus a read of the matching
+    records only.
+    """
+
+    def __init__(self, folder="alerts_storage", fsync_policy=Journal.FSYNC_INTERVAL, logger=None):
+        self.lock = threading.Lock()
+
+        # Use the provided logger or the root logger
+        self.logger = logger or logging.getLogger()
+
+        self.journal = Journal(os.path.join(folder, "alerts.jsonl"), fsync_policy, logger=self.logger)
+
+        # Index key -> ([timestamps], [offsets]); keys are None (all alerts), ("agent", id),
+        # ("type", alert_type) and ("agent_type", id, alert_type)
+        self.indexes = {}
+
+        count = 0
+        for offset, alert in self.journal.scan():
+            self.index(alert, offset)
+            count += 1
+        if count:
+            self.logger.info(f"Indexed {count} stored alerts from {self.journal.file_path}.")
+
+############################################################################################################################################################################################
+
+    def index_keys(self, alert):
+        agent_id = str(alert.get("agent_id"))
+        alert_type = alert.get("alert")
+        return (None, ("agent", agent_id), ("type", alert_type), ("agent_type", agent_id, alert_type))
+
+    def query_key(self, agent_id, alert_type):
+        if agent_id is not None and alert_type is not None:
+            return ("agent_type", str(agent_id), alert_type)
+        if agent_id is not None:
+            return ("agent", str(agent_id))
+        if alert_type is not None:
+            return ("type", alert_type)
+        return None
+
+    def index(self, alert, offset):
+        timestamp = alert.get("timestamp", 0.0)
+        with self.lock:
+            for key in self.index_keys(alert):
+                timestamps, offsets = self.indexes.setdefault(key, ([], []))
+                # Alerts are stamped on arrival, so appending keeps every index in time order
+                position = len(timestamps) if not timestamps or timestamps[-1] <= timestamp else bisect.bisect_right(timestamps, timestamp)
+                timestamps.insert(position, timestamp)
+                offsets.insert(position, offset)
+
+############################################################################################################################################################################################
+
+    def append(self, alert):
+        """
+        Stamps an alert with the receive time (unless it already has one), appends it to the
+        journal and indexes it.
+        """
+        alert.setdefault("timestamp", time.time())
+        offset = self.journal.append(alert)
+        self.index(alert, offset)
+        return alert
+
+############################################################################################################################################################################################
+
+    def query(self, agent_id=None, alert_type=None, start=None, end=None):
+        """
+        Returns the alerts matching an agent and/or an alert type with start <= timestamp < end,
+        oldest first. The matching records are read in a single pass over the journal.
+        """
+        key = self.query_key(agent_id, alert_type)
+        with self.lock:
+            timestamps, offsets = self.indexes.get(key, ([], []))
+            first = 0 if start is None else bisect.bisect_left(timestamps, start)
+            last = len(timestamps) if end is None else bisect.bisect_left(timestamps, end)
+            selected = offsets[first:last]
+
+        return self.journal.read_offsets(selected)
+
+############################################################################################################################################################################################
+
+    def count(self, agent_id=None, alert_type=None, start=None, end=None):
+        """
+        Counts matching alerts from the index alone, without reading the journal.
+        """
+        key = self.query_key(agent_id, alert_type)
+        with self.lock:
+            timestamps, _ = self.indexes.get(key, ([], []))
+            first = 0 if start is None else bisect.bisect_left(timestamps, start)
+            last = len(timestamps) if end is None else bisect.bisect_left(timestamps, end)
+            return last - first
+
+############################################################################################################################################################################################
+
+    def close(self):
+        self.journal.close()
@@ -0,0 +1,73 @@
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import threading
+from NetTask_Server import NetTask
+from task_dispatch import TaskDispatcher
+
+# Usage: python bench_dispatch.py [agents] [loss]
+# Dispatches a task to many simulated agents, answered by one socket that drops a fraction of the tasks
+
+def respond(responder, loss, stop):
+    responder.settimeout(0.2)
+    while not stop.is_set():
+        try:
+            data, address = responder.recvfrom(65535)
+        except socket.timeout:
+            continue
+        if random.random() < loss:
+            continue
+        task = json.loads(data)
+        ack = {"message": "task_ack", "agent_id": task["device_id"], "task_id": task["task_id"], "task_hash": task["task_hash"]}
+        responder.sendto(json.dumps(ack).encode(), address)
+
+############################################################################################################################################################################################
+
+def benchmark(agents, loss):
+    logger = logging.getLogger("bench_dispatch")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    responder = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    responder.bind(("127.0.0.1", 0))
+    responder.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    stop = threading.Event()
+    threading.Thread(target=respond, args=(responder, loss, stop), daemon=True).start()
+
+    net_task = NetTask("127.0.0.1", 0, logger)
+    dispatcher = TaskDispatcher(net_task, logger)
+
+    def handle(message, addr):
+        if message.get("message") == "task_ack":
+            dispatcher.acknowledge(message["agent_id"], message["task_id"], message.get("task_hash"))
+
+    threading.Thread(target=net_task.serve, args=(handle,), daemon=True).start()
+    while net_task.loop is None or not net_task.loop.is_running():
+        time.sleep(0.01)
+
+    async def dispatch():
+        tasks = [(str(agent_id), responder.getsockname(), "bench",
+                  json.dumps({"task_id": "bench", "device_id": str(agent_id), "frequency": 10, "task_hash": "bench"}).encode(), "bench")
+                 for agent_id in range(1, agents + 1)]
+        return await dispatcher.dispatch(tasks)
+
+    started = time.perf_counter()
+    results = net_task.spawn(dispatch()).result()
+    elapsed = time.perf_counter() - started
+
+    print(f"{agents} agents, {loss:.0%} loss: {sum(results)} acknowledged, {len(results) - sum(results)} failed in {elapsed:.2f} s "
+          f"with {threading.active_count()} threads")
+    print(dispatcher.stats())
+
+    stop.set()
+    net_task.close()
+
+############################################################################################################################################################################################
+
+if __name__ == "__main__":
+    agents = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    loss = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    benchmark(agents, loss)
@@ -0,0 +1,90 @@
+import sys
+import json
+import time
+import socket
+import tracemalloc
+from bench_storage import make_sample
+import wire_format
+from buffer_pool import BufferPool
+
+# Usage: python bench_nettask.py [datagrams]
+# Compares the original receive path (recvfrom(1024), limited to 1024-byte datagrams) with the pooled
+# one of NetTaskWorker, which receives up to MAX_READS datagrams into one pooled buffer per wakeup and
+# decodes them from a memoryview, for JSON and binary metrics datagrams. Only the per-datagram bytes
+# object goes away (about 200 bytes allocated per datagram); a JSON datagram is still materialised
+# once as the str the parser needs, and the parsed message dominates both time and memory. On loopback
+# JSON takes about 10.3 us per datagram on both paths, and binary 14.5-15 us pooled vs 13.4 us copying,
+# because indexing a memoryview is slower than indexing bytes. The pool removes the datagram size
+# limit without a 64 KB allocation per receive; it is not a receive-cost optimisation.
+
+def receive_copying(receiver, count):
+    # Original receive path: a new bytes object of up to 1024 bytes per datagram, then the parse
+    messages = []
+    for _ in range(count):
+        data, addr = receiver.recvfrom(1024)
+        messages.append((wire_format.decode(data), addr))
+    return messages
+
+def make_receive_pooled(pool):
+    # Receive path of NetTaskWorker.read_datagrams: one pooled buffer per wakeup
+    def receive_pooled(receiver, count):
+        messages = []
+        pair = pool.acquire()
+        buffer, view = pair
+        try:
+            for _ in range(count):
+                size, addr = receiver.recvfrom_into(buffer)
+                messages.append((wire_format.decode(view[:size]), addr))
+        finally:
+            pool.release(pair)
+        return messages
+    return receive_pooled
+
+############################################################################################################################################################################################
+
+def benchmark(name, receive, datagrams, payload):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = receiver.getsockname()
+
+    # Throughput, in batches small enough for the receive buffer
+    elapsed = 0.0
+    for first in range(0, datagrams, 64):
+        batch = min(64, datagrams - first)
+        for _ in range(batch):
+            sender.sendto(payload, address)
+        started = time.perf_counter()
+        receive(receiver, batch)
+        elapsed += time.perf_counter() - started
+
+    # Memory allocated while handling each datagram (peak above the live baseline)
+    samples = min(datagrams, 1000)
+    transient = 0
+    tracemalloc.start()
+    for _ in range(samples):
+        sender.sendto(payload, address)
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        receive(receiver, 1)
+        transient += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    sender.close()
+    receiver.close()
+
+    print(f"{name:>8} | {datagrams / elapsed:10.0f} datagrams/s | {elapsed / datagrams * 1e6:7.2f} us/datagram | "
+          f"{transient / samples:8.0f} bytes allocated per datagram")
+
+############################################################################################################################################################################################
+
+if __name__ == "__main__":
+    datagrams = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    message = {"agent_id": "1", "metrics": make_sample(time.time())}
+    for payload in (json.dumps(message).encode(), wire_format.encode(message, wire_format.SUPPORTED_VERSIONS[-1])):
+        kind = "binary" if wire_format.is_binary(payload) else "JSON"
+        print(f"{datagrams} {kind} metrics datagrams of {len(payload)} bytes")
+        benchmark("copying", receive_copying, datagrams, payload)
+        benchmark("pooled", make_receive_pooled(BufferPool()), datagrams, payload)
@@ -0,0 +1,77 @@
+import sys
+import time
+import random
+import logging
+import tempfile
+from storage import Storage
+
+# Usage: python bench_storage.py [agents] [samples_per_agent] [batch_size]
+
+def make_sample(timestamp):
+    return {
+        "cpu_usage": round(random.uniform(0, 100), 1),
+        "ram_usage": round(random.uniform(40, 90), 1),
+        "interface_stats": {
+            "eth0": {
+                "bytes_sent": random.randint(0, 10 ** 6),
+                "bytes_recv": random.randint(0, 10 ** 6),
+                "packets_sent": random.randint(0, 1000),
+                "packets_recv": random.randint(0, 1000),
+                "dropin": 0,
+                "dropout": 0,
+            }
+        },
+        "link_metrics": {
+            "bandwidth": {"bandwidth": f"{random.uniform(1, 90):.1f} Gbits/sec", "jitter": None, "packet_loss": None},
+            "latency": {"latency": round(random.uniform(0.01, 5), 3)},
+        },
+        "timestamp": timestamp,
+    }
+
+############################################################################################################################################################################################
+
+def benchmark(backend, agents, samples_per_agent, batch_size):
+    with tempfile.TemporaryDirectory() as folder:
+        storage = Storage(logging.getLogger("bench"), storage_folder=folder, backend=backend)
+
+        start_time = time.time() - samples_per_agent
+        batches = []
+        for agent in range(1, agents + 1):
+            samples = [make_sample(start_time + i) for i in range(samples_per_agent)]
+            for first in range(0, samples_per_agent, batch_size):
+                batches.append((str(agent), samples[first:first + batch_size]))
+
+        started = time.perf_counter()
+        for agent_id, batch in batches:
+            storage.store_metrics_batch_in_file(agent_id, batch)
+        ingest_time = time.perf_counter() - started
+
+        # Last 10% of the history of one agent
+        range_start = start_time + samples_per_agent * 0.9
+        started = time.perf_counter()
+        entries = sum(1 for _ in storage.retrieve_metrics_range("1", range_start))
+        range_time = time.perf_counter() - started
+
+        # Average cpu per agent over the same window
+        started = time.perf_counter()
+        averages = storage.aggregate_metric("cpu_usage", "avg", since=range_start)
+        aggregate_time = time.perf_counter() - started
+
+        storage.close()
+
+    total = agents * samples_per_agent
+    print(f"{backend:>6} | ingest {total / ingest_time:10.0f} samples/s | "
+          f"range query {range_time * 1000:8.2f} ms ({entries} entries) | "
+          f"avg cpu per agent {aggregate_time * 1000:8.2f} ms ({len(averages)} agents)")
+
+############################################################################################################################################################################################
+
+if __name__ == "__main__":
+    agents = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    samples_per_agent = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    logging.getLogger("bench").setLevel(logging.WARNING)
+    print(f"{agents} agents x {samples_per_agent} samples, batches of {batch_size}")
+    for backend in Storage.BACKENDS:
+        benchmark(backend, agents, samples_per_agent, batch_size)
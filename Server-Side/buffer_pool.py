@@ -0,0 +1,48 @@
+import threading
+from collections import deque
+
+class BufferPool:
+    """
+    A pool of preallocated receive buffers, each with a memoryview over it.
+    Datagrams are received straight into a pooled buffer with recvfrom_into and parsed from
+    its memoryview, so no bytes object is allocated per datagram. When every buffer is in use
+    a new one is allocated and later kept in the pool.
+    """
+
+    def __init__(self, count=8, buffer_size=65535):
+        if count <= 0 or buffer_size <= 0:
+            raise ValueError("Buffer pool count and buffer size must be positive")
+
+        self.buffer_size = buffer_size
+        self.lock = threading.Lock()
+        self.free = deque(self.allocate() for _ in range(count))
+
+        self.allocated = count
+        self.misses = 0
+
+############################################################################################################################################################################################
+
+    def allocate(self):
+        buffer = bytearray(self.buffer_size)
+        return buffer, memoryview(buffer)
+
+    def acquire(self):
+        """
+        Returns a free (bytearray, memoryview) pair; give it back with release() once parsed.
+        """
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+            self.allocated += 1
+            self.misses += 1
+        return self.allocate()
+
+    def release(self, pair):
+        with self.lock:
+            self.free.append(pair)
+
+############################################################################################################################################################################################
+
+    def stats(self):
+        with self.lock:
+            return {"buffers": self.allocated, "free": len(self.free), "misses": self.misses}
@@ -0,0 +1,313 @@
+import os
+import math
+import mmap
+import time
+import array
+import bisect
+import logging
+import threading
+from metric_fields import flatten_metrics
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, columns are then exposed as memoryviews
+    np = None
+
+NAN_BYTES = array.array("d", [math.nan]).tobytes()
+
+class ColumnStore:
+    """
+    A columnar time-series store for agent metrics.
+    Every agent gets one fixed-width float64 column file per metric plus a timestamp column,
+    so reading a time range is a slice over memory-mapped files instead of a JSON parse.
+    Missing values are stored as NaN.
+    """
+
+    TIMESTAMP = "timestamp"
+    SUFFIX = ".f8"
+    ITEM_SIZE = 8
+
+    def __init__(self, folder, logger=None):
+        self.folder = folder
+        self.agents = {}
+        self.lock = threading.Lock()
+
+        # Use the provided logger or the root logger
+        self.logger = logger or logging.getLogger()
+
+############################################################################################################################################################################################
+
+    def agent_folder(self, agent_id):
+        return os.path.join(self.folder, f"agent{agent_id}")
+
+    def column_path(self, agent_id, column):
+        return os.path.join(self.agent_folder(agent_id), column + self.SUFFIX)
+
+############################################################################################################################################################################################
+
+    def open_agent(self, agent_id):
+        """
+        Opens the column files of an agent, repairing columns of uneven length left behind by a crash.
+        Must be called with the lock held.
+        """
+        agent = self.agents.get(agent_id)
+        if agent:
+            return agent
+
+        folder = self.agent_folder(agent_id)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        timestamp_path = self.column_path(agent_id, self.TIMESTAMP)
+        rows = os.path.getsize(timestamp_path) // self.ITEM_SIZE if os.path.exists(timestamp_path) else 0
+
+        files = {}
+        for file_name in os.listdir(folder):
+            if not file_name.endswith(self.SUFFIX):
+                continue
+            column = file_name[:-len(self.SUFFIX)]
+            file = open(os.path.join(folder, file_name), "r+b")
+
+            # The timestamp column is written last, so it holds the number of complete rows
+            size = file.seek(0, os.SEEK_END)
+            if size > rows * self.ITEM_SIZE:
+                file.truncate(rows * self.ITEM_SIZE)
+            elif size < rows * self.ITEM_SIZE:
+                missing = rows - size // self.ITEM_SIZE
+                file.truncate((size // self.ITEM_SIZE) * self.ITEM_SIZE)
+                file.seek(0, os.SEEK_END)
+                file.write(NAN_BYTES * missing)
+            file.seek(0, os.SEEK_END)
+            files[column] = file
+
+        if self.TIMESTAMP not in files:
+            files[self.TIMESTAMP] = open(timestamp_path, "a+b")
+
+        last_timestamp = self.read_last(files[self.TIMESTAMP], rows)
+        agent = {"files": files, "rows": rows, "last_timestamp": last_timestamp}
+        self.agents[agent_id] = agent
+        return agent
+
+############################################################################################################################################################################################
+
+    def read_last(self, file, rows):
+        if rows == 0:
+            return -math.inf
+        file.seek((rows - 1) * self.ITEM_SIZE)
+        value = array.array("d", file.read(self.ITEM_SIZE))[0]
+        file.seek(0, os.SEEK_END)
+        return value
+
+############################################################################################################################################################################################
+
+    def append(self, agent_id, metrics, timestamp=None):
+        """
+        Appends one metrics sample to the columns of the specified agent.
+        """
+        self.append_many(agent_id, [(timestamp, metrics)])
+
+############################################################################################################################################################################################
+
+    def append_many(self, agent_id, samples):
+        """
+        Appends several (timestamp, metrics) samples with one write per column.
+        """
+        self.append_rows(agent_id, [(timestamp, flatten_metrics(metrics)) for timestamp, metrics in samples])
+
+############################################################################################################################################################################################
+
+    def append_rows(self, agent_id, rows):
+        """
+        Appends several (timestamp, fields) rows, where fields maps column names to numbers.
+        Timestamps default to the current time and are kept non-decreasing so range scans can bisect.
+        The server already stamps the samples of an agent in order, so a timestamp is only moved
+        forward for rows stored out of order by other writers.
+        """
+        with self.lock:
+            agent = self.open_agent(agent_id)
+            files = agent["files"]
+
+            timestamps = array.array("d")
+            last_timestamp = agent["last_timestamp"]
+            for timestamp, _ in rows:
+                timestamp = time.time() if timestamp is None else float(timestamp)
+                last_timestamp = max(last_timestamp, timestamp)
+                timestamps.append(last_timestamp)
+
+            # New columns are backfilled with NaN so every column keeps the same length
+            for _, fields in rows:
+                for column in fields:
+                    if column not in files:
+                        file = open(self.column_path(agent_id, column), "a+b")
+                        file.write(NAN_BYTES * agent["rows"])
+                        files[column] = file
+
+            for column, file in files.items():
+                if column == self.TIMESTAMP:
+                    continue
+                values = array.array("d", (fields.get(column, math.nan) for _, fields in rows))
+                file.write(values.tobytes())
+                file.flush()
+
+            files[self.TIMESTAMP].write(timestamps.tobytes())
+            files[self.TIMESTAMP].flush()
+
+            agent["rows"] += len(rows)
+            agent["last_timestamp"] = last_timestamp
+
+############################################################################################################################################################################################
+
+    def last_timestamp(self, agent_id):
+        """
+        Returns the timestamp of the newest row of an agent, or None if it has no rows.
+        """
+        with self.lock:
+            agent = self.open_agent(agent_id)
+            return agent["last_timestamp"] if agent["rows"] else None
+
+############################################################################################################################################################################################
+
+    def agent_ids(self):
+        """
+        Returns the IDs of every agent with columns on disk.
+        """
+        if not os.path.exists(self.folder):
+            return []
+        return [
+            folder_name[len("agent"):] for folder_name in os.listdir(self.folder)
+            if folder_name.startswith("agent") and os.path.isdir(os.path.join(self.folder, folder_name))
+        ]
+
+############################################################################################################################################################################################
+
+    def trim(self, agent_id, before):
+        """
+        Drops every row of an agent with a timestamp older than `before`.
+        Each column is rewritten without its head and atomically replaced, so views handed out
+        earlier keep pointing at the old data. Returns the number of dropped rows.
+        """
+        with self.lock:
+            agent = self.open_agent(agent_id)
+            if agent["rows"] == 0:
+                return 0
+
+            timestamps_file = agent["files"][self.TIMESTAMP]
+            timestamps_file.seek(0)
+            timestamps = array.array("d", timestamps_file.read(agent["rows"] * self.ITEM_SIZE))
+            timestamps_file.seek(0, os.SEEK_END)
+
+            dropped = bisect.bisect_left(timestamps, before)
+            if dropped == 0:
+                return 0
+
+            for column, file in list(agent["files"].items()):
+                file.seek(dropped * self.ITEM_SIZE)
+                tail = file.read((agent["rows"] - dropped) * self.ITEM_SIZE)
+                file.close()
+
+                path = self.column_path(agent_id, column)
+                with open(path + ".tmp", "wb") as tmp_file:
+                    tmp_file.write(tail)
+                os.replace(path + ".tmp", path)
+                agent["files"][column] = open(path, "a+b")
+
+            agent["rows"] -= dropped
+            return dropped
+
+############################################################################################################################################################################################
+
+    def columns(self, agent_id):
+        """
+        Returns the names of the metric columns stored for the specified agent.
+        """
+        folder = self.agent_folder(agent_id)
+        if not os.path.exists(folder):
+            return []
+        return sorted(
+            file_name[:-len(self.SUFFIX)] for file_name in os.listdir(folder)
+            if file_name.endswith(self.SUFFIX) and file_name != self.TIMESTAMP + self.SUFFIX
+        )
+
+############################################################################################################################################################################################
+
+    def column(self, agent_id, column):
+        """
+        Returns a zero-copy, read-only view of a whole column: a NumPy array when NumPy
+        is installed, otherwise a memoryview of doubles.
+        """
+        with self.lock:
+            return self.map_column(agent_id, column, self.row_count(agent_id))
+
+    def row_count(self, agent_id):
+        """
+        Returns the number of complete rows of an open agent, or None if it is not open.
+        Must be called with the lock held.
+        """
+        agent = self.agents.get(agent_id)
+        return agent["rows"] if agent else None
+
+    def map_column(self, agent_id, column, rows):
+        """
+        Maps the first `rows` values of a column (the whole file if None).
+        Must be called with the lock held, so trim() cannot replace the file in between.
+        """
+        path = self.column_path(agent_id, column)
+        if not os.path.exists(path):
+            return self.empty()
+
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if rows is None:
+                rows = size // self.ITEM_SIZE
+            length = min(size, rows * self.ITEM_SIZE)
+            if length == 0:
+                return self.empty()
+            mapped = mmap.mmap(file.fileno(), length, access=mmap.ACCESS_READ)
+
+        if np is not None:
+            return np.frombuffer(mapped, dtype="float64")
+        return memoryview(mapped).cast("d")
+
+    def empty(self):
+        if np is not None:
+            return np.empty(0, dtype="float64")
+        return memoryview(array.array("d"))
+
+############################################################################################################################################################################################
+
+    def scan(self, agent_id, columns=None, start=None, end=None):
+        """
+        Returns the samples of an agent with start <= timestamp < end as a dict of column views,
+        including the "timestamp" column. Only the requested columns are mapped, all of them in
+        one locked section, so a concurrent append or trim cannot misalign their rows.
+        """
+        with self.lock:
+            timestamps = self.map_column(agent_id, self.TIMESTAMP, self.row_count(agent_id))
+            views = {
+                column: self.map_column(agent_id, column, len(timestamps))
+                for column in (columns if columns is not None else self.columns(agent_id))
+            }
+
+        if np is not None:
+            first = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+            last = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side="left"))
+        else:
+            first = 0 if start is None else bisect.bisect_left(timestamps, start)
+            last = len(timestamps) if end is None else bisect.bisect_left(timestamps, end)
+
+        result = {self.TIMESTAMP: timestamps[first:last]}
+        for column, values in views.items():
+            result[column] = values[first:last] if len(values) >= last else self.empty()
+        return result
+
+############################################################################################################################################################################################
+
+    def close(self):
+        """
+        Closes every open column file.
+        """
+        with self.lock:
+            for agent in self.agents.values():
+                for file in agent["files"].values():
+                    file.close()
+            self.agents.clear()
@@ -0,0 +1,182 @@
+import sys
+import json
+import threading
+from collections import OrderedDict
+
+# Delta encoding of consecutive metrics samples, shared by NMS_Agent and NMS_Server.
+#
+# Instead of whole samples, the agent sends only the fields that changed since a base: the last
+# sample of the newest message the server acknowledged, whose seq travels in the "base" field.
+# Inside a batch, every sample after the first is relative to the sample before it. Every
+# `keyframe_interval` seqs, and whenever there is no usable base, the message carries whole samples
+# and no "base" (a keyframe). The server keeps the last sample of its most recent messages per
+# agent to rebuild whole samples; when the base is unknown to it (lost keyframe, server restart),
+# it asks for a resync and the agent goes back to keyframes until a new base is acknowledged.
+#
+# A delta holds the changed values, with nested objects reduced to their changed fields. Removed
+# fields cannot be expressed, so a sample that drops a field is sent whole.
+
+KEYFRAME_INTERVAL = 32
+
+# Bases kept per agent on the server, more than the seqs an agent keeps in flight
+MAX_BASES = 64
+
+def diff(base, sample):
+    """
+    Returns the fields of `sample` that differ from `base`, or None when `sample` lacks a field of `base`.
+    """
+    delta = {}
+    for key, value in sample.items():
+        if key not in base:
+            delta[key] = value
+            continue
+        base_value = base[key]
+        if type(value) is dict and type(base_value) is dict:
+            nested = diff(base_value, value)
+            if nested is None:
+                return None
+            if nested:
+                delta[key] = nested
+        elif value != base_value or type(value) is not type(base_value):
+            delta[key] = value
+    if any(key not in sample for key in base):
+        return None
+    return delta
+
+def apply(base, delta):
+    """
+    Rebuilds a sample from its base and delta. Unchanged nested objects are shared with the base.
+    """
+    sample = dict(base)
+    for key, value in delta.items():
+        base_value = sample.get(key)
+        if type(value) is dict and type(base_value) is dict:
+            sample[key] = apply(base_value, value)
+        else:
+            sample[key] = value
+    return sample
+
+############################################################################################################################################################################################
+
+class DeltaEncoder:
+    """
+    Agent side: turns the samples of a message into deltas against the last acknowledged sample.
+    Messages are encoded on every (re)transmission, so a retransmission after a resync is a keyframe.
+    """
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+
+        self.base_seq = None
+        self.base = None
+        self.lock = threading.Lock()
+
+        self.keyframes = 0
+        self.deltas = 0
+        self.resyncs = 0
+
+    def encode(self, seq, samples):
+        """
+        Returns (base seq, samples to send) for the samples of message `seq`: deltas with the seq of
+        their base, or the samples themselves with None for a keyframe. The samples are not modified.
+        """
+        with self.lock:
+            base_seq, base = self.base_seq, self.base
+            if base is None or seq % self.keyframe_interval == 0:
+                self.keyframes += 1
+                return None, samples
+
+            deltas = []
+            for sample in samples:
+                delta = diff(base, sample)
+                if delta is None:
+                    self.keyframes += 1
+                    return None, samples
+                deltas.append(delta)
+                base = sample
+            self.deltas += 1
+            return base_seq, deltas
+
+    def acknowledged(self, seq, samples):
+        """
+        Makes the last sample of an acknowledged message the base of the next deltas.
+        """
+        with self.lock:
+            if self.base_seq is None or seq > self.base_seq:
+                self.base_seq = seq
+                self.base = samples[-1]
+
+    def resync(self):
+        """
+        Forgets the base after the server could not rebuild a delta, so keyframes are sent until one is acknowledged.
+        """
+        with self.lock:
+            self.base_seq = None
+            self.base = None
+            self.resyncs += 1
+
+    def stats(self):
+        with self.lock:
+            return {"base_seq": self.base_seq, "keyframes": self.keyframes, "deltas": self.deltas, "resyncs": self.resyncs}
+
+############################################################################################################################################################################################
+
+class DeltaDecoder:
+    """
+    Server side: rebuilds the whole samples of one agent from keyframes and deltas, keeping the last
+    sample of the `max_bases` most recent messages as bases.
+    """
+
+    def __init__(self, max_bases=MAX_BASES):
+        self.max_bases = max_bases
+
+        # seq -> last whole sample of that message, oldest first
+        self.bases = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.resyncs = 0
+
+    def decode(self, seq, base_seq, samples):
+        """
+        Returns the whole samples of message `seq`, or None when its base is unknown and the agent must resync.
+        """
+        with self.lock:
+            if base_seq is not None:
+                base = self.bases.get(base_seq)
+                if base is None:
+                    self.resyncs += 1
+                    return None
+                rebuilt = []
+                for delta in samples:
+                    base = apply(base, delta)
+                    rebuilt.append(base)
+                samples = rebuilt
+
+            # Copy the last sample, so changes made while storing it do not reach the base
+            self.bases[seq] = dict(samples[-1])
+            self.bases.move_to_end(seq)
+            while len(self.bases) > self.max_bases:
+                self.bases.popitem(last=False)
+            return samples
+
+############################################################################################################################################################################################
+
+if __name__ == "__main__":
+    # Usage: python delta_encoding.py [metrics file ...]
+    # Compares the JSON size of consecutive samples sent whole and as deltas
+    samples = []
+    for file_path in sys.argv[1:]:
+        with open(file_path, "r") as file:
+            samples.extend(json.load(file) if file_path.endswith(".json") else map(json.loads, file))
+
+    encoder = DeltaEncoder()
+    decoder = DeltaDecoder()
+    whole_size = delta_size = 0
+    for seq, sample in enumerate(samples, start=1):
+        base_seq, payload = encoder.encode(seq, [sample])
+        whole_size += len(json.dumps(sample))
+        delta_size += len(json.dumps(payload[0]))
+        assert decoder.decode(seq, base_seq, payload) == [sample]
+        encoder.acknowledged(seq, [sample])
+    print(f"{len(samples)} samples: whole {whole_size} bytes, delta {delta_size} bytes "
+          f"({whole_size / max(1, delta_size):.1f}x smaller), {encoder.stats()}")
@@ -0,0 +1,501 @@
+import os
+import sys
+import json
+import math
+import array
+import bisect
+import struct
+import logging
+import threading
+from metric_fields import flatten_metrics
+
+# Compressed block format for metric series, after Facebook's Gorilla paper:
+#   - timestamps (integer milliseconds) as delta-of-delta in variable-length bit buckets
+#   - float columns as the XOR of each value with the previous one
+#   - integral columns (such as interface counters) as zigzag deltas in varint bytes
+#
+# Block layout:
+#   MAGIC | varint rows | varint columns | varint length + timestamp payload
+#   then for every column: varint name length + name | kind byte | varint length + payload
+
+MAGIC = b"GOR1"
+
+KIND_FLOAT = 0
+KIND_INT = 1
+
+############################################################################################################################################################################################
+
+class BitWriter:
+    """
+    Appends values of arbitrary bit width, most significant bit first.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.current = 0
+        self.bits = 0
+
+    def write(self, value, count):
+        self.current = (self.current << count) | (value & ((1 << count) - 1))
+        self.bits += count
+        while self.bits >= 8:
+            self.bits -= 8
+            self.buffer.append((self.current >> self.bits) & 0xFF)
+        self.current &= (1 << self.bits) - 1
+
+    def getvalue(self):
+        if self.bits:
+            return bytes(self.buffer) + bytes([(self.current << (8 - self.bits)) & 0xFF])
+        return bytes(self.buffer)
+
+class BitReader:
+    """
+    Reads values written by a BitWriter.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def read(self, count):
+        first = self.position >> 3
+        last = (self.position + count + 7) >> 3
+        chunk = int.from_bytes(self.data[first:last], "big")
+        unused = (last << 3) - (self.position + count)
+        self.position += count
+        return (chunk >> unused) & ((1 << count) - 1)
+
+############################################################################################################################################################################################
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+def write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+def read_varint(data, position):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+############################################################################################################################################################################################
+
+# Delta-of-delta buckets: (prefix, prefix bits, value bits)
+TIMESTAMP_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12))
+
+def to_milliseconds(timestamp):
+    return int(round(timestamp * 1000))
+
+def encode_timestamps(timestamps):
+    """
+    Encodes non-decreasing timestamps (in seconds) as millisecond delta-of-deltas.
+    Samples taken at a fixed frequency cost about one bit each.
+    """
+    writer = BitWriter()
+    previous = previous_delta = 0
+    for index, timestamp in enumerate(timestamps):
+        value = to_milliseconds(timestamp)
+        if index == 0:
+            writer.write(value, 64)
+        elif index == 1:
+            previous_delta = value - previous
+            writer.write(zigzag(previous_delta), 64)
+        else:
+            delta = value - previous
+            encoded = zigzag(delta - previous_delta)
+            previous_delta = delta
+            if encoded == 0:
+                writer.write(0, 1)
+            else:
+                for prefix, prefix_bits, value_bits in TIMESTAMP_BUCKETS:
+                    if encoded < (1 << value_bits):
+                        writer.write(prefix, prefix_bits)
+                        writer.write(encoded, value_bits)
+                        break
+                else:
+                    writer.write(0b1111, 4)
+                    writer.write(encoded, 64)
+        previous = value
+    return writer.getvalue()
+
+def decode_timestamps(data, count):
+    reader = BitReader(data)
+    timestamps = []
+    previous = delta = 0
+    for index in range(count):
+        if index == 0:
+            value = reader.read(64)
+        elif index == 1:
+            delta = unzigzag(reader.read(64))
+            value = previous + delta
+        else:
+            if reader.read(1) == 0:
+                encoded = 0
+            elif reader.read(1) == 0:
+                encoded = reader.read(7)
+            elif reader.read(1) == 0:
+                encoded = reader.read(9)
+            elif reader.read(1) == 0:
+                encoded = reader.read(12)
+            else:
+                encoded = reader.read(64)
+            delta += unzigzag(encoded)
+            value = previous + delta
+        timestamps.append(value / 1000)
+        previous = value
+    return timestamps
+
+############################################################################################################################################################################################
+
+def encode_floats(values):
+    """
+    XOR-encodes float64 values: repeated values cost one bit, slowly changing ones only
+    their meaningful middle bits.
+    """
+    bits = memoryview(array.array("d", values)).cast("B").cast("Q")
+    writer = BitWriter()
+    previous = 0
+    previous_leading = previous_trailing = None
+
+    for index, value in enumerate(bits):
+        if index == 0:
+            writer.write(value, 64)
+            previous = value
+            continue
+
+        xor = value ^ previous
+        previous = value
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+
+        leading = min(64 - xor.bit_length(), 31)
+        trailing = (xor & -xor).bit_length() - 1
+        if previous_leading is not None and leading >= previous_leading and trailing >= previous_trailing:
+            writer.write(0b10, 2)
+            writer.write(xor >> previous_trailing, 64 - previous_leading - previous_trailing)
+        else:
+            meaningful = 64 - leading - trailing
+            writer.write(0b11, 2)
+            writer.write(leading, 5)
+            writer.write(meaningful - 1, 6)
+            writer.write(xor >> trailing, meaningful)
+            previous_leading, previous_trailing = leading, trailing
+
+    return writer.getvalue()
+
+def decode_floats(data, count):
+    reader = BitReader(data)
+    bits = array.array("Q")
+    previous = 0
+    leading = trailing = 0
+
+    for index in range(count):
+        if index == 0:
+            previous = reader.read(64)
+        elif reader.read(1) == 1:
+            if reader.read(1) == 1:
+                leading = reader.read(5)
+                meaningful = reader.read(6) + 1
+                trailing = 64 - leading - meaningful
+            previous ^= reader.read(64 - leading - trailing) << trailing
+        bits.append(previous)
+
+    return list(memoryview(bits).cast("B").cast("d"))
+
+############################################################################################################################################################################################
+
+def is_integral(values):
+    return all(not math.isnan(value) and not math.isinf(value) and value == int(value) and abs(value) < 2 ** 62 for value in values)
+
+def encode_ints(values):
+    """
+    Encodes integers as zigzag varint deltas: counters that change little take one or two bytes.
+    """
+    buffer = bytearray()
+    previous = 0
+    for value in values:
+        value = int(value)
+        write_varint(buffer, zigzag(value - previous))
+        previous = value
+    return bytes(buffer)
+
+def decode_ints(data, count):
+    values = []
+    previous = 0
+    position = 0
+    for _ in range(count):
+        encoded, position = read_varint(data, position)
+        previous += unzigzag(encoded)
+        values.append(float(previous))
+    return values
+
+############################################################################################################################################################################################
+
+def encode_block(timestamps, columns):
+    """
+    Encodes a block of rows: a list of timestamps and a dict of column name -> values.
+    Integral columns are varint-encoded, every other column is XOR-encoded.
+    """
+    buffer = bytearray(MAGIC)
+    write_varint(buffer, len(timestamps))
+    write_varint(buffer, len(columns))
+
+    payload = encode_timestamps(timestamps)
+    write_varint(buffer, len(payload))
+    buffer += payload
+
+    for name, values in columns.items():
+        encoded_name = name.encode()
+        write_varint(buffer, len(encoded_name))
+        buffer += encoded_name
+        if is_integral(values):
+            kind, payload = KIND_INT, encode_ints(values)
+        else:
+            kind, payload = KIND_FLOAT, encode_floats(values)
+        buffer.append(kind)
+        write_varint(buffer, len(payload))
+        buffer += payload
+
+    return bytes(buffer)
+
+def decode_block(data, columns=None):
+    """
+    Decodes a block into (timestamps, {column: values}). Only the requested columns are
+    decoded; the payloads of the others are skipped.
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a compressed metrics block")
+
+    position = len(MAGIC)
+    rows, position = read_varint(data, position)
+    count, position = read_varint(data, position)
+
+    length, position = read_varint(data, position)
+    timestamps = decode_timestamps(data[position:position + length], rows)
+    position += length
+
+    decoded = {}
+    for _ in range(count):
+        length, position = read_varint(data, position)
+        name = bytes(data[position:position + length]).decode()
+        position += length
+        kind = data[position]
+        position += 1
+        length, position = read_varint(data, position)
+        if columns is None or name in columns:
+            payload = data[position:position + length]
+            decoded[name] = decode_ints(payload, rows) if kind == KIND_INT else decode_floats(payload, rows)
+        position += length
+
+    return timestamps, decoded
+
+############################################################################################################################################################################################
+
+class BlockStore:
+    """
+    Per-agent files of compressed blocks, with a small index of (first timestamp, last timestamp,
+    offset, length) per block so a single block can be read without touching the others.
+    """
+
+    INDEX_ENTRY = struct.Struct("<ddQQ")
+
+    def __init__(self, folder, logger=None):
+        self.folder = folder
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+        # Use the provided logger or the root logger
+        self.logger = logger or logging.getLogger()
+
+############################################################################################################################################################################################
+
+    def blocks_path(self, agent_id):
+        return os.path.join(self.folder, f"agent{agent_id}.blocks")
+
+    def index_path(self, agent_id):
+        return os.path.join(self.folder, f"agent{agent_id}.blocks.idx")
+
+############################################################################################################################################################################################
+
+    def load_index(self, agent_id):
+        """
+        Loads the block index of an agent, dropping blocks torn by a crash. Must be called with the lock held.
+        """
+        index = self.indexes.get(agent_id)
+        if index is not None:
+            return index
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        blocks_path = self.blocks_path(agent_id)
+        blocks_size = os.path.getsize(blocks_path) if os.path.exists(blocks_path) else 0
+
+        index = []
+        if os.path.exists(self.index_path(agent_id)):
+            with open(self.index_path(agent_id), "rb") as file:
+                data = file.read()
+            for position in range(0, len(data) - self.INDEX_ENTRY.size + 1, self.INDEX_ENTRY.size):
+                entry = self.INDEX_ENTRY.unpack_from(data, position)
+                if entry[2] + entry[3] > blocks_size:
+                    break
+                index.append(entry)
+
+        end = index[-1][2] + index[-1][3] if index else 0
+        if blocks_size > end:
+            with open(blocks_path, "r+b") as file:
+                file.truncate(end)
+        self.write_index(agent_id, index)
+
+        self.indexes[agent_id] = index
+        return index
+
+    def write_index(self, agent_id, index):
+        with open(self.index_path(agent_id) + ".tmp", "wb") as file:
+            for entry in index:
+                file.write(self.INDEX_ENTRY.pack(*entry))
+        os.replace(self.index_path(agent_id) + ".tmp", self.index_path(agent_id))
+
+############################################################################################################################################################################################
+
+    def append(self, agent_id, timestamps, columns):
+        """
+        Compresses rows into a new block at the end of the agent's block file.
+        """
+        if not timestamps:
+            return
+
+        block = encode_block(timestamps, columns)
+        with self.lock:
+            index = self.load_index(agent_id)
+            with open(self.blocks_path(agent_id), "ab") as file:
+                offset = file.tell()
+                file.write(block)
+            entry = (timestamps[0], timestamps[-1], offset, len(block))
+            with open(self.index_path(agent_id), "ab") as file:
+                file.write(self.INDEX_ENTRY.pack(*entry))
+            index.append(entry)
+
+############################################################################################################################################################################################
+
+    def last_timestamp(self, agent_id):
+        with self.lock:
+            index = self.load_index(agent_id)
+            return index[-1][1] if index else None
+
+    def agent_ids(self):
+        if not os.path.exists(self.folder):
+            return []
+        return [name[len("agent"):-len(".blocks")] for name in os.listdir(self.folder) if name.endswith(".blocks")]
+
+############################################################################################################################################################################################
+
+    def read_block(self, agent_id, number, columns=None):
+        """
+        Decodes a single block of an agent (random access by block number).
+        """
+        with self.lock:
+            _, _, offset, length = self.load_index(agent_id)[number]
+        with open(self.blocks_path(agent_id), "rb") as file:
+            file.seek(offset)
+            return decode_block(file.read(length), columns)
+
+############################################################################################################################################################################################
+
+    def scan(self, agent_id, columns=None, start=None, end=None):
+        """
+        Returns the rows of an agent with start <= timestamp < end as a dict of lists,
+        including the "timestamp" column. Only overlapping blocks are read and decoded.
+        Stored timestamps are rounded to milliseconds, so the bounds are rounded the same way.
+        """
+        with self.lock:
+            index = list(self.load_index(agent_id))
+
+        first = 0 if start is None else bisect.bisect_left([entry[1] for entry in index], start)
+        start_ms = None if start is None else to_milliseconds(start) / 1000
+        end_ms = None if end is None else to_milliseconds(end) / 1000
+        result = {"timestamp": []}
+        for number in range(first, len(index)):
+            if end is not None and index[number][0] >= end:
+                break
+            timestamps, decoded = self.read_block(agent_id, number, columns)
+            rows = [row for row, timestamp in enumerate(timestamps)
+                    if (start_ms is None or timestamp >= start_ms) and (end_ms is None or timestamp < end_ms)]
+            count = len(result["timestamp"])
+            result["timestamp"].extend(timestamps[row] for row in rows)
+            names = columns if columns is not None else (set(result) | set(decoded)) - {"timestamp"}
+            for name in names:
+                column = result.setdefault(name, [math.nan] * count)
+                values = decoded.get(name)
+                column.extend(values[row] for row in rows) if values else column.extend([math.nan] * len(rows))
+        return result
+
+############################################################################################################################################################################################
+
+    def trim(self, agent_id, before, min_fraction=0.25):
+        """
+        Drops whole blocks whose rows are all older than `before`. The block file is only rewritten
+        once the expired blocks make up at least `min_fraction` of it.
+        """
+        with self.lock:
+            index = self.load_index(agent_id)
+            dropped = bisect.bisect_left([entry[1] for entry in index], before)
+            if dropped == 0:
+                return 0
+
+            size = index[-1][2] + index[-1][3]
+            offset = index[dropped][2] if dropped < len(index) else size
+            if offset < size * min_fraction:
+                return 0
+
+            blocks_path = self.blocks_path(agent_id)
+            with open(blocks_path, "rb") as source, open(blocks_path + ".tmp", "wb") as target:
+                source.seek(offset)
+                target.write(source.read())
+            os.replace(blocks_path + ".tmp", blocks_path)
+
+            index[:] = [(first, last, start - offset, length) for first, last, start, length in index[dropped:]]
+            self.write_index(agent_id, index)
+            return dropped
+
+############################################################################################################################################################################################
+
+if __name__ == "__main__":
+    # Usage: python gorilla.py <agentN_metrics_collected.json | .jsonl>
+    # Compares the size of a metrics file with the same numeric series in compressed blocks.
+    file_path = sys.argv[1]
+    with open(file_path, "r") as file:
+        if file_path.endswith(".jsonl"):
+            samples = [json.loads(line) for line in file if line.strip()]
+        else:
+            samples = json.load(file)
+
+    rows = [flatten_metrics(sample) for sample in samples]
+    names = sorted({name for row in rows for name in row})
+    timestamps = [sample.get("timestamp", index * 20.0) for index, sample in enumerate(samples)]
+    columns = {name: [row.get(name, math.nan) for row in rows] for name in names}
+
+    block = encode_block(timestamps, columns)
+    decoded_timestamps, decoded = decode_block(block)
+    assert all(
+        (math.isnan(a) and math.isnan(b)) or a == b
+        for name in names for a, b in zip(columns[name], decoded[name])
+    )
+
+    original = os.path.getsize(file_path)
+    print(f"{len(samples)} samples, {len(names)} series")
+    print(f"{file_path}: {original} bytes")
+    print(f"compressed block: {len(block)} bytes ({original / len(block):.1f}x smaller)")
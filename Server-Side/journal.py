@@ -0,0 +1,377 @@
+import os
+import json
+import time
+import logging
+import threading
+
+class Journal:
+    """
+    An append-only, line-delimited JSON (JSON Lines) journal.
+    Every record is written as a single line at the end of the file, so the cost of
+    storing a record does not depend on how many records are already stored.
+    """
+
+    FSYNC_ALWAYS = "always"        # fsync after every write (safest, slowest)
+    FSYNC_INTERVAL = "interval"    # fsync at most once every `fsync_interval` seconds
+    FSYNC_NEVER = "never"          # leave it to the OS page cache
+
+    FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+    def __init__(self, file_path, fsync_policy=FSYNC_INTERVAL, fsync_interval=1.0, logger=None):
+        if fsync_policy not in self.FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+
+        self.file_path = file_path
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.last_fsync = time.monotonic()
+        self.lock = threading.Lock()
+
+        # Use the provided logger or the root logger
+        self.logger = logger or logging.getLogger()
+
+        folder = os.path.dirname(file_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.recover()
+        self.file = open(file_path, "ab")
+
+############################################################################################################################################################################################
+
+    def recover(self, chunk_size=65536):
+        """
+        Drops a torn or corrupt last record left behind by a crash in the middle of a write.
+        Only the tail of the file is read, so recovery is cheap however large the journal is.
+        """
+        if not os.path.exists(self.file_path):
+            return
+
+        with open(self.file_path, "r+b") as file:
+            size = file.seek(0, os.SEEK_END)
+
+            while size > 0:
+                # Find the start of the last line (the one ending at `size`)
+                file.seek(size - 1)
+                ends_with_newline = file.read(1) == b"\n"
+                end = size - 1 if ends_with_newline else size
+
+                start = end
+                while start > 0:
+                    read_from = max(0, start - chunk_size)
+                    file.seek(read_from)
+                    chunk = file.read(start - read_from)
+                    newline = chunk.rfind(b"\n")
+                    if newline != -1:
+                        start = read_from + newline + 1
+                        break
+                    start = read_from
+
+                file.seek(start)
+                last_line = file.read(end - start)
+
+                if ends_with_newline:
+                    try:
+                        json.loads(last_line)
+                        break  # The last record is complete and valid
+                    except ValueError:
+                        pass
+
+                self.logger.warning(f"Discarding torn record at offset {start} in {self.file_path}.")
+                file.truncate(start)
+                size = start
+
+############################################################################################################################################################################################
+
+    def encode(self, record):
+        return (json.dumps(record, separators=(",", ":")) + "\n").encode()
+
+############################################################################################################################################################################################
+
+    def append(self, record):
+        """
+        Appends a single record and returns the byte offset it was written at.
+        """
+        return self.append_many([record])[0]
+
+############################################################################################################################################################################################
+
+    def append_many(self, records):
+        """
+        Appends several records with a single write and returns the byte offset of each one.
+        """
+        lines = [self.encode(record) for record in records]
+        offsets = []
+
+        with self.lock:
+            offset = self.file.tell()
+            for line in lines:
+                offsets.append(offset)
+                offset += len(line)
+
+            self.file.write(b"".join(lines))
+            self.file.flush()
+            self.maybe_fsync()
+
+        return offsets
+
+############################################################################################################################################################################################
+
+    def maybe_fsync(self):
+        """
+        Applies the fsync policy after a write. Must be called with the lock held.
+        """
+        if self.fsync_policy == self.FSYNC_ALWAYS:
+            os.fsync(self.file.fileno())
+            self.last_fsync = time.monotonic()
+        elif self.fsync_policy == self.FSYNC_INTERVAL:
+            now = time.monotonic()
+            if now - self.last_fsync >= self.fsync_interval:
+                os.fsync(self.file.fileno())
+                self.last_fsync = now
+
+############################################################################################################################################################################################
+
+    def sync(self):
+        """
+        Forces everything written so far onto disk.
+        """
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.last_fsync = time.monotonic()
+
+############################################################################################################################################################################################
+
+    def read(self, offset=0):
+        """
+        Yields every record stored in the journal, starting at the given byte offset.
+        """
+        for _, record in self.scan(offset):
+            yield record
+
+    def scan(self, offset=0):
+        """
+        Yields (offset, record) for every record stored in the journal, starting at the given byte offset.
+        """
+        with self.lock:
+            self.file.flush()
+
+        yield from self.scan_file(self.file_path, offset, self.logger)
+
+############################################################################################################################################################################################
+
+    def read_forward(self, offset, count):
+        """
+        Returns up to `count` (offset, record) pairs starting at the given byte offset.
+        """
+        entries = []
+        if count <= 0:
+            return entries
+        for entry in self.scan(offset):
+            entries.append(entry)
+            if len(entries) >= count:
+                break
+        return entries
+
+    def read_backward(self, offset, count, chunk_size=65536):
+        """
+        Returns up to `count` (offset, record) pairs stored right before the given byte offset
+        (which must be the start of a record), oldest first. Only the needed tail is read.
+        """
+        with self.lock:
+            self.file.flush()
+
+        data = b""
+        position = offset
+        with open(self.file_path, "rb") as file:
+            # Read chunks backwards until they hold `count` complete lines (or the file start)
+            while position > 0 and data.count(b"\n") <= count:
+                read_from = max(0, position - chunk_size)
+                file.seek(read_from)
+                data = file.read(position - read_from) + data
+                position = read_from
+
+        lines = data.split(b"\n")[:-1]
+        if position > 0:
+            lines = lines[1:]  # The first line may be cut in half
+
+        entries = []
+        line_offset = offset
+        for line in reversed(lines[-count:] if count > 0 else []):
+            line_offset -= len(line) + 1
+            try:
+                entries.append((line_offset, json.loads(line)))
+            except ValueError:
+                self.logger.warning(f"Skipping corrupt record in {self.file_path}.")
+        entries.reverse()
+        return entries
+
+############################################################################################################################################################################################
+
+    def read_at(self, offset):
+        """
+        Reads the single record stored at the given byte offset.
+        """
+        with self.lock:
+            self.file.flush()
+
+        with open(self.file_path, "rb") as file:
+            file.seek(offset)
+            return json.loads(file.readline())
+
+    def read_offsets(self, offsets):
+        """
+        Reads the records stored at the given byte offsets in one sequential pass over the file,
+        from the first offset to the last, parsing only those records. Returns them in the order
+        of `offsets`.
+        """
+        if not offsets:
+            return []
+
+        with self.lock:
+            self.file.flush()
+
+        wanted = set(offsets)
+        last = max(wanted)
+        records = {}
+        with open(self.file_path, "rb") as file:
+            offset = min(wanted)
+            file.seek(offset)
+            for line in file:
+                if offset in wanted:
+                    records[offset] = json.loads(line)
+                if offset >= last:
+                    break
+                offset += len(line)
+        return [records[offset] for offset in offsets]
+
+############################################################################################################################################################################################
+
+    @staticmethod
+    def read_file(file_path, offset=0, logger=None):
+        """
+        Yields the records of a journal file without opening it for writing.
+        """
+        for _, record in Journal.scan_file(file_path, offset, logger):
+            yield record
+
+    @staticmethod
+    def scan_file(file_path, offset=0, logger=None):
+        """
+        Yields (offset, record) for the records of a journal file without opening it for writing.
+        """
+        logger = logger or logging.getLogger()
+        if not os.path.exists(file_path):
+            return
+
+        with open(file_path, "rb") as file:
+            file.seek(offset)
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break  # Torn record still being written
+                try:
+                    yield offset, json.loads(line)
+                except ValueError:
+                    logger.warning(f"Skipping corrupt record in {file_path}.")
+                offset += len(line)
+
+############################################################################################################################################################################################
+
+    def size(self):
+        """
+        Returns the size of the journal in bytes.
+        """
+        with self.lock:
+            return self.file.tell()
+
+############################################################################################################################################################################################
+
+    def trim(self, offset, keep=()):
+        """
+        Drops every record before the given byte offset (which must be the start of a record),
+        except the `keep` records, which are written first. The rest of the journal is copied to a
+        new file that atomically replaces the old one. Returns the size of the kept records in bytes.
+        """
+        kept = b"".join(self.encode(record) for record in keep)
+        with self.lock:
+            self.file.flush()
+            with open(self.file_path, "rb") as source, open(self.file_path + ".tmp", "wb") as target:
+                target.write(kept)
+                source.seek(offset)
+                while True:
+                    chunk = source.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                target.flush()
+                if self.fsync_policy != self.FSYNC_NEVER:
+                    os.fsync(target.fileno())
+
+            self.file.close()
+            os.replace(self.file_path + ".tmp", self.file_path)
+            self.file = open(self.file_path, "ab")
+        return len(kept)
+
+    def rewrite(self, records):
+        """
+        Replaces every record with the given ones. The new file atomically replaces the old one.
+        """
+        lines = b"".join(self.encode(record) for record in records)
+        with self.lock:
+            with open(self.file_path + ".tmp", "wb") as target:
+                target.write(lines)
+                target.flush()
+                if self.fsync_policy != self.FSYNC_NEVER:
+                    os.fsync(target.fileno())
+
+            self.file.close()
+            os.replace(self.file_path + ".tmp", self.file_path)
+            self.file = open(self.file_path, "ab")
+
+############################################################################################################################################################################################
+
+    @classmethod
+    def import_json_array(cls, json_path, journal_path, logger=None):
+        """
+        One-time import of a legacy JSON array file (as written by the old
+        `Storage.store_metrics_in_file`) into a new journal file.
+        Returns the number of imported records.
+        """
+        logger = logger or logging.getLogger()
+
+        try:
+            with open(json_path, "r") as file:
+                records = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Failed to import {json_path}: {e}")
+            return 0
+
+        if not isinstance(records, list):
+            records = [records]
+
+        # Write to a temporary file first so a crash never leaves a half imported journal
+        tmp_path = journal_path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            for record in records:
+                file.write((json.dumps(record, separators=(",", ":")) + "\n").encode())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, journal_path)
+
+        logger.info(f"Imported {len(records)} records from {json_path} into {journal_path}.")
+        return len(records)
+
+############################################################################################################################################################################################
+
+    def close(self):
+        """
+        Flushes and closes the journal file.
+        """
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.flush()
+            if self.fsync_policy != self.FSYNC_NEVER:
+                os.fsync(self.file.fileno())
+            self.file.close()
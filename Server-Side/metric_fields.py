@@ -0,0 +1,101 @@
+import math
+
+# Counters reported by the agents for every monitored interface
+INTERFACE_COUNTERS = ("bytes_sent", "bytes_recv", "packets_sent", "packets_recv", "dropin", "dropout")
+
+# Link metrics reported by the agents (parsed from iperf and ping output)
+LINK_FIELDS = ("bandwidth", "jitter", "packet_loss", "latency")
+
+BANDWIDTH_UNITS = {
+    "bits/sec": 1.0,
+    "Kbits/sec": 1e3,
+    "Mbits/sec": 1e6,
+    "Gbits/sec": 1e9,
+}
+
+############################################################################################################################################################################################
+
+def parse_number(value):
+    """
+    Parses a plain number, or the leading number of a string such as "0.022 ms".
+    Returns NaN when no value is available.
+    """
+    if value is None or isinstance(value, bool):
+        return math.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).split()[0])
+    except (ValueError, IndexError):
+        return math.nan
+
+############################################################################################################################################################################################
+
+def parse_bandwidth(value):
+    """
+    Parses an iperf bandwidth string such as "67.8 Gbits/sec" into bits per second.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    try:
+        number, unit = str(value).split()
+        return float(number) * BANDWIDTH_UNITS[unit]
+    except (ValueError, KeyError):
+        return math.nan
+
+############################################################################################################################################################################################
+
+def parse_packet_loss(value):
+    """
+    Parses an iperf packet loss string such as "0/894 (0%)" into a percentage.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if not value or "(" not in str(value):
+        return math.nan
+    try:
+        return float(str(value).split("(")[1].strip(")% "))
+    except ValueError:
+        return math.nan
+
+############################################################################################################################################################################################
+
+def flatten_metrics(metrics):
+    """
+    Flattens a metrics sample sent by an agent into a dict of numeric fields:
+    cpu_usage, ram_usage, interface_stats.<iface>.<counter>, bandwidth, jitter, packet_loss and latency.
+    Missing or unparseable values are left out.
+    """
+    fields = {}
+
+    for name in ("cpu_usage", "ram_usage"):
+        value = parse_number(metrics.get(name))
+        if not math.isnan(value):
+            fields[name] = value
+
+    for iface, stats in (metrics.get("interface_stats") or {}).items():
+        if not isinstance(stats, dict):
+            continue
+        for counter in INTERFACE_COUNTERS:
+            value = parse_number(stats.get(counter))
+            if not math.isnan(value):
+                fields[f"interface_stats.{iface}.{counter}"] = value
+
+    link_metrics = metrics.get("link_metrics") or {}
+    bandwidth = link_metrics.get("bandwidth") or {}
+    latency = link_metrics.get("latency") or {}
+    if isinstance(bandwidth, dict):
+        values = {
+            "bandwidth": parse_bandwidth(bandwidth.get("bandwidth")),
+            "jitter": parse_number(bandwidth.get("jitter")),
+            "packet_loss": parse_packet_loss(bandwidth.get("packet_loss")),
+        }
+        for name, value in values.items():
+            if not math.isnan(value):
+                fields[name] = value
+    if isinstance(latency, dict):
+        value = parse_number(latency.get("latency"))
+        if not math.isnan(value):
+            fields["latency"] = value
+
+    return fields
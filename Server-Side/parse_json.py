@@ -1,4 +1,5 @@
 import json
+import hashlib
 
 class DeviceMetrics:
     def __init__(self, cpu_usage, ram_usage, interface_stats):
@@ -41,11 +42,61 @@ class Device:
         return f"Device(device_id={self.device_id}, device_metrics={self.device_metrics}, link_metrics={self.link_metrics}, alertflow_conditions={self.alertflow_conditions})"
 
 class TaskConfig:
-    def __init__(self, task_id, frequency, devices):
+    def __init__(self, task_id, frequency, devices, batch_size=1, batch_interval=None):
         self.task_id = task_id
         self.frequency = frequency
         self.devices = devices
 
+        # Agents send their samples in batches of batch_size, or every batch_interval seconds
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+        # Devices by ID, and the task of every device serialized once with the hash of its content,
+        # so dispatching and retransmitting a task is a lookup and a send of ready-made bytes
+        self.devices_by_id = {device.device_id: device for device in devices}
+        self.tasks = {device.device_id: self.build_task(device) for device in devices}
+
+    def batch_span(self):
+        """
+        Returns the longest time (seconds) a sample may wait in an agent's batch before it is sent.
+        """
+        spans = []
+        if self.batch_size and self.batch_size > 1:
+            spans.append((self.batch_size - 1) * self.frequency)
+        if self.batch_interval:
+            # The batch is only checked when a sample is collected
+            spans.append(self.batch_interval + self.frequency)
+        return min(spans) if spans else 0.0
+
+    def build_task(self, device):
+        """
+        Returns the task sent to the agent of a device, as JSON bytes, and the hash of its content.
+        The task carries its hash, which the agent echoes in its task_ack, so an ACK is matched to
+        the version of the task it answers.
+        """
+        task_data = {
+            "task_id": self.task_id,
+            "frequency": self.frequency,
+            "batch_size": self.batch_size,
+            "batch_interval": self.batch_interval,
+            "device_id": device.device_id,
+            "device_metrics": vars(device.device_metrics),
+            "link_metrics": vars(device.link_metrics),
+            "alertflow_conditions": vars(device.alertflow_conditions),
+        }
+        task_hash = hashlib.sha256(json.dumps(task_data, sort_keys=True).encode()).hexdigest()[:16]
+        task_data["task_hash"] = task_hash
+        return json.dumps(task_data, sort_keys=True).encode(), task_hash
+
+    def device(self, device_id):
+        return self.devices_by_id.get(device_id)
+
+    def task(self, device_id):
+        """
+        Returns (payload, hash) of the task of a device, or None if the device is not configured.
+        """
+        return self.tasks.get(device_id)
+
     @classmethod
     def from_json(cls, file_path):
         try:
@@ -91,11 +142,17 @@ class TaskConfig:
                 )
                 devices.append(device)
 
-            return cls(task_id=task_id, frequency=frequency, devices=devices)
+            return cls(
+                task_id=task_id,
+                frequency=frequency,
+                devices=devices,
+                batch_size=data.get("batch_size", 1),
+                batch_interval=data.get("batch_interval")
+            )
 
         except (FileNotFoundError, json.JSONDecodeError) as e:
             print(f"[ERROR] Failed  JSON file: {e}")
             return None
 
     def __repr__(self):
-        return f"TaskConfig(task_id={self.task_id}, frequency={self.frequency}, devices={self.devices})"
+        return f"TaskConfig(task_id={self.task_id}, frequency={self.frequency}, devices={self.devices}, batch_size={self.batch_size}, batch_interval={self.batch_interval})"
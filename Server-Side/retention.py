@@ -0,0 +1,290 @@
+import os
+import math
+import time
+import logging
+import threading
+from column_store import ColumnStore
+from gorilla import BlockStore
+
+# Aggregates kept for every metric in a rollup tier
+AGGREGATES = ("min", "max", "avg", "count", "last")
+
+class RollupTier:
+    """
+    A downsampled copy of the metrics: one row of min/max/avg/count/last per metric and per
+    `resolution` seconds, kept for `retention` seconds.
+    """
+
+    def __init__(self, name, resolution, retention):
+        self.name = name
+        self.resolution = resolution
+        self.retention = retention
+
+    def __repr__(self):
+        return f"RollupTier(name={self.name}, resolution={self.resolution}, retention={self.retention})"
+
+############################################################################################################################################################################################
+
+class RetentionPolicy:
+    """
+    How long raw samples are kept, and which rollup tiers are built from them.
+    Tiers must be ordered from the finest to the coarsest resolution; each tier is rolled up
+    from the previous one (the first one from the raw samples).
+    Raw samples are also archived at full resolution in compressed blocks of `block_rows` rows,
+    kept for `archive_retention` seconds (0 disables the archive).
+    """
+
+    def __init__(self, raw_retention=24 * 3600, tiers=None, archive_retention=30 * 24 * 3600, block_rows=1024):
+        self.raw_retention = raw_retention
+        self.archive_retention = archive_retention
+        self.block_rows = block_rows
+        self.tiers = tiers if tiers is not None else [
+            RollupTier("1m", 60, 30 * 24 * 3600),
+            RollupTier("1h", 3600, 365 * 24 * 3600),
+        ]
+
+    def __repr__(self):
+        return f"RetentionPolicy(raw_retention={self.raw_retention}, archive_retention={self.archive_retention}, tiers={self.tiers})"
+
+############################################################################################################################################################################################
+
+class Compactor:
+    """
+    Background compactor that turns raw samples into rollups and drops data older than the
+    retention of its tier, so disk use levels off instead of growing forever.
+    """
+
+    def __init__(self, raw_store, folder, policy=None, interval=60, grace=5, logger=None):
+        self.raw_store = raw_store
+        self.policy = policy or RetentionPolicy()
+        self.interval = interval
+        self.grace = grace  # Samples may still be in the write-behind queue this long after ingest
+        self.max_backdate = 0  # Samples may be stamped up to this long before their ingest
+        self.stores = {tier.name: ColumnStore(os.path.join(folder, tier.name), logger) for tier in self.policy.tiers}
+        self.archive = BlockStore(os.path.join(folder, "archive"), logger) if self.policy.archive_retention else None
+
+        # Called with (agent_id, before) whenever raw retention is applied, so other copies of
+        # the raw samples (such as the journal) can expire too
+        self.on_raw_trim = None
+
+        # Use the provided logger or the root logger
+        self.logger = logger or logging.getLogger()
+
+        self.stop_event = threading.Event()
+        self.compactor_thread = None
+
+############################################################################################################################################################################################
+
+    def start(self):
+        """
+        Starts the background compaction thread.
+        """
+        if self.compactor_thread:
+            return
+        self.stop_event.clear()
+        self.compactor_thread = threading.Thread(target=self.run_compactor, daemon=True)
+        self.compactor_thread.start()
+        self.logger.info(f"Compactor started with {self.policy}.")
+
+    def run_compactor(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.compact()
+            except Exception as e:
+                self.logger.error(f"Compaction failed: {e}")
+
+############################################################################################################################################################################################
+
+    def compact(self, now=None):
+        """
+        Runs one compaction pass over every agent: rolls up every complete bucket of every tier,
+        then applies the retention of the raw samples and of each tier.
+        """
+        now = time.time() if now is None else now
+
+        for agent_id in self.raw_store.agent_ids():
+            source = self.raw_store
+            source_is_raw = True
+            for tier in self.policy.tiers:
+                store = self.stores[tier.name]
+                rows = self.rollup(agent_id, source, source_is_raw, store, tier, now)
+                if rows:
+                    self.logger.info(f"Rolled up {rows} {tier.name} buckets for agent {agent_id}.")
+                source, source_is_raw = store, False
+
+            if self.archive:
+                rows = self.archive_rows(agent_id, now)
+                if rows:
+                    self.logger.info(f"Archived {rows} raw samples of agent {agent_id} in compressed blocks.")
+                self.archive.trim(agent_id, now - self.policy.archive_retention)
+
+            before = self.raw_trim_bound(agent_id, now - self.policy.raw_retention)
+            if before is not None:
+                self.raw_store.trim(agent_id, before)
+                if self.on_raw_trim:
+                    self.on_raw_trim(agent_id, before)
+            for tier in self.policy.tiers:
+                self.stores[tier.name].trim(agent_id, now - tier.retention)
+
+    def raw_trim_bound(self, agent_id, before):
+        """
+        Limits a raw trim to the samples kept elsewhere: archived at full resolution, or without an
+        archive rolled up into the first tier. Returns None when nothing may be trimmed yet.
+        """
+        if self.archive:
+            last_archived = self.archive.last_timestamp(agent_id)
+            if last_archived is None:
+                return None
+            return min(before, math.nextafter(last_archived, math.inf))
+        if self.policy.tiers:
+            tier = self.policy.tiers[0]
+            last_bucket = self.stores[tier.name].last_timestamp(agent_id)
+            if last_bucket is None:
+                return None
+            return min(before, last_bucket + tier.resolution)
+        return before
+
+############################################################################################################################################################################################
+
+    def rollup(self, agent_id, source, source_is_raw, store, tier, now):
+        """
+        Aggregates the rows of `source` into `tier` buckets, from the bucket after the last
+        one already in `store` up to the last complete bucket. A bucket is complete once no
+        backdated sample can land in it anymore. Returns the number of new buckets.
+        """
+        last_bucket = store.last_timestamp(agent_id)
+        start = None if last_bucket is None else last_bucket + tier.resolution
+        end = math.floor((now - self.grace - self.max_backdate) / tier.resolution) * tier.resolution
+
+        data = source.scan(agent_id, start=start, end=end)
+        timestamps = data.pop(ColumnStore.TIMESTAMP)
+        if len(timestamps) == 0:
+            return 0
+
+        # Group source columns by metric: raw columns hold plain values, rollup columns one aggregate each
+        metrics = {}
+        for column, values in data.items():
+            if source_is_raw:
+                metrics.setdefault(column, {})["value"] = values
+            else:
+                metric, aggregate = column.rsplit(".", 1)
+                metrics.setdefault(metric, {})[aggregate] = values
+
+        rows = []
+        first = 0
+        while first < len(timestamps):
+            bucket = math.floor(timestamps[first] / tier.resolution) * tier.resolution
+            last = first
+            while last < len(timestamps) and timestamps[last] < bucket + tier.resolution:
+                last += 1
+
+            fields = {}
+            for metric, columns in metrics.items():
+                aggregates = self.aggregate(columns, first, last, source_is_raw)
+                if aggregates:
+                    for aggregate, value in aggregates.items():
+                        fields[f"{metric}.{aggregate}"] = value
+            rows.append((bucket, fields))
+            first = last
+
+        store.append_rows(agent_id, rows)
+        return len(rows)
+
+############################################################################################################################################################################################
+
+    def archive_rows(self, agent_id, now):
+        """
+        Compresses raw rows not archived yet into blocks of `block_rows` rows. Rows about to
+        expire from the raw columns are archived even if they do not fill a whole block.
+        Returns the number of archived rows.
+        """
+        last_archived = self.archive.last_timestamp(agent_id)
+        data = self.raw_store.scan(agent_id, start=last_archived)
+        timestamps = list(data.pop(ColumnStore.TIMESTAMP))
+
+        first = 0
+        if last_archived is not None:
+            while first < len(timestamps) and timestamps[first] <= last_archived:
+                first += 1
+
+        expiring = now - self.policy.raw_retention
+        archived = 0
+        while first < len(timestamps):
+            last = min(first + self.policy.block_rows, len(timestamps))
+            if last - first < self.policy.block_rows and timestamps[first] >= expiring:
+                break  # Wait for a full block unless the rows are about to be trimmed
+            columns = {column: list(values[first:last]) for column, values in data.items()}
+            self.archive.append(agent_id, timestamps[first:last], columns)
+            archived += last - first
+            first = last
+        return archived
+
+############################################################################################################################################################################################
+
+    def aggregate(self, columns, first, last, source_is_raw):
+        """
+        Computes min/max/avg/count/last over rows [first, last) of one metric, skipping NaN.
+        Rollup rows are merged: avg is weighted by count.
+        """
+        minimum, maximum, total, count, latest = math.inf, -math.inf, 0.0, 0, math.nan
+
+        for row in range(first, last):
+            if source_is_raw:
+                value = columns["value"][row]
+                if math.isnan(value):
+                    continue
+                row_min = row_max = row_last = value
+                row_count = 1
+                row_total = value
+            else:
+                row_count = columns["count"][row] if "count" in columns else math.nan
+                if math.isnan(row_count) or row_count == 0:
+                    continue
+                row_min, row_max, row_last = columns["min"][row], columns["max"][row], columns["last"][row]
+                row_total = columns["avg"][row] * row_count
+
+            minimum = min(minimum, row_min)
+            maximum = max(maximum, row_max)
+            total += row_total
+            count += row_count
+            latest = row_last
+
+        if count == 0:
+            return None
+        return {"min": minimum, "max": maximum, "avg": total / count, "count": count, "last": latest}
+
+############################################################################################################################################################################################
+
+    def choose_tier(self, start, end=None, max_points=1000, sample_interval=1, now=None):
+        """
+        Picks the finest source ("raw" or a tier name) that still holds data from `start`
+        and answers the range with at most about `max_points` rows per agent.
+        `sample_interval` is how often the agents send raw samples, in seconds.
+        Without a `start` the range reaches back as far as the data, which the coarsest tier keeps longest.
+        """
+        if start is None:
+            return self.policy.tiers[-1].name if self.policy.tiers else "raw"
+
+        now = time.time() if now is None else now
+        end = now if end is None else end
+        span = max(0, end - start)
+
+        if start >= now - self.policy.raw_retention and span / sample_interval <= max_points:
+            return "raw"
+        for tier in self.policy.tiers:
+            if start >= now - tier.retention and span / tier.resolution <= max_points:
+                return tier.name
+        return self.policy.tiers[-1].name if self.policy.tiers else "raw"
+
+############################################################################################################################################################################################
+
+    def close(self):
+        """
+        Stops the compaction thread and closes the rollup stores.
+        """
+        self.stop_event.set()
+        if self.compactor_thread:
+            self.compactor_thread.join()
+            self.compactor_thread = None
+        for store in self.stores.values():
+            store.close()
@@ -0,0 +1,119 @@
+import math
+import array
+import threading
+from metric_fields import flatten_metrics
+
+class MetricsRingBuffer:
+    """
+    A fixed-capacity ring buffer holding the most recent metrics of one agent.
+    Every numeric metric gets its own array-backed ring, aligned slot by slot with a timestamp
+    ring and a ring of the original samples, so memory use only depends on the capacity.
+    Once full, every new sample overwrites the oldest one.
+    """
+
+    def __init__(self, capacity):
+        if capacity <= 0:
+            raise ValueError("Ring buffer capacity must be positive")
+
+        self.capacity = capacity
+        self.start = 0  # Physical slot of the oldest sample
+        self.size = 0
+        self.timestamps = array.array("d", [math.nan]) * capacity
+        self.samples = [None] * capacity
+        self.columns = {}
+        self.lock = threading.Lock()
+
+############################################################################################################################################################################################
+
+    def __len__(self):
+        return self.size
+
+    def slot(self, position):
+        """
+        Returns the physical slot of the sample at a logical position (0 is the oldest).
+        """
+        return (self.start + position) % self.capacity
+
+############################################################################################################################################################################################
+
+    def append(self, timestamp, metrics):
+        """
+        Adds a sample, overwriting the oldest one when the buffer is full.
+        """
+        fields = flatten_metrics(metrics)
+
+        with self.lock:
+            if self.size < self.capacity:
+                slot = self.slot(self.size)
+                self.size += 1
+            else:
+                slot = self.start
+                self.start = (self.start + 1) % self.capacity
+
+            # Keep timestamps non-decreasing so windows can be found by bisecting
+            if self.size > 1:
+                timestamp = max(timestamp, self.timestamps[self.slot(self.size - 2)])
+            self.timestamps[slot] = timestamp
+            self.samples[slot] = metrics
+
+            for column, values in self.columns.items():
+                values[slot] = fields.get(column, math.nan)
+            for column, value in fields.items():
+                if column not in self.columns:
+                    values = array.array("d", [math.nan]) * self.capacity
+                    values[slot] = value
+                    self.columns[column] = values
+
+############################################################################################################################################################################################
+
+    def first_position(self, since):
+        """
+        Returns the logical position of the first sample with timestamp >= since. Must be called with the lock held.
+        """
+        if since is None:
+            return 0
+
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[self.slot(middle)] < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+############################################################################################################################################################################################
+
+    def recent_samples(self, since=None, last=None):
+        """
+        Returns the buffered samples (oldest first) newer than `since` and/or the `last` ones.
+        """
+        with self.lock:
+            first = self.first_position(since)
+            if last is not None:
+                first = max(first, self.size - last)
+            return [self.samples[self.slot(position)] for position in range(first, self.size)]
+
+############################################################################################################################################################################################
+
+    def series(self, column, since=None, last=None):
+        """
+        Returns (timestamps, values) of one numeric metric, oldest first.
+        Missing values are NaN.
+        """
+        with self.lock:
+            first = self.first_position(since)
+            if last is not None:
+                first = max(first, self.size - last)
+            values = self.columns.get(column)
+            slots = [self.slot(position) for position in range(first, self.size)]
+            timestamps = [self.timestamps[slot] for slot in slots]
+            if values is None:
+                return timestamps, [math.nan] * len(slots)
+            return timestamps, [values[slot] for slot in slots]
+
+############################################################################################################################################################################################
+
+    def metric_names(self):
+        with self.lock:
+            return sorted(self.columns)
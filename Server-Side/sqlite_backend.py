@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import sqlite3
+import logging
+import threading
+from journal import Journal
+from metric_fields import flatten_metrics
+
+class SQLiteBackend:
+    """
+    Stores agent metrics in a local SQLite database instead of per-agent JSON files.
+    Every sample is kept whole in `samples` and its numeric fields in `metric_values`,
+    so aggregations such as "avg cpu per agent over the last hour" run in SQL.
+    Samples without a timestamp (imported from before samples were timestamped) are stored
+    with a NULL timestamp, so no time range matches them and they are never trimmed.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS samples (
+            id INTEGER PRIMARY KEY,
+            agent_id TEXT NOT NULL,
+            timestamp REAL,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS metric_values (
+            sample_id INTEGER NOT NULL,
+            agent_id TEXT NOT NULL,
+            timestamp REAL,
+            metric TEXT NOT NULL,
+            value REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS imported_files (
+            path TEXT PRIMARY KEY,
+            records INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS samples_agent_time ON samples (agent_id, timestamp);
+        CREATE INDEX IF NOT EXISTS values_agent_time_metric ON metric_values (agent_id, timestamp, metric);
+        CREATE INDEX IF NOT EXISTS values_metric_time ON metric_values (metric, timestamp);
+    """
+
+    # Databases created with NOT NULL timestamps stored missing ones as 0.0
+    MIGRATE_NULL_TIMESTAMPS = """
+        BEGIN;
+        DROP INDEX samples_agent_time;
+        DROP INDEX values_agent_time_metric;
+        DROP INDEX values_metric_time;
+        ALTER TABLE samples RENAME TO samples_old;
+        ALTER TABLE metric_values RENAME TO metric_values_old;
+        {schema}
+        INSERT INTO samples SELECT id, agent_id, NULLIF(timestamp, 0.0), data FROM samples_old;
+        INSERT INTO metric_values SELECT sample_id, agent_id, NULLIF(timestamp, 0.0), metric, value FROM metric_values_old;
+        DROP TABLE samples_old;
+        DROP TABLE metric_values_old;
+        COMMIT;
+    """
+
+    INSERT_SAMPLE = "INSERT INTO samples (id, agent_id, timestamp, data) VALUES (?, ?, ?, ?)"
+    INSERT_VALUE = "INSERT INTO metric_values (sample_id, agent_id, timestamp, metric, value) VALUES (?, ?, ?, ?, ?)"
+
+    AGGREGATES = {"avg": "AVG", "min": "MIN", "max": "MAX", "count": "COUNT", "sum": "SUM"}
+
+    def __init__(self, db_path, logger=None):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+
+        # Use the provided logger or the root logger
+        self.logger = logger or logging.getLogger()
+
+        folder = os.path.dirname(db_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        # One connection shared by the flusher and the UI threads, serialized by the lock
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+        self.connection.commit()
+        self.migrate_null_timestamps()
+
+        # Sample IDs are assigned here so samples and their values can both be inserted with executemany
+        self.next_sample_id = self.connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM samples").fetchone()[0]
+
+        self.logger.info(f"SQLite storage backend opened at {db_path}.")
+
+############################################################################################################################################################################################
+
+    def migrate_null_timestamps(self):
+        """
+        Rebuilds the tables of a database created with NOT NULL timestamps once, storing NULL
+        instead of the 0.0 its untimestamped samples got.
+        """
+        columns = self.connection.execute("PRAGMA table_info(samples)").fetchall()
+        if any(name == "timestamp" and not_null for _, name, _, not_null, _, _ in columns):
+            self.connection.executescript(self.MIGRATE_NULL_TIMESTAMPS.format(schema=self.SCHEMA))
+            self.logger.info(f"Migrated {self.db_path} to NULL timestamps for untimestamped samples.")
+
+############################################################################################################################################################################################
+
+    def store_metrics_batch(self, agent_id, metrics_batch):
+        """
+        Inserts several samples of one agent in a single transaction with batched, prepared inserts.
+        """
+        samples = []
+        values = []
+
+        with self.lock, self.connection:
+            for metrics in metrics_batch:
+                sample_id = self.next_sample_id
+                self.next_sample_id += 1
+                timestamp = metrics.get("timestamp")
+                if not isinstance(timestamp, (int, float)):
+                    timestamp = None
+                samples.append((sample_id, agent_id, timestamp, json.dumps(metrics, separators=(",", ":"))))
+                values.extend(
+                    (sample_id, agent_id, timestamp, metric, value)
+                    for metric, value in flatten_metrics(metrics).items()
+                )
+            self.connection.executemany(self.INSERT_SAMPLE, samples)
+            self.connection.executemany(self.INSERT_VALUE, values)
+
+############################################################################################################################################################################################
+
+    def retrieve_metrics(self, agent_id, start=None, end=None):
+        """
+        Returns the stored samples of an agent with start <= timestamp < end, oldest first.
+        Samples without a timestamp only match an open range, and come first.
+        """
+        query = "SELECT data FROM samples WHERE agent_id = ?"
+        parameters = [agent_id]
+        if start is not None:
+            query += " AND timestamp >= ?"
+            parameters.append(start)
+        if end is not None:
+            query += " AND timestamp < ?"
+            parameters.append(end)
+        query += " ORDER BY timestamp, id"
+
+        with self.lock:
+            rows = self.connection.execute(query, parameters).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+############################################################################################################################################################################################
+
+    def read_page(self, agent_id, position, count, backward=False):
+        """
+        Returns up to `count` (sample id, sample) pairs of an agent starting at the given sample id,
+        or right before it when `backward` is set, oldest first.
+        """
+        if backward:
+            query = "SELECT id, data FROM samples WHERE agent_id = ? AND id < ? ORDER BY id DESC LIMIT ?"
+        else:
+            query = "SELECT id, data FROM samples WHERE agent_id = ? AND id >= ? ORDER BY id LIMIT ?"
+
+        with self.lock:
+            rows = self.connection.execute(query, (agent_id, position, count)).fetchall()
+        if backward:
+            rows.reverse()
+        return [(sample_id, json.loads(data)) for sample_id, data in rows]
+
+    def end_position(self, agent_id):
+        with self.lock:
+            return self.connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM samples WHERE agent_id = ?", (agent_id,)).fetchone()[0]
+
+    def seek_time(self, agent_id, timestamp):
+        """
+        Returns the id of the first sample of an agent with a timestamp >= the given one.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT MIN(id) FROM samples WHERE agent_id = ? AND timestamp >= ?", (agent_id, timestamp)
+            ).fetchone()
+        return row[0] if row[0] is not None else self.end_position(agent_id)
+
+############################################################################################################################################################################################
+
+    def aggregate(self, metric, aggregate="avg", since=None, until=None, agent_id=None):
+        """
+        Aggregates one metric per agent in SQL, for example the average cpu_usage of every agent
+        over the last hour. Returns a dict of agent_id -> value.
+        """
+        function = self.AGGREGATES.get(aggregate)
+        if not function:
+            raise ValueError(f"Unknown aggregate: {aggregate}")
+
+        query = f"SELECT agent_id, {function}(value) FROM metric_values WHERE metric = ?"
+        parameters = [metric]
+        if since is not None:
+            query += " AND timestamp >= ?"
+            parameters.append(since)
+        if until is not None:
+            query += " AND timestamp < ?"
+            parameters.append(until)
+        if agent_id is not None:
+            query += " AND agent_id = ?"
+            parameters.append(agent_id)
+        query += " GROUP BY agent_id"
+
+        with self.lock:
+            return dict(self.connection.execute(query, parameters).fetchall())
+
+############################################################################################################################################################################################
+
+    def list_agents(self):
+        with self.lock:
+            return [agent_id for (agent_id,) in self.connection.execute("SELECT DISTINCT agent_id FROM samples")]
+
+############################################################################################################################################################################################
+
+    def trim(self, agent_id, before):
+        """
+        Deletes the samples of an agent older than `before`. Samples without a timestamp are kept,
+        as NULL never compares lower than `before`.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM metric_values WHERE agent_id = ? AND timestamp < ?", (agent_id, before))
+            self.connection.execute("DELETE FROM samples WHERE agent_id = ? AND timestamp < ?", (agent_id, before))
+
+############################################################################################################################################################################################
+
+    def import_files(self, storage_folder):
+        """
+        Migrates the per-agent metrics files of the JSON backend (legacy JSON arrays and JSON
+        Lines journals) into the database. Every file is imported only once.
+        Returns the number of imported samples.
+        """
+        if not os.path.exists(storage_folder):
+            return 0
+
+        imported = 0
+        for file_name in sorted(os.listdir(storage_folder)):
+            if file_name.endswith("_metrics_collected.jsonl"):
+                agent_id = file_name[len("agent"):-len("_metrics_collected.jsonl")]
+            elif file_name.endswith("_metrics_collected.json"):
+                agent_id = file_name[len("agent"):-len("_metrics_collected.json")]
+            else:
+                continue
+
+            file_path = os.path.abspath(os.path.join(storage_folder, file_name))
+            with self.lock:
+                done = self.connection.execute("SELECT 1 FROM imported_files WHERE path = ?", (file_path,)).fetchone()
+            if done:
+                continue
+
+            try:
+                if file_name.endswith(".jsonl"):
+                    records = list(Journal.read_file(file_path, logger=self.logger))
+                else:
+                    with open(file_path, "r") as file:
+                        records = json.load(file)
+            except (OSError, json.JSONDecodeError) as e:
+                self.logger.error(f"Failed to import {file_path}: {e}")
+                continue
+
+            self.store_metrics_batch(agent_id, records)
+            with self.lock, self.connection:
+                self.connection.execute("INSERT INTO imported_files (path, records) VALUES (?, ?)", (file_path, len(records)))
+            self.logger.info(f"Imported {len(records)} samples of agent {agent_id} from {file_path}.")
+            imported += len(records)
+
+        return imported
+
+############################################################################################################################################################################################
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+############################################################################################################################################################################################
+
+if __name__ == "__main__":
+    # Usage: python sqlite_backend.py [storage_folder] [db_path]
+    storage_folder = sys.argv[1] if len(sys.argv) > 1 else "metrics_storage"
+    db_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(storage_folder, "metrics.db")
+    logging.basicConfig(level=logging.INFO)
+    backend = SQLiteBackend(db_path)
+    print(f"Imported {backend.import_files(storage_folder)} samples into {db_path}")
+    backend.close()
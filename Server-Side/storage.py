@@ -1,74 +1,454 @@
 import os
 import json
+import math
+import time
 import logging
+import threading
+from journal import Journal
+from time_index import TimeIndex
+from ring_buffer import MetricsRingBuffer
+from sqlite_backend import SQLiteBackend
+from alert_journal import AlertJournal
+from column_store import ColumnStore
+from retention import Compactor, AGGREGATES
 
 class Storage:
     """
     A storage class to manage the metrics and other data received from agents.
+    Metrics are stored on disk either in per-agent JSON Lines journals ("json" backend)
+    or in a local SQLite database ("sqlite" backend).
     """
 
-    def __init__(self, logger=None):
-        self.agent_metrics = {}
+    BACKEND_JSON = "json"
+    BACKEND_SQLITE = "sqlite"
+
+    BACKENDS = (BACKEND_JSON, BACKEND_SQLITE)
+
+    def __init__(self, logger=None, storage_folder="metrics_storage", fsync_policy=Journal.FSYNC_INTERVAL, fsync_interval=1.0,
+                 retention_policy=None, hot_capacity=1024, hot_window=None, sample_interval=1, backend=BACKEND_JSON,
+                 alerts_folder=None):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown storage backend: {backend}")
+
         self.agent_alerts = {}
 
+        # Bounded in-memory ring buffers with the most recent metrics of every agent, sized by
+        # sample count or by a time window (in seconds) at the expected sample interval
+        self.hot_capacity = math.ceil(hot_window / sample_interval) if hot_window else hot_capacity
+        self.agent_metrics = {}
+        self.agent_metrics_lock = threading.Lock()
+
         # Use the provided logger or the root logger
         self.logger = logger or logging.getLogger()
 
+        # Append-only metrics journals, one per agent
+        self.storage_folder = storage_folder
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.journals = {}
+        self.time_indexes = {}
+        self.agent_locks = {}
+        self.journals_lock = threading.Lock()
+
+        # SQLite database replacing the journals; existing metrics files are migrated into it once
+        self.backend = backend
+        self.sqlite = None
+        if backend == self.BACKEND_SQLITE:
+            self.sqlite = SQLiteBackend(os.path.join(storage_folder, "metrics.db"), self.logger)
+            self.sqlite.import_files(storage_folder)
+
+        # Columnar copy of the numeric fields, for fast range scans
+        self.column_store = ColumnStore(os.path.join(storage_folder, "columns"), self.logger)
+
+        # Downsampled rollups of the columns and retention of every tier
+        self.compactor = Compactor(self.column_store, os.path.join(storage_folder, "rollups"), retention_policy, logger=self.logger)
+        self.compactor.on_raw_trim = self.trim_journal
+
+        # Append-only, indexed journal of the received alerts, kept under the storage folder by default
+        self.alert_journal = AlertJournal(alerts_folder or os.path.join(storage_folder, "alerts"), fsync_policy, self.logger)
+
 ############################################################################################################################################################################################
 
     def store_metrics(self, agent_id, metrics):
         """
-        Stores metrics in memory for the specified agent.
+        Stores metrics in the in-memory ring buffer of the specified agent.
+        Once the buffer is full, the oldest metrics are overwritten.
         """
-        if agent_id not in self.agent_metrics:
-            self.agent_metrics[agent_id] = []
-        self.agent_metrics[agent_id].append(metrics)
+        with self.agent_metrics_lock:
+            if agent_id not in self.agent_metrics:
+                self.agent_metrics[agent_id] = MetricsRingBuffer(self.hot_capacity)
+            ring_buffer = self.agent_metrics[agent_id]
+        ring_buffer.append(metrics.get("timestamp", time.time()), metrics)
         self.logger.info(f"Metrics stored in memory for agent {agent_id}.")
 
 ############################################################################################################################################################################################
 
-    def retrieve_metrics(self, agent_id):
+    def retrieve_metrics(self, agent_id, since=None, last=None):
         """
-        Retrieves metrics for a specific agent.
+        Retrieves the recent metrics held in memory for a specific agent, oldest first.
         """
-        return self.agent_metrics.get(agent_id, [])
+        ring_buffer = self.agent_metrics.get(agent_id)
+        return ring_buffer.recent_samples(since, last) if ring_buffer else []
 
 ############################################################################################################################################################################################
 
-    def store_metrics_in_file(self, agent_id, metrics):
+    def retrieve_recent_series(self, agent_id, metric, since=None, last=None):
         """
-        Stores metrics in a JSON file specific to the agent inside a designated folder.
+        Retrieves (timestamps, values) of one numeric metric held in memory for a specific agent.
         """
-        # Define the storage folder
-        storage_folder = "metrics_storage"
-        if not os.path.exists(storage_folder):
-            os.makedirs(storage_folder)
-            self.logger.info(f"Created storage folder at {storage_folder}.")
+        ring_buffer = self.agent_metrics.get(agent_id)
+        return ring_buffer.series(metric, since, last) if ring_buffer else ([], [])
 
-        # Construct the file path
-        file_name = f"agent{agent_id}_metrics_collected.json"
-        file_path = os.path.join(storage_folder, file_name)
+############################################################################################################################################################################################
+
+    def get_journal(self, agent_id):
+        """
+        Returns the append-only metrics journal for the specified agent, opening it on first use.
+        A legacy JSON array file for the agent is imported into the journal exactly once.
+        """
+        with self.journals_lock:
+            journal = self.journals.get(agent_id)
+            if journal:
+                return journal
 
-        # Read existing metrics if the file exists
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, "r") as file:
-                    existing_metrics = json.load(file)
-            except json.JSONDecodeError:
-                existing_metrics = []
-        else:
-            existing_metrics = []
+            if not os.path.exists(self.storage_folder):
+                os.makedirs(self.storage_folder)
+                self.logger.info(f"Created storage folder at {self.storage_folder}.")
 
-        # Append the new metrics
-        existing_metrics.append(metrics)
+            journal_path = self.journal_path(agent_id)
+            legacy_path = self.legacy_path(agent_id)
+            if os.path.exists(legacy_path) and not os.path.exists(journal_path):
+                Journal.import_json_array(legacy_path, journal_path, self.logger)
+                os.replace(legacy_path, legacy_path + ".imported")
 
-        # Write updated metrics back to the file
+            journal = Journal(journal_path, self.fsync_policy, self.fsync_interval, self.logger)
+            self.time_indexes[agent_id] = TimeIndex(self.index_path(agent_id), journal, logger=self.logger)
+            self.agent_locks[agent_id] = threading.Lock()
+            self.journals[agent_id] = journal
+            return journal
+
+############################################################################################################################################################################################
+
+    def journal_path(self, agent_id):
+        return os.path.join(self.storage_folder, f"agent{agent_id}_metrics_collected.jsonl")
+
+    def index_path(self, agent_id):
+        return os.path.join(self.storage_folder, f"agent{agent_id}_metrics_collected.idx")
+
+    def legacy_path(self, agent_id):
+        return os.path.join(self.storage_folder, f"agent{agent_id}_metrics_collected.json")
+
+############################################################################################################################################################################################
+
+    def store_metrics_in_file(self, agent_id, metrics):
+        """
+        Appends metrics to the journal file specific to the agent inside the storage folder,
+        and their numeric fields to the agent's columns.
+        """
+        self.store_metrics_batch_in_file(agent_id, [metrics])
+
+############################################################################################################################################################################################
+
+    def store_metrics_batch_in_file(self, agent_id, metrics_batch):
+        """
+        Appends several metrics samples for the same agent with a single write per file.
+        Returns True if the samples were stored.
+        """
         try:
-            with open(file_path, "w") as file:
-                json.dump(existing_metrics, file, indent=4)
-            self.logger.info(f"Metrics for agent {agent_id} stored in {file_path}.")
+            if self.sqlite:
+                self.sqlite.store_metrics_batch(agent_id, metrics_batch)
+                location = self.sqlite.db_path
+            else:
+                journal = self.get_journal(agent_id)
+                time_index = self.time_indexes[agent_id]
+                with self.agent_locks[agent_id]:
+                    offsets = journal.append_many(metrics_batch)
+                    for metrics, offset in zip(metrics_batch, offsets):
+                        time_index.add(TimeIndex.record_timestamp(metrics), offset)
+                location = journal.file_path
+            self.column_store.append_many(agent_id, [(metrics.get("timestamp"), metrics) for metrics in metrics_batch])
+            self.logger.info(f"{len(metrics_batch)} metrics entries for agent {agent_id} stored in {location}.")
+            return True
         except Exception as e:
             self.logger.error(f"Failed to store metrics for agent {agent_id}: {e}")
+            return False
+
+############################################################################################################################################################################################
+
+    def retrieve_metrics_range(self, agent_id, start=None, end=None):
+        """
+        Yields the stored metrics of an agent with start <= timestamp < end.
+        The time index is used to seek close to the first matching entry.
+        """
+        if self.sqlite:
+            yield from self.sqlite.retrieve_metrics(agent_id, start, end)
+            return
+
+        journal = self.get_journal(agent_id)
+        offset = self.time_indexes[agent_id].seek(start) if start is not None else 0
+
+        for metrics in journal.read(offset):
+            timestamp = TimeIndex.record_timestamp(metrics)
+            if start is not None and timestamp < start:
+                continue
+            if end is not None and timestamp >= end:
+                break
+            yield metrics
+
+############################################################################################################################################################################################
+
+    def trim_journal(self, agent_id, before, min_fraction=0.25):
+        """
+        Drops journal entries older than `before`. To keep the cost amortized, the journal is only
+        rewritten once the expired entries make up at least `min_fraction` of it.
+        Entries without a timestamp (stored or imported before samples were timestamped) never
+        expire: they are kept at the head of the journal, as the SQLite backend keeps them.
+        """
+        if self.sqlite:
+            self.sqlite.trim(agent_id, before)
+            return
+
+        journal = self.get_journal(agent_id)
+        time_index = self.time_indexes[agent_id]
+
+        with self.agent_locks[agent_id]:
+            offset = None
+            for record_offset, metrics in journal.scan(time_index.seek(before)):
+                if TimeIndex.record_timestamp(metrics) >= before:
+                    offset = record_offset
+                    break
+            if offset is None:
+                offset = journal.size()
+
+            if offset == 0 or offset < journal.size() * min_fraction:
+                return
+
+            # The time index gives such entries the timestamp of the entries around them, so the
+            # expired part is read in full to find them
+            keep = []
+            kept_size = 0
+            for record_offset, metrics in journal.scan(0):
+                if record_offset >= offset:
+                    break
+                if not isinstance(metrics, dict) or not isinstance(metrics.get("timestamp"), (int, float)):
+                    keep.append(metrics)
+                    kept_size += len(journal.encode(metrics))
+            expired = offset - kept_size
+            if expired <= 0 or expired < journal.size() * min_fraction:
+                return
+            prefix = journal.trim(offset, keep)
+            time_index.shift(offset, prefix)
+        self.logger.info(f"Trimmed {expired} bytes of expired metrics from {journal.file_path}.")
+
+############################################################################################################################################################################################
+
+    def list_stored_agents(self):
+        """
+        Returns the IDs of every agent with metrics stored on disk (journal, legacy JSON file or database).
+        """
+        if self.sqlite:
+            return sorted(self.sqlite.list_agents(), key=lambda agent_id: (len(agent_id), agent_id))
+
+        if not os.path.exists(self.storage_folder):
+            return []
+
+        agents = set()
+        for file_name in os.listdir(self.storage_folder):
+            for suffix in ("_metrics_collected.jsonl", "_metrics_collected.json"):
+                if file_name.startswith("agent") and file_name.endswith(suffix):
+                    agents.add(file_name[len("agent"):-len(suffix)])
+        return sorted(agents, key=lambda agent_id: (len(agent_id), agent_id))
+
+############################################################################################################################################################################################
+
+    def retrieve_metrics_from_file(self, agent_id):
+        """
+        Reads every stored metrics entry for the specified agent.
+        """
+        if self.sqlite:
+            return self.sqlite.retrieve_metrics(agent_id)
+
+        journal_path = self.journal_path(agent_id)
+        if os.path.exists(journal_path):
+            return list(Journal.read_file(journal_path, logger=self.logger))
+
+        legacy_path = self.legacy_path(agent_id)
+        if os.path.exists(legacy_path):
+            with open(legacy_path, "r") as file:
+                return json.load(file)
+
+        raise FileNotFoundError(f"Metrics file for Agent {agent_id} not found.")
+
+############################################################################################################################################################################################
+
+    def read_metrics_page(self, agent_id, position, count, backward=False):
+        """
+        Returns up to `count` (position, metrics) pairs stored for an agent starting at `position`,
+        or right before it when `backward` is set, oldest first. Only those entries are read.
+        Positions are opaque: journal byte offsets, or sample ids with the SQLite backend.
+        """
+        if self.sqlite:
+            return self.sqlite.read_page(agent_id, position, count, backward)
+
+        journal = self.get_journal(agent_id)
+        if backward:
+            return journal.read_backward(position, count)
+        return journal.read_forward(position, count)
+
+    def metrics_start_position(self, agent_id):
+        return 0
+
+    def metrics_end_position(self, agent_id):
+        if self.sqlite:
+            return self.sqlite.end_position(agent_id)
+        return self.get_journal(agent_id).size()
+
+    def seek_metrics_time(self, agent_id, timestamp):
+        """
+        Returns the position of the first stored entry of an agent with a timestamp >= the given one.
+        """
+        if self.sqlite:
+            return self.sqlite.seek_time(agent_id, timestamp)
+
+        journal = self.get_journal(agent_id)
+        for offset, metrics in journal.scan(self.time_indexes[agent_id].seek(timestamp)):
+            if TimeIndex.record_timestamp(metrics) >= timestamp:
+                return offset
+        return journal.size()
+
+############################################################################################################################################################################################
+
+    def scan_metrics(self, agent_id, columns=None, start=None, end=None):
+        """
+        Returns the numeric metrics of an agent between two timestamps as a dict of column views.
+        """
+        return self.column_store.scan(agent_id, columns, start, end)
+
+############################################################################################################################################################################################
+
+    def query_metrics(self, agent_id, metrics, start, end=None, max_points=1000, sample_interval=1):
+        """
+        Returns (source, columns) for a time range, reading raw samples for short recent ranges
+        and the smallest rollup tier that fits otherwise. Rollup columns are named
+        "<metric>.<aggregate>" (min, max, avg, count, last).
+        """
+        source = self.compactor.choose_tier(start, end, max_points, sample_interval)
+        if source == "raw":
+            return source, self.column_store.scan(agent_id, metrics, start, end)
+
+        columns = [f"{metric}.{aggregate}" for metric in metrics for aggregate in AGGREGATES]
+        return source, self.compactor.stores[source].scan(agent_id, columns, start, end)
+
+############################################################################################################################################################################################
+
+    def scan_archive(self, agent_id, columns=None, start=None, end=None):
+        """
+        Returns full-resolution numeric metrics of an agent from the compressed archive,
+        which keeps raw samples longer than the raw columns do.
+        """
+        if not self.compactor.archive:
+            return {"timestamp": []}
+        return self.compactor.archive.scan(agent_id, columns, start, end)
+
+############################################################################################################################################################################################
+
+    def metric_names(self, agent_id):
+        """
+        Returns the numeric metrics stored for an agent, as column names.
+        """
+        ring_buffer = self.agent_metrics.get(agent_id)
+        return sorted(set(self.column_store.columns(agent_id)) | set(ring_buffer.metric_names() if ring_buffer else ()))
+
+    def metric_history(self, agent_id, metric, start, end=None, max_points=1000, sample_interval=1, full_resolution=False):
+        """
+        Returns (source, rows) for one metric of an agent over a time range, read from the cheapest
+        place that holds it: the in-memory ring buffer when it covers the whole range, then the raw
+        columns or a rollup tier (see query_metrics), or with `full_resolution` the compressed archive
+        followed by the raw samples not archived yet. Rows are (timestamp, {name: value}), named
+        "value" for raw samples and after the aggregate for rollups. Missing values are left out.
+        """
+        ring_buffer = self.agent_metrics.get(agent_id)
+        if end is None and not full_resolution and ring_buffer is not None:
+            timestamps, values = self.retrieve_recent_series(agent_id, metric, since=start)
+            # The ring buffer covers the range when it still holds samples older than its start
+            if len(ring_buffer) > len(timestamps):
+                return "memory", [(timestamp, {"value": value}) for timestamp, value in zip(timestamps, values) if not math.isnan(value)]
+
+        if full_resolution:
+            archived = self.scan_archive(agent_id, [metric], start, end)
+            timestamps = list(archived["timestamp"])
+            values = list(archived.get(metric, []))
+            # Archived timestamps are rounded to milliseconds, so the raw samples are read from the
+            # exact last archived timestamp kept in the archive index
+            last_archived = self.compactor.archive.last_timestamp(agent_id) if self.compactor.archive else None
+            raw_start = start
+            if last_archived is not None:
+                raw_start = math.nextafter(last_archived, math.inf) if start is None else max(start, math.nextafter(last_archived, math.inf))
+            raw = self.scan_metrics(agent_id, [metric], raw_start, end)
+            timestamps.extend(raw[ColumnStore.TIMESTAMP])
+            values.extend(raw[metric])
+            return "archive", [(timestamp, {"value": value}) for timestamp, value in zip(timestamps, values) if not math.isnan(value)]
+
+        source, columns = self.query_metrics(agent_id, [metric], start, end, max_points, sample_interval)
+        timestamps = columns[ColumnStore.TIMESTAMP]
+        if source == "raw":
+            return source, [(timestamp, {"value": value}) for timestamp, value in zip(timestamps, columns[metric]) if not math.isnan(value)]
+
+        rows = []
+        for row, timestamp in enumerate(timestamps):
+            fields = {aggregate: columns[f"{metric}.{aggregate}"][row] for aggregate in AGGREGATES if len(columns[f"{metric}.{aggregate}"]) > row}
+            fields = {aggregate: value for aggregate, value in fields.items() if not math.isnan(value)}
+            if fields:
+                rows.append((timestamp, fields))
+        return source, rows
+
+############################################################################################################################################################################################
+
+    def aggregate_metric(self, metric, aggregate="avg", since=None, until=None):
+        """
+        Aggregates one metric per agent (avg, min, max, count or sum) and returns a dict of
+        agent_id -> value. The SQLite backend runs it in SQL; otherwise the columns are scanned.
+        """
+        if self.sqlite:
+            return self.sqlite.aggregate(metric, aggregate, since, until)
+
+        result = {}
+        for agent_id in self.column_store.agent_ids():
+            values = [value for value in self.column_store.scan(agent_id, [metric], since, until)[metric] if not math.isnan(value)]
+            if not values:
+                continue
+            if aggregate == "avg":
+                result[agent_id] = sum(values) / len(values)
+            elif aggregate == "min":
+                result[agent_id] = min(values)
+            elif aggregate == "max":
+                result[agent_id] = max(values)
+            elif aggregate == "count":
+                result[agent_id] = len(values)
+            elif aggregate == "sum":
+                result[agent_id] = sum(values)
+            else:
+                raise ValueError(f"Unknown aggregate: {aggregate}")
+        return result
+
+############################################################################################################################################################################################
+
+    def close(self):
+        """
+        Flushes and closes every open journal, column file and database.
+        """
+        self.compactor.close()
+        self.column_store.close()
+        self.alert_journal.close()
+        if self.sqlite:
+            self.sqlite.close()
+        with self.journals_lock:
+            for journal in self.journals.values():
+                journal.close()
+            for time_index in self.time_indexes.values():
+                time_index.close()
+            self.journals.clear()
+            self.time_indexes.clear()
 
 ############################################################################################################################################################################################
 
@@ -93,35 +473,19 @@ class Storage:
 
     def store_alerts_in_file(self, agent_id, alert):
         """
-        Stores alerts in a JSON file specific to the agent inside a designated folder.
+        Appends an alert to the indexed alert journal inside the alerts storage folder.
         """
-        # Define the storage folder
-        storage_folder = "alerts_storage"
-        if not os.path.exists(storage_folder):
-            os.makedirs(storage_folder)
-            self.logger.info(f"Created storage folder at {storage_folder}.")
-
-        # Construct the file path
-        file_name = f"agent{agent_id}_alerts.json"
-        file_path = os.path.join(storage_folder, file_name)
-
-        # Read existing alerts if the file exists
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, "r") as file:
-                    existing_alerts = json.load(file)
-            except json.JSONDecodeError:
-                existing_alerts = []
-        else:
-            existing_alerts = []
-
-        # Append the new alert
-        existing_alerts.append(alert)
-
-        # Write updated alerts back to the file
         try:
-            with open(file_path, "w") as file:
-                json.dump(existing_alerts, file, indent=4)
-            self.logger.info(f"Alert for agent {agent_id} stored in {file_path}.")
+            alert.setdefault("agent_id", agent_id)
+            self.alert_journal.append(alert)
+            self.logger.info(f"Alert for agent {agent_id} stored in {self.alert_journal.journal.file_path}.")
         except Exception as e:
             self.logger.error(f"Failed to store alert for agent {agent_id}: {e}")
+
+############################################################################################################################################################################################
+
+    def query_alerts(self, agent_id=None, alert_type=None, start=None, end=None):
+        """
+        Returns the stored alerts of an agent and/or of an alert type between two timestamps.
+        """
+        return self.alert_journal.query(agent_id, alert_type, start, end)
@@ -0,0 +1,206 @@
+import heapq
+import asyncio
+import itertools
+from collections import deque
+
+class TaskDispatcher:
+    """
+    Sends tasks to agents from the main NetTask event loop, without a thread or a coroutine per agent.
+    Every (agent_id, task_id) waiting for its task_ack is an entry of the pending table, and all
+    retransmission deadlines live in one timer heap served by a single loop timer. task_acks are
+    matched to their entry by agent_id and task_id, and by the hash of the task when the agent
+    echoes it, so an ACK can only complete its own handshake, not that of a newer version of the task.
+    At most `max_in_flight` tasks are unacknowledged at a time; the others wait in a queue, so a
+    dispatch to thousands of agents does not burst past the socket buffers.
+    Timeouts follow each agent's RTT (Jacobson/Karels) with exponential backoff, and the dispatch
+    latency (first transmission to ACK) of every agent is kept for the statistics.
+    """
+
+    def __init__(self, net_task, logger, max_in_flight=256, retries=5):
+        self.net_task = net_task
+        self.logger = logger
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+
+        # (agent_id, task_id) -> [address, payload, attempts, first_sent, last_sent, future, task_hash]
+        self.pending = {}
+        # Entries of the pending table waiting for a free slot, in dispatch order
+        self.queue = deque()
+        self.in_flight = 0
+
+        # (deadline, counter, key, entry, attempts); timers of replaced entries or whose attempts changed are stale
+        self.timers = []
+        self.timer = None
+        self.counter = itertools.count()
+
+        # agent_id -> seconds between the first transmission of its last task and the ACK
+        self.latencies = {}
+
+        self.dispatched = 0
+        self.acknowledged = 0
+        self.failed = 0
+        self.retransmitted = 0
+
+############################################################################################################################################################################################
+
+    @property
+    def loop(self):
+        return self.net_task.loop
+
+    def dispatch(self, tasks):
+        """
+        Queues (agent_id, address, task_id, payload, task_hash) tasks for delivery, the payload being
+        the serialized task, sent as it is on every (re)transmission. Must be called on the main loop.
+        Returns a future resolved with one bool per task, True once its task_ack arrived.
+        A task already waiting for its ACK with the same hash is not sent twice. One with another
+        hash (an older version) fails, and the new version starts its own handshake.
+        """
+        futures = []
+        for agent_id, address, task_id, payload, task_hash in tasks:
+            key = (str(agent_id), task_id)
+            entry = self.pending.get(key)
+            if entry is not None and entry[6] == task_hash:
+                entry[0] = address
+            else:
+                if entry is not None:
+                    self.logger.info(f"Task {task_id} of agent {agent_id} changed before its ACK, sending the new version.")
+                    self.replace(entry)
+                # The key of an entry that was still queued stays in the queue and starts the new one
+                if entry is None or entry[2] > 0:
+                    self.queue.append(key)
+                entry = self.pending[key] = [address, payload, 0, None, None, self.loop.create_future(), task_hash]
+                self.dispatched += 1
+            futures.append(entry[5])
+        self.start_queued()
+        return asyncio.gather(*futures)
+
+    def replace(self, entry):
+        """
+        Fails the handshake of an outdated entry, freeing its slot if it was sent.
+        """
+        if entry[2] > 0:
+            self.in_flight -= 1
+        self.failed += 1
+        if not entry[5].done():
+            entry[5].set_result(False)
+
+    def start_queued(self):
+        while self.queue and self.in_flight < self.max_in_flight:
+            key = self.queue.popleft()
+            entry = self.pending.get(key)
+            if entry is not None:
+                self.in_flight += 1
+                entry[3] = self.loop.time()
+                self.transmit(key, entry)
+
+    def transmit(self, key, entry):
+        address, payload = entry[0], entry[1]
+        entry[4] = self.loop.time()
+        self.net_task.send_payload(payload, address)
+
+        deadline = entry[4] + self.net_task.rtt.get(address).timeout(entry[2])
+        entry[2] += 1
+        heapq.heappush(self.timers, (deadline, next(self.counter), key, entry, entry[2]))
+        if self.timer is None or deadline < self.timer.when():
+            self.arm_timer(deadline)
+
+############################################################################################################################################################################################
+
+    def arm_timer(self, deadline):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = self.loop.call_at(deadline, self.on_timer)
+
+    def on_timer(self):
+        """
+        Retransmits every entry whose deadline passed and gives up on those out of retries.
+        """
+        self.timer = None
+        now = self.loop.time()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, key, entry, attempts = heapq.heappop(self.timers)
+            if not self.is_live(key, entry, attempts):
+                continue
+            if attempts >= self.retries:
+                self.logger.error(f"Failed to receive ACK for task {key[1]} from agent {key[0]} after {attempts} attempts")
+                self.finish(key, False)
+            else:
+                self.logger.warning(f"No ACK received for task {key[1]} from agent {key[0]}, retrying ({attempts}/{self.retries})...")
+                self.retransmitted += 1
+                self.transmit(key, entry)
+
+        # Stale timers at the top are dropped here, so the loop timer is armed for a live entry
+        while self.timers and not self.is_live(*self.timers[0][2:]):
+            heapq.heappop(self.timers)
+        if self.timers and self.timer is None:
+            self.arm_timer(self.timers[0][0])
+        self.start_queued()
+
+    def is_live(self, key, entry, attempts):
+        return self.pending.get(key) is entry and entry[2] == attempts
+
+    def finish(self, key, acknowledged):
+        entry = self.pending.pop(key)
+        self.in_flight -= 1
+        if acknowledged:
+            self.acknowledged += 1
+        else:
+            self.failed += 1
+        if not entry[5].done():
+            entry[5].set_result(acknowledged)
+
+############################################################################################################################################################################################
+
+    def acknowledge(self, agent_id, task_id, task_hash=None):
+        """
+        Completes the delivery of a task when its task_ack arrives. Safe to call from any thread.
+        An ACK with the hash of another version of the task is ignored; agents that do not echo the
+        hash acknowledge whichever version is pending.
+        """
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not self.loop:
+            self.loop.call_soon_threadsafe(self.acknowledge, agent_id, task_id, task_hash)
+            return
+
+        key = (str(agent_id), task_id)
+        entry = self.pending.get(key)
+        if entry is None or entry[2] == 0 or (task_hash is not None and task_hash != entry[6]):
+            return
+
+        now = self.loop.time()
+        # Karn's algorithm: the ACK of a retransmitted task could answer any of the copies
+        if entry[2] == 1:
+            self.net_task.rtt.get(entry[0]).sample(now - entry[4])
+        self.latencies[key[0]] = now - entry[3]
+        self.logger.info(f"Task {task_id} acknowledged by agent {agent_id} in {(now - entry[3]) * 1000:.1f} ms")
+        self.finish(key, True)
+        self.start_queued()
+
+############################################################################################################################################################################################
+
+    def stats(self):
+        latencies = sorted(self.latencies.values())
+
+        def percentile(fraction):
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 2) if latencies else None
+
+        return {
+            "pending": len(self.pending),
+            "in_flight": self.in_flight,
+            "dispatched": self.dispatched,
+            "acknowledged": self.acknowledged,
+            "failed": self.failed,
+            "retransmitted": self.retransmitted,
+            "latency_p50_ms": percentile(0.5),
+            "latency_p99_ms": percentile(0.99),
+            "latency_max_ms": percentile(1.0),
+        }
+
+    def agent_latencies(self):
+        """
+        Returns the last dispatch latency of every agent, in milliseconds.
+        """
+        return {agent_id: round(latency * 1000, 2) for agent_id, latency in self.latencies.items()}
@@ -0,0 +1,139 @@
+import os
+import bisect
+import struct
+import logging
+import threading
+
+class TimeIndex:
+    """
+    A sparse index from sample timestamp to journal byte offset.
+    One (timestamp, offset) entry is kept for every `every` records and persisted in a small
+    sidecar file, so a time-range query seeks close to its first record instead of reading
+    the journal from the start.
+    """
+
+    ENTRY = struct.Struct("<dQ")
+
+    def __init__(self, file_path, journal, every=64, logger=None):
+        self.file_path = file_path
+        self.journal = journal
+        self.every = every
+        self.timestamps = []
+        self.offsets = []
+        self.since_last_entry = 0
+        self.last_timestamp = 0.0
+        self.lock = threading.Lock()
+
+        # Use the provided logger or the root logger
+        self.logger = logger or logging.getLogger()
+
+        self.load()
+
+############################################################################################################################################################################################
+
+    @staticmethod
+    def record_timestamp(record):
+        """
+        Returns the server timestamp of a journal record. Records stored before samples
+        were timestamped sort before every timestamped record.
+        """
+        timestamp = record.get("timestamp") if isinstance(record, dict) else None
+        return float(timestamp) if isinstance(timestamp, (int, float)) else 0.0
+
+############################################################################################################################################################################################
+
+    def load(self):
+        """
+        Loads the sidecar file, drops entries past the end of the journal and indexes any
+        records appended after the last entry (for example after a crash or an import).
+        """
+        journal_size = self.journal.size()
+        valid_size = 0
+
+        if os.path.exists(self.file_path):
+            with open(self.file_path, "rb") as file:
+                data = file.read()
+            for position in range(0, len(data) - self.ENTRY.size + 1, self.ENTRY.size):
+                timestamp, offset = self.ENTRY.unpack_from(data, position)
+                if offset >= journal_size or (self.offsets and offset <= self.offsets[-1]):
+                    break
+                self.timestamps.append(timestamp)
+                self.offsets.append(offset)
+                valid_size = position + self.ENTRY.size
+
+        # Rewrite the sidecar without the invalid entries, then keep it open for appends
+        with open(self.file_path, "ab") as file:
+            file.truncate(valid_size)
+        self.file = open(self.file_path, "ab")
+
+        if self.offsets:
+            self.last_timestamp = self.timestamps[-1]
+            self.since_last_entry = self.every
+            tail_offset = self.offsets[-1]
+        else:
+            tail_offset = 0
+
+        scanned = 0
+        for offset, record in self.journal.scan(tail_offset):
+            if self.offsets and offset == self.offsets[-1]:
+                self.since_last_entry = 1
+                continue
+            self.add(self.record_timestamp(record), offset)
+            scanned += 1
+        if scanned:
+            self.logger.info(f"Indexed {scanned} journal records into {self.file_path}.")
+
+############################################################################################################################################################################################
+
+    def add(self, timestamp, offset):
+        """
+        Registers a record appended to the journal. Only every `every`-th record gets an entry.
+        Timestamps are kept non-decreasing so lookups can bisect.
+        """
+        with self.lock:
+            self.last_timestamp = max(self.last_timestamp, timestamp)
+            if self.offsets and self.since_last_entry < self.every:
+                self.since_last_entry += 1
+                return
+
+            self.timestamps.append(self.last_timestamp)
+            self.offsets.append(offset)
+            self.since_last_entry = 1
+            self.file.write(self.ENTRY.pack(self.last_timestamp, offset))
+            self.file.flush()
+
+############################################################################################################################################################################################
+
+    def seek(self, timestamp):
+        """
+        Returns the journal offset to start reading from to find the first record with a
+        timestamp >= the given one.
+        """
+        with self.lock:
+            position = bisect.bisect_left(self.timestamps, timestamp) - 1
+            return self.offsets[position] if position >= 0 else 0
+
+############################################################################################################################################################################################
+
+    def shift(self, offset, prefix=0):
+        """
+        Adjusts the index after the journal was trimmed up to the given offset, with `prefix`
+        bytes of kept records (which sort before every entry) written in front of the rest.
+        """
+        with self.lock:
+            position = bisect.bisect_left(self.offsets, offset)
+            self.timestamps = self.timestamps[position:]
+            self.offsets = [entry - offset + prefix for entry in self.offsets[position:]]
+
+            self.file.close()
+            with open(self.file_path + ".tmp", "wb") as file:
+                for timestamp, entry in zip(self.timestamps, self.offsets):
+                    file.write(self.ENTRY.pack(timestamp, entry))
+            os.replace(self.file_path + ".tmp", self.file_path)
+            self.file = open(self.file_path, "ab")
+
+############################################################################################################################################################################################
+
+    def close(self):
+        with self.lock:
+            self.file.close()
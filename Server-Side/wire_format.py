@@ -0,0 +1,471 @@
+import sys
+import json
+import itertools
+import time
+import struct
+
+# Compact binary encoding of NetTask metrics messages, shared by NMS_Agent and NMS_Server.
+#
+# A binary datagram starts with MAGIC, the wire format version and the message type, followed by
+# the message encoded against the schema of that version. JSON datagrams always start with "{",
+# so both kinds can arrive on the same socket. An object is encoded as a varint bitmap of the
+# schema fields that are present, a varint bitmap of the present fields that are null, and then
+# the value of every present, non-null field in schema order:
+#   NUMBER  varint of zigzag(mantissa) << 3 | scale. Scale 0 is an int, 1-6 a float with that many
+#           decimals (only when it round-trips exactly), and 7 a struct-packed float64 that follows.
+#   STRING  varint length + UTF-8 bytes
+#   map     varint count + (STRING key, value) pairs, for objects keyed by name (interfaces)
+#   list    varint count + values, for batches of samples
+#   object  nested schema
+# Anything the schema does not describe (unknown keys, other value types) makes the encoder raise
+# WireFormatError, and the sender falls back to JSON for that message.
+
+MAGIC = 0xA7
+HEADER = struct.Struct("!BBB")
+FLOAT64 = struct.Struct("!d")
+
+# Message types
+METRICS = 1
+
+NUMBER = "number"
+STRING = "string"
+
+def map_of(schema):
+    return ("map", schema)
+
+def list_of(schema):
+    return ("list", schema)
+
+INTERFACE_SCHEMA = (
+    ("bytes_sent", NUMBER),
+    ("bytes_recv", NUMBER),
+    ("packets_sent", NUMBER),
+    ("packets_recv", NUMBER),
+    ("dropin", NUMBER),
+    ("dropout", NUMBER),
+)
+
+BANDWIDTH_SCHEMA = (
+    ("bandwidth", STRING),
+    ("jitter", STRING),
+    ("packet_loss", STRING),
+    ("status", STRING),
+)
+
+LINK_SCHEMA = (
+    ("bandwidth", BANDWIDTH_SCHEMA),
+    ("latency", (("latency", NUMBER),)),
+)
+
+SAMPLE_SCHEMA = (
+    ("cpu_usage", NUMBER),
+    ("ram_usage", NUMBER),
+    ("interface_stats", map_of(INTERFACE_SCHEMA)),
+    ("link_metrics", LINK_SCHEMA),
+    ("timestamp", NUMBER),
+)
+
+METRICS_SCHEMA = (
+    ("agent_id", STRING),
+    ("metrics", SAMPLE_SCHEMA),
+)
+
+# Version 2 adds the sequence number of sliding-window delivery
+METRICS_SCHEMA_V2 = METRICS_SCHEMA + (
+    ("seq", NUMBER),
+)
+
+# Version 3 adds batches of samples, each with the agent time it was collected at,
+# and the agent time the message was sent at
+SAMPLE_SCHEMA_V3 = SAMPLE_SCHEMA + (
+    ("collected_at", NUMBER),
+)
+
+METRICS_SCHEMA_V3 = (
+    ("agent_id", STRING),
+    ("metrics", SAMPLE_SCHEMA_V3),
+    ("seq", NUMBER),
+    ("batch", list_of(SAMPLE_SCHEMA_V3)),
+    ("sent_at", NUMBER),
+)
+
+# Version 4 adds the seq of the base of delta-encoded samples (see delta_encoding)
+METRICS_SCHEMA_V4 = METRICS_SCHEMA_V3 + (
+    ("base", NUMBER),
+)
+
+# Version 5 adds the oldest seq the agent still has in flight, where the server starts the
+# receive window of an agent it has no state for (after a restart)
+METRICS_SCHEMA_V5 = METRICS_SCHEMA_V4 + (
+    ("window_start", NUMBER),
+)
+
+# Version -> message type -> schema. A new version only ever appends fields to its schemas.
+SCHEMAS = {
+    1: {METRICS: METRICS_SCHEMA},
+    2: {METRICS: METRICS_SCHEMA_V2},
+    3: {METRICS: METRICS_SCHEMA_V3},
+    4: {METRICS: METRICS_SCHEMA_V4},
+    5: {METRICS: METRICS_SCHEMA_V5},
+}
+SUPPORTED_VERSIONS = tuple(sorted(SCHEMAS))
+
+# First version whose servers rebuild delta-encoded samples
+DELTA_VERSION = 4
+
+# First version whose messages carry the start of the send window
+WINDOW_VERSION = 5
+
+POWERS_OF_TEN = [10 ** scale for scale in range(7)]
+
+class WireFormatError(ValueError):
+    pass
+
+############################################################################################################################################################################################
+
+def negotiate(offered):
+    """
+    Returns the highest wire format version supported by both sides, or None for JSON.
+    """
+    common = set(SUPPORTED_VERSIONS).intersection(offered or ())
+    return max(common) if common else None
+
+def is_binary(data):
+    return len(data) > 0 and data[0] == MAGIC
+
+############################################################################################################################################################################################
+
+def write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data, position):
+    byte = data[position]
+    if byte < 0x80:
+        return byte, position + 1
+
+    value = byte & 0x7F
+    shift = 7
+    while True:
+        position += 1
+        byte = data[position]
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position + 1
+        shift += 7
+
+############################################################################################################################################################################################
+
+def write_number(out, value):
+    kind = type(value)
+    if kind is int:
+        write_varint(out, ((value << 1) ^ -1 if value < 0 else value << 1) << 3)
+        return
+    if kind is not float:
+        raise WireFormatError(f"Not a number: {value!r}")
+
+    if value == value and abs(value) < 1e15:
+        for scale in range(1, 7):
+            mantissa = round(value * POWERS_OF_TEN[scale])
+            if mantissa / POWERS_OF_TEN[scale] == value:
+                zigzag = (mantissa << 1) ^ -1 if mantissa < 0 else mantissa << 1
+                write_varint(out, zigzag << 3 | scale)
+                return
+    out.append(7)
+    out += FLOAT64.pack(value)
+
+def read_number(data, position):
+    header = data[position]
+    if header < 0x80:
+        position += 1
+    else:
+        header, position = read_varint(data, position)
+    scale = header & 7
+    if scale == 7:
+        return FLOAT64.unpack_from(data, position)[0], position + 8
+
+    zigzag = header >> 3
+    mantissa = (zigzag >> 1) ^ -(zigzag & 1)
+    if scale == 0:
+        return mantissa, position
+    return mantissa / POWERS_OF_TEN[scale], position
+
+############################################################################################################################################################################################
+
+def write_string(out, value):
+    if type(value) is not str:
+        raise WireFormatError(f"Not a string: {value!r}")
+    encoded = value.encode("utf-8")
+    write_varint(out, len(encoded))
+    out += encoded
+
+def read_string(data, position):
+    length = data[position]
+    if length < 0x80:
+        position += 1
+    else:
+        length, position = read_varint(data, position)
+    end = position + length
+    return str(data[position:end], "utf-8"), end
+
+############################################################################################################################################################################################
+
+class Source:
+    """
+    Python source of a generated codec function, built line by line with unique local names.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.names = itertools.count()
+
+    def name(self, prefix):
+        return f"{prefix}{next(self.names)}"
+
+    def add(self, indent, line):
+        self.lines.append("    " * indent + line)
+
+def emit_varint_read(source, indent, target):
+    source.add(indent, f"{target} = data[p]")
+    source.add(indent, f"if {target} < 0x80:")
+    source.add(indent + 1, "p += 1")
+    source.add(indent, "else:")
+    source.add(indent + 1, f"{target}, p = read_varint(data, p)")
+
+def emit_read(source, kind, indent, target):
+    if kind is NUMBER:
+        header = source.name("h")
+        emit_varint_read(source, indent, header)
+        source.add(indent, f"if {header} & 7 == 7:")
+        source.add(indent + 1, f"{target} = unpack_float64(data, p)[0]")
+        source.add(indent + 1, "p += 8")
+        source.add(indent, "else:")
+        source.add(indent + 1, f"{header}, scale = {header} >> 3, {header} & 7")
+        source.add(indent + 1, f"{header} = ({header} >> 1) ^ -({header} & 1)")
+        source.add(indent + 1, f"{target} = {header} / POWERS_OF_TEN[scale] if scale else {header}")
+    elif kind is STRING:
+        length = source.name("n")
+        emit_varint_read(source, indent, length)
+        source.add(indent, f"{target} = str(data[p:p + {length}], 'utf-8')")
+        source.add(indent, f"p += {length}")
+    elif kind[0] in ("map", "list"):
+        count, value = source.name("c"), source.name("v")
+        emit_varint_read(source, indent, count)
+        source.add(indent, f"{value} = {{}}" if kind[0] == "map" else f"{value} = []")
+        source.add(indent, f"for _ in range({count}):")
+        if kind[0] == "map":
+            key = source.name("k")
+            emit_read(source, STRING, indent + 1, key)
+            emit_read(source, kind[1], indent + 1, f"{value}[{key}]")
+        else:
+            item = source.name("i")
+            emit_read(source, kind[1], indent + 1, item)
+            source.add(indent + 1, f"{value}.append({item})")
+        source.add(indent, f"{target} = {value}")
+    else:
+        present, nulls, value = source.name("present"), source.name("nulls"), source.name("o")
+        source.add(indent, f"{present} = data[p]")
+        source.add(indent, f"{nulls} = data[p + 1]")
+        source.add(indent, f"if {present} < 0x80 and {nulls} < 0x80:")
+        source.add(indent + 1, "p += 2")
+        source.add(indent, "else:")
+        source.add(indent + 1, f"{present}, p = read_varint(data, p)")
+        source.add(indent + 1, f"{nulls}, p = read_varint(data, p)")
+        source.add(indent, f"if {present} >> {len(kind)}:")
+        source.add(indent + 1, "raise WireFormatError('Fields beyond the schema of this version')")
+        source.add(indent, f"{value} = {{}}")
+        for index, (key, field_kind) in enumerate(kind):
+            source.add(indent, f"if {present} & {1 << index}:")
+            source.add(indent + 1, f"if {nulls} & {1 << index}:")
+            source.add(indent + 2, f"{value}[{key!r}] = None")
+            source.add(indent + 1, "else:")
+            emit_read(source, field_kind, indent + 2, f"{value}[{key!r}]")
+        source.add(indent, f"{target} = {value}")
+
+def emit_varint_write(source, indent, value):
+    source.add(indent, f"if {value} < 0x80:")
+    source.add(indent + 1, f"out.append({value})")
+    source.add(indent, "else:")
+    source.add(indent + 1, f"write_varint(out, {value})")
+
+def emit_write(source, kind, indent, value):
+    if kind is NUMBER:
+        zigzag = source.name("z")
+        source.add(indent, f"if type({value}) is int:")
+        source.add(indent + 1, f"{zigzag} = (({value} << 1) ^ -1 if {value} < 0 else {value} << 1) << 3")
+        emit_varint_write(source, indent + 1, zigzag)
+        source.add(indent, "else:")
+        source.add(indent + 1, f"write_number(out, {value})")
+    elif kind is STRING:
+        encoded = source.name("e")
+        source.add(indent, f"if type({value}) is not str:")
+        source.add(indent + 1, f"raise WireFormatError(f'Not a string: {{{value}!r}}')")
+        source.add(indent, f"{encoded} = {value}.encode('utf-8')")
+        source.add(indent, f"{encoded}_length = len({encoded})")
+        emit_varint_write(source, indent, f"{encoded}_length")
+        source.add(indent, f"out += {encoded}")
+    elif kind[0] in ("map", "list"):
+        count = source.name("c")
+        source.add(indent, f"if type({value}) is not {'dict' if kind[0] == 'map' else 'list'}:")
+        source.add(indent + 1, f"raise WireFormatError(f'Not a {kind[0]}: {{{value}!r}}')")
+        source.add(indent, f"{count} = len({value})")
+        emit_varint_write(source, indent, count)
+        if kind[0] == "map":
+            key, item = source.name("k"), source.name("i")
+            source.add(indent, f"for {key}, {item} in {value}.items():")
+            emit_write(source, STRING, indent + 1, key)
+        else:
+            item = source.name("i")
+            source.add(indent, f"for {item} in {value}:")
+        emit_write(source, kind[1], indent + 1, item)
+    else:
+        present, nulls, found = source.name("present"), source.name("nulls"), source.name("found")
+        source.add(indent, f"if type({value}) is not dict:")
+        source.add(indent + 1, f"raise WireFormatError(f'Not an object: {{{value}!r}}')")
+        source.add(indent, f"{present} = {nulls} = {found} = 0")
+        items = []
+        for index, (key, field_kind) in enumerate(kind):
+            item = source.name("f")
+            items.append((item, field_kind))
+            source.add(indent, f"{item} = {value}.get({key!r}, MISSING)")
+            source.add(indent, f"if {item} is not MISSING:")
+            source.add(indent + 1, f"{present} |= {1 << index}")
+            source.add(indent + 1, f"{found} += 1")
+            source.add(indent + 1, f"if {item} is None:")
+            source.add(indent + 2, f"{nulls} |= {1 << index}")
+            source.add(indent + 2, f"{item} = MISSING")
+        source.add(indent, f"if {found} != len({value}):")
+        source.add(indent + 1, f"raise WireFormatError(f'Unknown fields in {{sorted({value})}}')")
+        emit_varint_write(source, indent, present)
+        emit_varint_write(source, indent, nulls)
+        for item, field_kind in items:
+            source.add(indent, f"if {item} is not MISSING:")
+            emit_write(source, field_kind, indent + 1, item)
+
+############################################################################################################################################################################################
+
+# Globals of the generated codecs
+CODEC_NAMESPACE = {
+    "MISSING": object(),
+    "POWERS_OF_TEN": POWERS_OF_TEN,
+    "WireFormatError": WireFormatError,
+    "read_varint": read_varint,
+    "write_varint": write_varint,
+    "write_number": write_number,
+    "unpack_float64": FLOAT64.unpack_from,
+}
+
+def compile_writer(kind):
+    """
+    Turns a schema into a function writing values of that schema. The function is generated as
+    straight-line code, with the fields, bitmaps and one-byte varints inlined, so encoding neither
+    walks the schema nor calls a function per field.
+    """
+    source = Source()
+    source.add(0, "def write(out, value):")
+    emit_write(source, kind, 1, "value")
+    namespace = dict(CODEC_NAMESPACE)
+    exec("\n".join(source.lines), namespace)
+    return namespace["write"]
+
+def compile_reader(kind):
+    """
+    Turns a schema into a function reading values of that schema, generated the same way.
+    """
+    source = Source()
+    source.add(0, "def read(data, p):")
+    emit_read(source, kind, 1, "value")
+    source.add(1, "return value, p")
+    namespace = dict(CODEC_NAMESPACE)
+    exec("\n".join(source.lines), namespace)
+    return namespace["read"]
+
+# Version -> message type -> (writer, reader)
+CODECS = {
+    version: {message_type: (compile_writer(schema), compile_reader(schema)) for message_type, schema in schemas.items()}
+    for version, schemas in SCHEMAS.items()
+}
+
+############################################################################################################################################################################################
+
+def encode_message(message, version, message_type=METRICS):
+    """
+    Encodes a message with the given wire format version.
+    Raises WireFormatError when the message does not fit the schema.
+    """
+    codec = CODECS.get(version, {}).get(message_type)
+    if codec is None:
+        raise WireFormatError(f"Unsupported wire format version {version} or message type {message_type}")
+
+    out = bytearray(HEADER.pack(MAGIC, version, message_type))
+    codec[0](out, message)
+    return bytes(out)
+
+def decode_message(data):
+    """
+    Decodes a binary datagram (bytes or a memoryview over a receive buffer) back into the message dict.
+    """
+    magic, version, message_type = HEADER.unpack_from(data, 0)
+    codec = CODECS.get(version, {}).get(message_type)
+    if magic != MAGIC or codec is None:
+        raise WireFormatError(f"Unsupported datagram: version {version}, message type {message_type}")
+
+    try:
+        message, position = codec[1](data, HEADER.size)
+    except (IndexError, struct.error) as e:
+        raise WireFormatError(f"Truncated datagram: {e}")
+    if position != len(data):
+        raise WireFormatError("Trailing bytes after the message")
+    return message
+
+def encode(message, version):
+    """
+    Encodes a message with the negotiated version, or as JSON when there is none or it does not fit.
+    """
+    if version is not None:
+        try:
+            return encode_message(message, version)
+        except WireFormatError:
+            pass
+    return json.dumps(message).encode()
+
+def decode(data):
+    """
+    Decodes a datagram in either format.
+    """
+    if is_binary(data):
+        return decode_message(data)
+    return json.loads(str(data, "utf-8"))
+
+############################################################################################################################################################################################
+
+if __name__ == "__main__":
+    # Usage: python wire_format.py [metrics file ...]
+    # Compares the size and the encode/decode time of JSON and binary metrics datagrams
+    samples = []
+    for file_path in sys.argv[1:]:
+        with open(file_path, "r") as file:
+            samples.extend(json.load(file) if file_path.endswith(".json") else map(json.loads, file))
+
+    messages = [{"agent_id": "1", "metrics": sample} for sample in samples]
+    encoded = [encode(message, SUPPORTED_VERSIONS[-1]) for message in messages]
+    binary = [data for data in encoded if is_binary(data)]
+    json_size = sum(len(json.dumps(message).encode()) for message in messages)
+    print(f"{len(messages)} messages, {len(binary)} binary: JSON {json_size} bytes, wire {sum(map(len, encoded))} bytes "
+          f"({json_size / max(1, sum(map(len, encoded))):.1f}x smaller)")
+
+    for name, encoder, decoder, payloads in (
+        ("json", lambda message: json.dumps(message).encode(), lambda data: json.loads(data.decode()), [json.dumps(m).encode() for m in messages]),
+        ("binary", lambda message: encode(message, SUPPORTED_VERSIONS[-1]), decode, encoded),
+    ):
+        started = time.perf_counter()
+        for message in messages:
+            encoder(message)
+        encode_time = time.perf_counter() - started
+        started = time.perf_counter()
+        for data in payloads:
+            decoder(data)
+        decode_time = time.perf_counter() - started
+        print(f"{name:>6} | encode {encode_time / max(1, len(messages)) * 1e6:6.2f} us | decode {decode_time / max(1, len(messages)) * 1e6:6.2f} us")
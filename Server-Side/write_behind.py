@@ -0,0 +1,189 @@
+import time
+import queue
+import logging
+import threading
+
+class WriteBehindBuffer:
+    """
+    A bounded in-memory queue between metrics ingest and disk.
+    A background flusher thread drains the queue once per flush interval and commits every
+    queued sample with one batched write per agent (group commit).
+    """
+
+    ACK_ON_ENQUEUE = "enqueue"    # ACK as soon as the sample is queued
+    ACK_ON_COMMIT = "commit"      # ACK only once the sample has been written to disk
+
+    DURABILITY_MODES = (ACK_ON_ENQUEUE, ACK_ON_COMMIT)
+
+    def __init__(self, storage, durability=ACK_ON_ENQUEUE, max_queue=10000, flush_interval=0.5, max_batch=5000, logger=None):
+        if durability not in self.DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+
+        self.storage = storage
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.queue = queue.Queue(maxsize=max_queue)
+
+        # Use the provided logger or the root logger
+        self.logger = logger or logging.getLogger()
+
+        # Counters
+        self.stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.samples_flushed = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+        self.running = False
+        self.flusher_thread = None
+
+############################################################################################################################################################################################
+
+    def start(self):
+        """
+        Starts the background flusher thread.
+        """
+        if self.running:
+            return
+        self.running = True
+        self.flusher_thread = threading.Thread(target=self.run_flusher, daemon=True)
+        self.flusher_thread.start()
+        self.logger.info(f"Write-behind buffer started (durability: {self.durability}, flush interval: {self.flush_interval}s).")
+
+############################################################################################################################################################################################
+
+    def submit(self, agent_id, metrics, ack=None, failed=None):
+        """
+        Queues a metrics sample for the specified agent without blocking.
+        The `ack` callback is called once the sample may be acknowledged: right away when
+        it is queued, or by the flusher once it is committed to disk, depending on the
+        durability mode. In the commit mode, `failed` is called instead when the write fails,
+        so the sample can be received again. Returns False (and never calls `ack`) if the queue is full.
+        """
+        return self.submit_batch(agent_id, [metrics], ack, failed)
+
+    def submit_batch(self, agent_id, samples, ack=None, failed=None):
+        """
+        Queues a batch of samples of one agent as a single entry, with a single `ack` (and `failed`)
+        callback for the whole batch. Same semantics as submit().
+        """
+        on_commit = ack if self.durability == self.ACK_ON_COMMIT else None
+        on_failure = failed if self.durability == self.ACK_ON_COMMIT else None
+
+        try:
+            self.queue.put_nowait((agent_id, samples, on_commit, on_failure))
+        except queue.Full:
+            with self.stats_lock:
+                self.rejected += 1
+            self.logger.warning(f"Write-behind queue full, dropping metrics from agent {agent_id}.")
+            return False
+
+        with self.stats_lock:
+            self.enqueued += len(samples)
+
+        if ack is not None and on_commit is None:
+            ack()
+        return True
+
+############################################################################################################################################################################################
+
+    def run_flusher(self):
+        """
+        Flusher loop: waits for the first queued sample, lets the rest of the flush interval
+        elapse so more samples can join the batch, then commits them all at once.
+        """
+        last_flush = time.monotonic()
+
+        while self.running or not self.queue.empty():
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            remaining = self.flush_interval - (time.monotonic() - last_flush)
+            if remaining > 0 and self.running:
+                time.sleep(remaining)
+
+            batch = [first]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self.flush(batch)
+            last_flush = time.monotonic()
+
+############################################################################################################################################################################################
+
+    def flush(self, batch):
+        """
+        Commits a batch of queued samples with one write per agent, then runs the ACK callbacks
+        of the samples that were stored and the failure callbacks of the others. Unacknowledged
+        samples are retransmitted by the agents.
+        """
+        started = time.monotonic()
+
+        by_agent = {}
+        for agent_id, samples, _, _ in batch:
+            by_agent.setdefault(agent_id, []).extend(samples)
+
+        stored = {}
+        for agent_id, samples in by_agent.items():
+            try:
+                stored[agent_id] = self.storage.store_metrics_batch_in_file(agent_id, samples)
+            except Exception as e:
+                self.logger.error(f"Failed to write metrics from agent {agent_id}: {e}")
+                stored[agent_id] = False
+
+        latency = time.monotonic() - started
+        with self.stats_lock:
+            self.flushes += 1
+            self.samples_flushed += sum(len(samples) for _, samples, _, _ in batch)
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self.total_flush_latency += latency
+
+        for agent_id, _, on_commit, on_failure in batch:
+            callback = on_commit if stored[agent_id] else on_failure
+            if callback is not None:
+                try:
+                    callback()
+                except Exception as e:
+                    self.logger.error(f"Failed to handle the write of metrics from agent {agent_id}: {e}")
+
+############################################################################################################################################################################################
+
+    def stats(self):
+        """
+        Returns the buffer counters: queue depth, flush counts and flush latencies (in seconds).
+        """
+        with self.stats_lock:
+            return {
+                "durability": self.durability,
+                "queue_depth": self.queue.qsize(),
+                "queue_capacity": self.queue.maxsize,
+                "enqueued": self.enqueued,
+                "rejected": self.rejected,
+                "flushes": self.flushes,
+                "samples_flushed": self.samples_flushed,
+                "last_flush_latency": self.last_flush_latency,
+                "max_flush_latency": self.max_flush_latency,
+                "avg_flush_latency": self.total_flush_latency / self.flushes if self.flushes else 0.0,
+            }
+
+############################################################################################################################################################################################
+
+    def close(self):
+        """
+        Stops the flusher thread after committing everything still queued.
+        """
+        self.running = False
+        if self.flusher_thread:
+            self.flusher_thread.join()
+            self.flusher_thread = None
+        self.logger.info("Write-behind buffer stopped.")
@@ -0,0 +1,42 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The server modules import each other by name, as when NMS_Server runs from Server-Side
+sys.path.insert(0, os.path.join(ROOT, "Server-Side"))
+
+@pytest.fixture
+def storage(tmp_path):
+    """
+    A JSON-backed Storage in a temporary folder, with a small ring buffer and one hour of raw retention.
+    """
+    from storage import Storage
+    from retention import RetentionPolicy
+
+    storage = Storage(storage_folder=str(tmp_path / "metrics"), hot_capacity=50, retention_policy=RetentionPolicy(raw_retention=3600, block_rows=100))
+    yield storage
+    storage.close()
+
+@pytest.fixture
+def make_server(tmp_path, monkeypatch):
+    """
+    Builds NMS_Servers on loopback with ephemeral ports, storing everything under tmp_path.
+    The event loop is not started; tests call the handlers directly or serve in a thread.
+    """
+    from NMS_Server import NMS_Server
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(NMS_Server, "local_ip", lambda self: "127.0.0.1")
+    servers = []
+
+    def make(**kwargs):
+        kwargs.setdefault("registry_path", str(tmp_path / "agent_registry.jsonl"))
+        server = NMS_Server(0, 0, **kwargs)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.stop()
@@ -0,0 +1,78 @@
+from agent_registry import AgentRegistry
+
+FIRST = ("10.0.0.1", 5000)
+SECOND = ("10.0.0.2", 5000)
+
+def test_registration_handshake_states():
+    registry = AgentRegistry()
+    assert registry.begin(FIRST) == ("1", None)
+    assert registry.registered() == {}
+
+    # A register message while the handshake runs gets the same ID
+    assert registry.begin(FIRST) == ("1", AgentRegistry.PENDING)
+    registry.confirm("1")
+    assert registry.registered() == {"1": FIRST}
+
+    # A registered agent registering again (restarted) keeps its ID but loses its task
+    registry.assign_task("1", "h1")
+    assert registry.task_hash("1") == "h1"
+    assert registry.begin(FIRST) == ("1", AgentRegistry.REGISTERED)
+    assert registry.task_hash("1") is None
+    assert registry.registered() == {}
+    assert registry.stats() == {"registered": 0, "pending": 1, "next_id": 2, "journal_records": 0}
+
+def test_ids_are_never_handed_out_twice():
+    registry = AgentRegistry()
+    assert registry.begin(FIRST) == ("1", None)
+    registry.cancel("1")
+    assert registry.begin(SECOND) == ("2", None)
+    assert registry.begin(FIRST) == ("3", None)
+
+def test_tasks_are_only_assigned_to_registered_agents():
+    registry = AgentRegistry()
+    registry.begin(FIRST)
+    registry.assign_task("1", "h1")
+    registry.assign_task("9", "h1")
+    assert registry.task_hash("1") is None
+    assert registry.task_hash("9") is None
+
+def test_registered_agents_survive_a_restart(tmp_path):
+    path = str(tmp_path / "agent_registry.jsonl")
+    registry = AgentRegistry(path)
+    registry.begin(FIRST)
+    registry.begin(SECOND)
+    registry.confirm("1")
+    registry.confirm("2")
+    registry.assign_task("2", "h2")
+    registry.cancel("2")
+    registry.close()
+
+    # Cancelled agents are not kept, and their IDs are not reused
+    reloaded = AgentRegistry(path)
+    assert reloaded.registered() == {"1": FIRST}
+    assert reloaded.begin(FIRST) == ("1", AgentRegistry.REGISTERED)
+    assert reloaded.begin(SECOND) == ("3", None)
+    reloaded.close()
+
+def test_journal_is_compacted_and_keeps_ids_monotonic(tmp_path):
+    path = str(tmp_path / "agent_registry.jsonl")
+    registry = AgentRegistry(path, last_seen_interval=0)
+    registry.begin(FIRST)
+    registry.confirm("1")
+    registry.assign_task("1", "h1")
+    registry.begin(SECOND)
+    registry.confirm("2")
+    registry.cancel("2")
+
+    for _ in range(200):
+        registry.touch("1")
+    assert registry.stats()["journal_records"] <= 2 * 1 + 64 + 1
+    registry.close()
+
+    with open(path) as file:
+        assert sum(1 for _ in file) == registry.stats()["journal_records"]
+    reloaded = AgentRegistry(path)
+    assert reloaded.registered() == {"1": FIRST}
+    assert reloaded.task_hash("1") == "h1"
+    assert reloaded.begin(("10.0.0.3", 5000)) == ("3", None)
+    reloaded.close()
@@ -0,0 +1,38 @@
+import time
+from alert_journal import AlertJournal
+
+def test_query_alerts_by_agent_type_and_time(storage):
+    now = time.time()
+    storage.store_alerts_in_file("1", {"alert": "jitter", "value": 3, "timestamp": now - 7200})
+    storage.store_alerts_in_file("1", {"alert": "jitter", "value": 4, "timestamp": now - 60})
+    storage.store_alerts_in_file("2", {"alert": "cpu_usage", "value": 95, "timestamp": now - 30})
+
+    assert [alert["value"] for alert in storage.query_alerts(alert_type="jitter", start=now - 3600)] == [4]
+    assert [alert["value"] for alert in storage.query_alerts(agent_id="2")] == [95]
+    assert len(storage.query_alerts(start=now - 3600)) == 2
+
+def test_indexes_are_rebuilt_from_the_journal(tmp_path):
+    journal = AlertJournal(str(tmp_path))
+    for i in range(10):
+        journal.append({"agent_id": str(i % 2), "alert": "cpu_usage" if i % 3 else "jitter", "value": i, "timestamp": 100.0 + i})
+    journal.close()
+
+    journal = AlertJournal(str(tmp_path))
+    assert [alert["value"] for alert in journal.query("1", "cpu_usage", start=102.0, end=108.0)] == [5, 7]
+    assert journal.count(alert_type="jitter") == 4
+    journal.close()
+
+def test_query_reads_the_journal_once_in_time_order(tmp_path, monkeypatch):
+    journal = AlertJournal(str(tmp_path))
+    for i in range(20):
+        journal.append({"agent_id": "1", "alert": "jitter", "value": i, "timestamp": 100.0 + i})
+    journal.append({"agent_id": "1", "alert": "jitter", "value": "late", "timestamp": 104.5})
+
+    opened = []
+    real_open = open
+    monkeypatch.setattr("builtins.open", lambda *args, **kwargs: opened.append(args[0]) or real_open(*args, **kwargs))
+    alerts = journal.query("1", "jitter", start=103.0, end=107.0)
+
+    assert [alert["value"] for alert in alerts] == [3, 4, "late", 5, 6]
+    assert opened == [journal.journal.file_path]
+    journal.close()
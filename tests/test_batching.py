@@ -0,0 +1,43 @@
+from parse_json import TaskConfig
+
+def batch_message(seq, sent_at, collected_at):
+    batch = [{"cpu_usage": float(i), "collected_at": collected} for i, collected in enumerate(collected_at)]
+    return {"agent_id": "1", "seq": seq, "window_start": 1, "batch": batch, "sent_at": sent_at}
+
+def test_batch_span_is_the_longest_wait_in_a_batch():
+    assert TaskConfig("t", 5, []).batch_span() == 0.0
+    assert TaskConfig("t", 5, [], batch_size=4).batch_span() == 15
+    assert TaskConfig("t", 5, [], batch_interval=30).batch_span() == 35
+    assert TaskConfig("t", 5, [], batch_size=4, batch_interval=30).batch_span() == 15
+
+def test_a_batch_is_queued_and_acknowledged_once(make_server, monkeypatch):
+    server = make_server()
+    sent = []
+    monkeypatch.setattr(server.net_task, "send_message", lambda message, address, agent_id=None: sent.append(message))
+    monkeypatch.setattr("NMS_Server.time.time", lambda: 1000.0)
+
+    server.process_metrics(batch_message(1, 500.0, [497.0, 498.5, 500.0]), ("127.0.0.1", 9))
+
+    # Samples are stamped with the receive time minus how long before sending they were collected
+    agent_id, samples, _, _ = server.write_buffer.queue.get_nowait()
+    assert server.write_buffer.queue.empty()
+    assert [sample["timestamp"] for sample in samples] == [997.0, 998.5, 1000.0]
+    assert all("collected_at" not in sample for sample in samples)
+    assert [message["ack"] for message in sent] == [1]
+
+def test_timestamps_are_bounded_and_never_go_back(make_server, monkeypatch):
+    server = make_server()
+    monkeypatch.setattr(server.net_task, "send_message", lambda message, address, agent_id=None: None)
+    now = [1000.0]
+    monkeypatch.setattr("NMS_Server.time.time", lambda: now[0])
+
+    # A sample kept an hour in the agent's backlog is stamped max_backdate before receipt
+    server.process_metrics(batch_message(1, 5000.0, [1400.0, 4999.0]), ("127.0.0.1", 9))
+    _, samples, _, _ = server.write_buffer.queue.get_nowait()
+    assert [sample["timestamp"] for sample in samples] == [1000.0 - server.max_backdate, 999.0]
+
+    # A later batch collected earlier still lands after the last accepted sample
+    now[0] = 1001.0
+    server.process_metrics(batch_message(2, 100.0, [95.0]), ("127.0.0.1", 9))
+    _, samples, _, _ = server.write_buffer.queue.get_nowait()
+    assert [sample["timestamp"] for sample in samples] == [999.0]
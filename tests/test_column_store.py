@@ -0,0 +1,66 @@
+import math
+import threading
+from column_store import ColumnStore
+
+def values(view):
+    return [float(value) for value in view]
+
+def test_scan_returns_appended_rows(tmp_path):
+    store = ColumnStore(str(tmp_path))
+    store.append_many("1", [(100.0 + i, {"cpu_usage": float(i), "interface_stats": {"eth0": {"bytes_sent": i * 10}}}) for i in range(10)])
+
+    data = store.scan("1", ["cpu_usage", "interface_stats.eth0.bytes_sent"], start=103.0, end=106.0)
+    assert values(data["timestamp"]) == [103.0, 104.0, 105.0]
+    assert values(data["cpu_usage"]) == [3.0, 4.0, 5.0]
+    assert values(data["interface_stats.eth0.bytes_sent"]) == [30.0, 40.0, 50.0]
+    store.close()
+
+def test_new_columns_are_backfilled_and_rows_survive_reopening(tmp_path):
+    store = ColumnStore(str(tmp_path))
+    store.append("1", {"cpu_usage": 1.0}, timestamp=1.0)
+    store.append("1", {"cpu_usage": 2.0, "ram_usage": 50.0}, timestamp=2.0)
+    store.close()
+
+    store = ColumnStore(str(tmp_path))
+    assert store.columns("1") == ["cpu_usage", "ram_usage"]
+    data = store.scan("1")
+    assert values(data["cpu_usage"]) == [1.0, 2.0]
+    assert math.isnan(data["ram_usage"][0]) and data["ram_usage"][1] == 50.0
+    store.close()
+
+def test_out_of_order_timestamps_are_moved_forward(tmp_path):
+    store = ColumnStore(str(tmp_path))
+    store.append_rows("1", [(10.0, {"cpu_usage": 1.0}), (5.0, {"cpu_usage": 2.0})])
+    assert values(store.scan("1")["timestamp"]) == [10.0, 10.0]
+    store.close()
+
+def test_trim_drops_older_rows(tmp_path):
+    store = ColumnStore(str(tmp_path))
+    store.append_rows("1", [(float(i), {"cpu_usage": float(i)}) for i in range(10)])
+    assert store.trim("1", 4.0) == 4
+    assert values(store.scan("1")["cpu_usage"]) == [4.0, 5.0, 6.0, 7.0, 8.0, 9.0]
+    store.close()
+
+def test_scan_is_not_torn_by_a_concurrent_trim(tmp_path):
+    store = ColumnStore(str(tmp_path))
+    stop = threading.Event()
+
+    def append_and_trim():
+        timestamp = 0.0
+        while not stop.is_set():
+            store.append_rows("1", [(timestamp + i, {"cpu_usage": timestamp + i, "ram_usage": timestamp + i}) for i in range(20)])
+            timestamp += 20
+            store.trim("1", timestamp - 30)
+
+    writer = threading.Thread(target=append_and_trim)
+    writer.start()
+    try:
+        for _ in range(300):
+            data = store.scan("1", ["cpu_usage", "ram_usage"])
+            # Every column comes from the same generation of the files, so rows stay aligned
+            assert values(data["cpu_usage"]) == values(data["timestamp"])
+            assert values(data["ram_usage"]) == values(data["timestamp"])
+    finally:
+        stop.set()
+        writer.join()
+    store.close()
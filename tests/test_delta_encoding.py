@@ -0,0 +1,36 @@
+from delta_encoding import DeltaEncoder, DeltaDecoder, diff, apply
+
+def sample(cpu, bytes_sent, latency=0.5):
+    return {"cpu_usage": cpu, "interface_stats": {"eth0": {"bytes_sent": bytes_sent, "bytes_recv": 7}}, "link_metrics": {"latency": {"latency": latency}}}
+
+def test_diff_and_apply_round_trip():
+    base, current = sample(1.0, 100), sample(2.0, 100, latency=0.75)
+    delta = diff(base, current)
+    assert delta == {"cpu_usage": 2.0, "link_metrics": {"latency": {"latency": 0.75}}}
+    assert apply(base, delta) == current
+
+def test_removed_field_cannot_be_a_delta():
+    assert diff({"cpu_usage": 1.0, "ram_usage": 2.0}, {"cpu_usage": 1.0}) is None
+
+def test_encoder_and_decoder_round_trip():
+    encoder, decoder = DeltaEncoder(keyframe_interval=4), DeltaDecoder()
+    for seq in range(1, 20):
+        samples = [sample(float(seq), seq * 100), sample(float(seq) + 0.5, seq * 100 + 50)]
+        base_seq, payload = encoder.encode(seq, samples)
+        if seq % 4 == 0 or seq == 1:
+            assert base_seq is None
+        assert decoder.decode(seq, base_seq, payload) == samples
+        encoder.acknowledged(seq, samples)
+    assert encoder.stats()["deltas"] > 0
+
+def test_unknown_base_asks_for_resync():
+    encoder, decoder = DeltaEncoder(), DeltaDecoder()
+    encoder.acknowledged(1, [sample(1.0, 100)])
+    base_seq, payload = encoder.encode(2, [sample(2.0, 200)])
+    assert base_seq == 1
+    assert decoder.decode(2, base_seq, payload) is None
+
+    encoder.resync()
+    base_seq, payload = encoder.encode(2, [sample(2.0, 200)])
+    assert base_seq is None
+    assert decoder.decode(2, base_seq, payload) == [sample(2.0, 200)]
@@ -0,0 +1,74 @@
+import random
+import pytest
+from fragmentation import Fragmenter, Reassembler, FragmentationError, FRAGMENT_HEADER
+
+ADDRESS = ("127.0.0.1", 5000)
+
+def payload(size):
+    return bytes(random.Random(size).randrange(256) for _ in range(size))
+
+def test_small_payloads_are_sent_as_they_are():
+    data = payload(1200)
+    assert Fragmenter().fragment(data) == [data]
+
+def test_fragments_are_reassembled_in_any_order_and_with_duplicates():
+    data = payload(5000)
+    fragments = Fragmenter().fragment(data)
+    assert len(fragments) == 5
+    assert all(len(fragment) <= 1200 for fragment in fragments)
+
+    reassembler = Reassembler()
+    shuffled = fragments[::-1] + [fragments[2]]
+    results = [reassembler.add(memoryview(fragment), ADDRESS) for fragment in shuffled[:-1]]
+    assert results[:-1] == [None] * 4
+    assert results[-1] == data
+    # A late duplicate starts a new partial message rather than completing anything
+    assert reassembler.add(shuffled[-1], ADDRESS) is None
+    assert reassembler.stats() == {"reassembling": 1, "reassembled": 1, "expired": 0, "dropped": 0}
+
+def test_fragments_of_different_senders_are_kept_apart():
+    fragmenter = Fragmenter()
+    first, second = fragmenter.fragment(payload(3000)), fragmenter.fragment(payload(3001))
+    reassembler = Reassembler()
+    other = ("127.0.0.1", 5001)
+    assert reassembler.add(first[0], ADDRESS) is None
+    assert reassembler.add(second[0], other) is None
+    assert reassembler.add(first[1], other) is None
+    assert reassembler.add(first[1], ADDRESS) is None
+    assert reassembler.add(first[2], ADDRESS) == payload(3000)
+
+def test_partial_messages_expire(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("fragmentation.time.monotonic", lambda: clock[0])
+    fragments = Fragmenter().fragment(payload(3000))
+    reassembler = Reassembler(timeout=5.0)
+    assert reassembler.add(fragments[0], ADDRESS) is None
+
+    clock[0] += 6.0
+    assert reassembler.add(fragments[1], ADDRESS) is None
+    assert reassembler.add(fragments[2], ADDRESS) is None
+    assert reassembler.stats()["expired"] == 1
+    assert reassembler.stats()["reassembling"] == 1
+
+def test_limits_drop_partial_messages():
+    fragmenter = Fragmenter()
+    reassembler = Reassembler(max_messages=2, max_message_size=2000)
+    messages = [fragmenter.fragment(payload(2500 + i)) for i in range(3)]
+    for fragments in messages:
+        reassembler.add(fragments[0], ADDRESS)
+    # The oldest partial message made room for the newest one
+    assert reassembler.stats() == {"reassembling": 2, "reassembled": 0, "expired": 0, "dropped": 1}
+
+    # A message growing past max_message_size is dropped
+    assert reassembler.add(messages[2][1], ADDRESS) is None
+    assert reassembler.stats() == {"reassembling": 1, "reassembled": 0, "expired": 0, "dropped": 2}
+
+def test_malformed_fragments_are_dropped():
+    reassembler = Reassembler()
+    assert reassembler.add(FRAGMENT_HEADER.pack(0xA8, 1, 3, 2), ADDRESS) is None
+    assert reassembler.add(b"\xa8\x00", ADDRESS) is None
+    assert reassembler.stats()["dropped"] == 2
+
+def test_payload_needing_too_many_fragments_is_refused():
+    with pytest.raises(FragmentationError):
+        Fragmenter(max_datagram=FRAGMENT_HEADER.size + 1).fragment(bytes(0x10000 + 1))
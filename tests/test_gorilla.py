@@ -0,0 +1,36 @@
+import math
+from gorilla import BlockStore, encode_block, decode_block
+
+def test_block_round_trip():
+    timestamps = [1700000000.0 + i * 5 + (0.25 if i % 7 == 0 else 0.0) for i in range(200)]
+    columns = {
+        "cpu_usage": [41.2 + (i % 13) * 0.1 for i in range(200)],
+        "interface_stats.eth0.bytes_sent": [1000 * i for i in range(200)],
+        "link_metrics.latency.latency": [math.nan if i % 10 == 0 else 0.5 * i for i in range(200)],
+    }
+
+    decoded_timestamps, decoded = decode_block(encode_block(timestamps, columns))
+    assert decoded_timestamps == timestamps
+    assert decoded["cpu_usage"] == columns["cpu_usage"]
+    assert decoded["interface_stats.eth0.bytes_sent"] == columns["interface_stats.eth0.bytes_sent"]
+    latency = decoded["link_metrics.latency.latency"]
+    assert [math.isnan(value) for value in latency] == [math.isnan(value) for value in columns["link_metrics.latency.latency"]]
+    assert [value for value in latency if not math.isnan(value)] == [value for value in columns["link_metrics.latency.latency"] if not math.isnan(value)]
+
+def test_decode_only_requested_columns():
+    _, decoded = decode_block(encode_block([1.0, 2.0], {"cpu_usage": [1.0, 2.0], "ram_usage": [3.0, 4.0]}), ["ram_usage"])
+    assert decoded == {"ram_usage": [3.0, 4.0]}
+
+def test_block_store_scan_and_random_access(tmp_path):
+    store = BlockStore(str(tmp_path))
+    for block in range(3):
+        timestamps = [float(block * 100 + i) for i in range(100)]
+        store.append("1", timestamps, {"cpu_usage": [float(block)] * 100})
+
+    assert store.last_timestamp("1") == 299.0
+    timestamps, decoded = store.read_block("1", 1)
+    assert timestamps[0] == 100.0 and decoded["cpu_usage"] == [1.0] * 100
+
+    data = store.scan("1", ["cpu_usage"], start=150.0, end=250.0)
+    assert data["timestamp"] == [float(i) for i in range(150, 250)]
+    assert data["cpu_usage"] == [1.0] * 50 + [2.0] * 50
@@ -0,0 +1,48 @@
+import os
+import json
+from journal import Journal
+
+def test_records_are_read_back_at_their_offsets(tmp_path):
+    journal = Journal(str(tmp_path / "metrics.jsonl"))
+    offsets = journal.append_many([{"cpu_usage": float(i)} for i in range(5)])
+    offsets.append(journal.append({"cpu_usage": 5.0}))
+
+    assert [record["cpu_usage"] for record in journal.read()] == [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+    assert journal.read_at(offsets[3]) == {"cpu_usage": 3.0}
+    assert [record for _, record in journal.read_backward(offsets[4], 2)] == [{"cpu_usage": 2.0}, {"cpu_usage": 3.0}]
+    journal.close()
+
+def test_torn_last_record_is_dropped_on_reopen(tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    journal = Journal(path)
+    journal.append_many([{"cpu_usage": 1.0}, {"cpu_usage": 2.0}])
+    journal.close()
+
+    # A crash in the middle of a write leaves half a line behind
+    with open(path, "ab") as file:
+        file.write(b'{"cpu_usage": 3.')
+
+    journal = Journal(path)
+    journal.append({"cpu_usage": 4.0})
+    assert list(journal.read()) == [{"cpu_usage": 1.0}, {"cpu_usage": 2.0}, {"cpu_usage": 4.0}]
+    journal.close()
+
+def test_corrupt_complete_last_line_is_dropped_on_reopen(tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    with open(path, "wb") as file:
+        file.write(b'{"cpu_usage": 1.0}\n{"cpu_usage": \x00\x00}\n')
+
+    journal = Journal(path)
+    assert list(journal.read()) == [{"cpu_usage": 1.0}]
+    assert journal.size() == len(b'{"cpu_usage": 1.0}\n')
+    journal.close()
+
+def test_legacy_json_array_is_imported_once(storage):
+    legacy_path = storage.legacy_path("1")
+    with open(legacy_path, "w") as file:
+        json.dump([{"cpu_usage": 1.0}, {"cpu_usage": 2.0}], file)
+
+    storage.store_metrics_in_file("1", {"cpu_usage": 3.0, "timestamp": 100.0})
+    assert storage.retrieve_metrics_from_file("1") == [{"cpu_usage": 1.0}, {"cpu_usage": 2.0}, {"cpu_usage": 3.0, "timestamp": 100.0}]
+    assert not os.path.exists(legacy_path) and os.path.exists(legacy_path + ".imported")
+    assert storage.list_stored_agents() == ["1"]
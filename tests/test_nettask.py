@@ -0,0 +1,56 @@
+import json
+import socket
+import threading
+import pytest
+import wire_format
+from NetTask_Server import NetTask
+
+def serve(net_task):
+    """
+    Serves `net_task` in a thread with a handler echoing every message back to its sender.
+    Returns once the loop runs.
+    """
+    started = threading.Event()
+
+    def echo(message, addr):
+        net_task.send_message({"echo": message["agent_id"]}, addr)
+
+    thread = threading.Thread(target=net_task.serve, args=(echo, started.set), daemon=True)
+    thread.start()
+    assert started.wait(30)
+    return thread
+
+@pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT"), reason="SO_REUSEPORT is not available")
+def test_ingest_processes_spread_agents_and_replies_come_from_the_port():
+    net_task = NetTask("127.0.0.1", 0, workers=2)
+    thread = serve(net_task)
+
+    agents = []
+    try:
+        for value in range(32):
+            agent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            agent.bind(("127.0.0.1", 0))
+            agent.settimeout(5)
+            agents.append(agent)
+            # Binary and JSON datagrams are both decoded where they arrive
+            message = {"agent_id": str(value), "metrics": {"cpu_usage": float(value)}}
+            agent.sendto(wire_format.encode(message, wire_format.SUPPORTED_VERSIONS[-1] if value % 2 else None), ("127.0.0.1", net_task.udp_port))
+
+        for value, agent in enumerate(agents):
+            data, addr = agent.recvfrom(1024)
+            assert json.loads(data) == {"echo": str(value)}
+            assert addr == ("127.0.0.1", net_task.udp_port)
+
+        # Each agent address sticks to one socket, and with 32 of them both sockets get some
+        stats = net_task.stats()
+        assert [worker["worker"] for worker in stats] == [0, 1]
+        assert stats[1]["alive"]
+        assert sum(worker["datagrams"] for worker in stats) == 32
+        assert all(worker["datagrams"] > 0 for worker in stats)
+    finally:
+        for agent in agents:
+            agent.close()
+        net_task.close()
+        thread.join(5)
+
+    assert not net_task.ingest_processes[0].process.is_alive()
@@ -0,0 +1,72 @@
+import asyncio
+import socket
+from write_behind import WriteBehindBuffer
+
+def metrics_message(seq, cpu_usage):
+    return {"agent_id": "1", "seq": seq, "window_start": 1, "metrics": {"cpu_usage": cpu_usage}}
+
+def test_rejected_batch_is_kept_in_memory_once(make_server, monkeypatch):
+    server = make_server(durability=WriteBehindBuffer.ACK_ON_COMMIT)
+    agent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    agent.bind(("127.0.0.1", 0))
+    address = agent.getsockname()
+
+    # The first write fails, so seq 1 is rejected and the agent sends it again
+    store = server.storage.store_metrics_batch_in_file
+    failures = [True]
+
+    def store_once_failing(agent_id, samples):
+        return not failures.pop() if failures else store(agent_id, samples)
+
+    monkeypatch.setattr(server.storage, "store_metrics_batch_in_file", store_once_failing)
+
+    server.process_metrics(metrics_message(1, 10.0), address)
+    server.write_buffer.flush([server.write_buffer.queue.get_nowait()])
+    assert server.storage.retrieve_metrics("1") == []
+
+    server.process_metrics(metrics_message(1, 10.0), address)
+    server.write_buffer.flush([server.write_buffer.queue.get_nowait()])
+    assert [sample["cpu_usage"] for sample in server.storage.retrieve_metrics("1")] == [10.0]
+    assert [sample["cpu_usage"] for sample in server.storage.retrieve_metrics_from_file("1")] == [10.0]
+    agent.close()
+
+def test_last_sample_time_moves_only_once_a_batch_is_stored(make_server, monkeypatch):
+    server = make_server(durability=WriteBehindBuffer.ACK_ON_COMMIT)
+    address = ("127.0.0.1", 9)
+
+    server.process_metrics(metrics_message(1, 10.0), address)
+    assert "1" not in server.last_sample_times
+    entry = server.write_buffer.queue.get_nowait()
+    server.write_buffer.flush([entry])
+    stored_at = server.last_sample_times["1"]
+    assert stored_at == entry[1][0]["timestamp"]
+
+    # A batch whose write fails leaves it where it was
+    monkeypatch.setattr(server.storage, "store_metrics_batch_in_file", lambda agent_id, samples: False)
+    server.process_metrics(metrics_message(2, 11.0), address)
+    server.write_buffer.flush([server.write_buffer.queue.get_nowait()])
+    assert server.last_sample_times["1"] == stored_at
+
+def test_restarted_agent_starts_a_new_receive_window(make_server, monkeypatch):
+    server = make_server()
+    address = ("127.0.0.1", 9)
+
+    async def acknowledged(*args):
+        return True
+
+    async def no_tasks(agent_ids=None):
+        pass
+
+    monkeypatch.setattr(server.net_task, "send_with_retransmission", acknowledged)
+    monkeypatch.setattr(server, "send_task_to_agents", no_tasks)
+
+    asyncio.run(server.register_agent({}, address))
+    for seq in (1, 2, 3):
+        server.process_metrics(metrics_message(seq, float(seq)), address)
+
+    # The agent restarts at the same address, keeps its ID and numbers its samples from 1 again
+    asyncio.run(server.register_agent({}, address))
+    assert server.agent_registry.registered() == {"1": address}
+    server.process_metrics(metrics_message(1, 10.0), address)
+    assert [sample["cpu_usage"] for sample in server.storage.retrieve_metrics("1")] == [1.0, 2.0, 3.0, 10.0]
+    assert server.get_metrics_window("1").ack_message("1")["ack"] == 1
@@ -0,0 +1,62 @@
+import time
+
+def store(storage, agent_id, samples):
+    storage.store_metrics_batch_in_file(agent_id, samples)
+    for sample in samples:
+        storage.store_metrics(agent_id, sample)
+
+def test_metric_history_reads_memory_columns_rollups_and_archive(storage):
+    now = time.time()
+    store(storage, "1", [{"cpu_usage": float(i % 50), "timestamp": now - 7200 + i * 10} for i in range(720)])
+    storage.compactor.compact(now=now)
+
+    source, rows = storage.metric_history("1", "cpu_usage", now - 300)
+    assert source == "memory" and len(rows) == 30
+
+    source, rows = storage.metric_history("1", "cpu_usage", now - 1800, sample_interval=10)
+    assert source == "raw" and len(rows) == 180 and rows[-1][1] == {"value": 19.0}
+
+    source, rows = storage.metric_history("1", "cpu_usage", now - 3000)
+    assert source == "1m" and set(rows[0][1]) == {"min", "max", "avg", "count", "last"}
+
+    source, rows = storage.metric_history("1", "cpu_usage", now - 7200, full_resolution=True)
+    assert source == "archive" and len(rows) == 720
+
+def test_raw_retention_only_trims_archived_samples(storage):
+    now = time.time()
+    store(storage, "1", [{"cpu_usage": 1.0, "timestamp": now - 7200 + i} for i in range(10)])
+    storage.compactor.compact(now=now)
+
+    assert storage.compactor.archive.last_timestamp("1") == now - 7191
+    assert len(storage.scan_archive("1", ["cpu_usage"])["cpu_usage"]) == 10
+    assert len(storage.scan_metrics("1", ["cpu_usage"])["cpu_usage"]) == 0
+
+def test_full_resolution_history_does_not_repeat_the_last_archived_sample(storage):
+    # Archived timestamps are rounded to milliseconds, these are not
+    now = time.time()
+    store(storage, "1", [{"cpu_usage": float(i), "timestamp": now - 1000 + i + 0.0004} for i in range(250)])
+    storage.compactor.compact(now=now)
+    assert len(storage.scan_archive("1", ["cpu_usage"])["cpu_usage"]) == 200
+    assert len(storage.scan_metrics("1", ["cpu_usage"])["cpu_usage"]) == 250
+
+    source, rows = storage.metric_history("1", "cpu_usage", now - 1000, full_resolution=True)
+    assert source == "archive"
+    assert [fields["value"] for _, fields in rows] == [float(i) for i in range(250)]
+
+def test_choose_tier_by_range_and_point_count(storage):
+    compactor = storage.compactor
+    now = 10 ** 9
+    assert compactor.choose_tier(now - 600, now=now) == "raw"
+    assert compactor.choose_tier(now - 600, now=now, max_points=100) == "1m"
+    assert compactor.choose_tier(now - 7200, now=now) == "1m"
+    assert compactor.choose_tier(now - 7 * 24 * 3600, now=now) == "1h"
+
+def test_open_ended_queries_read_the_coarsest_tier(storage):
+    # Only the first hour is a complete bucket at `now`
+    now = 3600 * 500000
+    store(storage, "1", [{"cpu_usage": 1.0, "timestamp": now - 7200 + i * 60} for i in range(100)])
+    storage.compactor.compact(now=now)
+
+    source, columns = storage.query_metrics("1", ["cpu_usage"], None)
+    assert source == "1h" and list(columns["cpu_usage.count"]) == [60.0]
+    assert storage.metric_history("1", "cpu_usage", None)[0] == "1h"
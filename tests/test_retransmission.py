@@ -0,0 +1,65 @@
+import json
+import socket
+import threading
+import pytest
+from retransmission import RttEstimator, RttEstimators
+from NetTask_Server import NetTask
+
+def test_estimates_follow_jacobson_karels():
+    estimator = RttEstimator(initial_rto=1.0, min_rto=0.0, granularity=0.0)
+    assert estimator.timeout() == 1.0
+
+    estimator.sample(0.1)
+    assert estimator.srtt == pytest.approx(0.1)
+    assert estimator.rttvar == pytest.approx(0.05)
+    assert estimator.rto == pytest.approx(0.3)
+
+    estimator.sample(0.3)
+    assert estimator.rttvar == pytest.approx(0.75 * 0.05 + 0.25 * 0.2)
+    assert estimator.srtt == pytest.approx(0.875 * 0.1 + 0.125 * 0.3)
+    assert estimator.rto == pytest.approx(estimator.srtt + 4 * estimator.rttvar)
+
+def test_timeouts_are_clamped_and_back_off():
+    estimator = RttEstimator(min_rto=0.05, max_rto=2.0)
+    estimator.sample(0.001)
+    assert estimator.rto == 0.05
+    assert [estimator.timeout(attempt) for attempt in range(7)] == [0.05, 0.1, 0.2, 0.4, 0.8, 1.6, 2.0]
+
+def test_one_estimator_per_peer():
+    estimators = RttEstimators(initial_rto=0.5)
+    assert estimators.get("a") is estimators.get("a")
+    assert estimators.get("b") is not estimators.get("a")
+    assert estimators.get("b").rto == 0.5
+    assert estimators.stats()["a"] == {"srtt_ms": None, "rttvar_ms": None, "rto_ms": 500.0, "samples": 0}
+
+@pytest.mark.parametrize("acked_attempt, samples", [(0, 1), (1, 0)])
+def test_only_acks_of_single_transmissions_are_rtt_samples(acked_attempt, samples):
+    # Karn's algorithm: the ACK of a retransmitted message could answer either copy
+    net_task = NetTask("127.0.0.1", 0)
+    net_task.rtt = RttEstimators(initial_rto=0.2)
+    started = threading.Event()
+    thread = threading.Thread(target=net_task.serve, args=(lambda message, addr: None, started.set), daemon=True)
+    thread.start()
+    assert started.wait(5)
+
+    agent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    agent.bind(("127.0.0.1", 0))
+    agent.settimeout(5)
+    address = agent.getsockname()
+
+    def answer():
+        for attempt in range(acked_attempt + 1):
+            data, server = agent.recvfrom(1024)
+        agent.sendto(json.dumps({"message": "task_ack", "agent_id": "1", "task_id": json.loads(data)["task_id"]}).encode(), server)
+
+    answering = threading.Thread(target=answer)
+    answering.start()
+    try:
+        handshake = net_task.spawn(net_task.send_with_retransmission({"message": "task", "task_id": "t1"}, address, "task_ack", "1", retries=3))
+        assert handshake.result(5)
+        assert net_task.rtt.get(address).samples == samples
+    finally:
+        answering.join()
+        agent.close()
+        net_task.close()
+        thread.join(5)
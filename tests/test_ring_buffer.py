@@ -0,0 +1,42 @@
+import math
+import pytest
+from ring_buffer import MetricsRingBuffer
+
+def test_oldest_samples_are_overwritten_once_full():
+    ring_buffer = MetricsRingBuffer(4)
+    for i in range(10):
+        ring_buffer.append(100.0 + i, {"cpu_usage": float(i)})
+
+    assert len(ring_buffer) == 4
+    assert [sample["cpu_usage"] for sample in ring_buffer.recent_samples()] == [6.0, 7.0, 8.0, 9.0]
+    assert ring_buffer.series("cpu_usage") == ([106.0, 107.0, 108.0, 109.0], [6.0, 7.0, 8.0, 9.0])
+
+def test_windows_by_time_and_by_count():
+    ring_buffer = MetricsRingBuffer(8)
+    for i in range(12):
+        ring_buffer.append(100.0 + i, {"cpu_usage": float(i)})
+
+    assert ring_buffer.series("cpu_usage", since=109.5)[1] == [10.0, 11.0]
+    assert [sample["cpu_usage"] for sample in ring_buffer.recent_samples(last=3)] == [9.0, 10.0, 11.0]
+    assert ring_buffer.recent_samples(since=200.0) == []
+
+def test_new_and_missing_fields_are_nan():
+    ring_buffer = MetricsRingBuffer(4)
+    ring_buffer.append(1.0, {"cpu_usage": 1.0})
+    ring_buffer.append(2.0, {"cpu_usage": 2.0, "interface_stats": {"eth0": {"bytes_sent": 10}}})
+    ring_buffer.append(3.0, {"cpu_usage": 3.0})
+
+    timestamps, values = ring_buffer.series("interface_stats.eth0.bytes_sent")
+    assert math.isnan(values[0]) and values[1] == 10.0 and math.isnan(values[2])
+    assert ring_buffer.metric_names() == ["cpu_usage", "interface_stats.eth0.bytes_sent"]
+    assert all(math.isnan(value) for value in ring_buffer.series("ram_usage")[1])
+
+def test_timestamps_never_go_back():
+    ring_buffer = MetricsRingBuffer(4)
+    ring_buffer.append(10.0, {"cpu_usage": 1.0})
+    ring_buffer.append(5.0, {"cpu_usage": 2.0})
+    assert ring_buffer.series("cpu_usage")[0] == [10.0, 10.0]
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        MetricsRingBuffer(0)
@@ -0,0 +1,16 @@
+import os
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The agent and the server are deployed separately, so each side keeps its own copy of the
+# modules they share. The copies must stay identical, edit one and copy it over.
+SHARED_MODULES = ["wire_format.py", "fragmentation.py", "sliding_window.py", "retransmission.py", "delta_encoding.py"]
+
+@pytest.mark.parametrize("module", SHARED_MODULES)
+def test_shared_module_copies_are_identical(module):
+    with open(os.path.join(ROOT, "Server-Side", module), "rb") as file:
+        server_copy = file.read()
+    with open(os.path.join(ROOT, "Agent-Side", module), "rb") as file:
+        agent_copy = file.read()
+    assert server_copy == agent_copy, f"Server-Side/{module} and Agent-Side/{module} differ"
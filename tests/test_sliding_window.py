@@ -0,0 +1,51 @@
+from sliding_window import SendWindow, ReceiveWindow
+
+def test_send_window_keeps_at_most_window_in_flight():
+    sent = []
+    window = SendWindow(lambda seq, sample: sent.append(seq), window=2, backlog=2)
+    for value in range(5):
+        window.send(value)
+    assert sent == [1, 2]
+    assert window.stats()["dropped"] == 1
+
+    # Selective ACK of 2 frees one slot, then the cumulative ACK frees the other
+    assert window.acknowledge(0, [[2, 2]]) == [(2, 1)]
+    assert sent == [1, 2, 3]
+    assert window.acknowledge(1) == [(1, 0)]
+    assert sent == [1, 2, 3, 4]
+    assert window.window_start() == 3
+
+def test_receive_window_cumulative_and_selective_acks():
+    window = ReceiveWindow()
+    for seq in (1, 2, 4, 5, 7):
+        assert window.accept(seq)
+        window.acknowledge(seq)
+    assert window.ack_message("1") == {"message": "metrics_ack", "agent_id": "1", "ack": 2, "sack": [[4, 5], [7, 7]]}
+
+    window.acknowledge(3) if window.accept(3) else None
+    assert window.ack_message("1")["ack"] == 5
+
+def test_duplicates_are_not_accepted_twice():
+    window = ReceiveWindow()
+    assert window.accept(1)
+    assert not window.accept(1)  # Pending
+    window.acknowledge(1)
+    assert not window.accept(1)  # Stored
+    assert window.duplicates == 2
+
+def test_rejected_seq_is_accepted_again():
+    window = ReceiveWindow()
+    assert window.accept(1)
+    window.reject(1)
+    assert window.accept(1)
+
+def test_restarted_server_starts_at_the_agent_window_start():
+    window = ReceiveWindow()
+    assert window.accept(30, window_start=10)
+    assert window.accept(10, window_start=10)
+    assert not window.accept(9)
+
+    # Without a window start, the first seq seen starts the window
+    legacy = ReceiveWindow()
+    assert legacy.accept(30)
+    assert not legacy.accept(10)
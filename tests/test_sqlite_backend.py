@@ -0,0 +1,54 @@
+import json
+import time
+import sqlite3
+import pytest
+from storage import Storage
+from retention import RetentionPolicy
+from sqlite_backend import SQLiteBackend
+
+@pytest.mark.parametrize("backend", Storage.BACKENDS)
+def test_imported_untimestamped_samples_survive_compaction(tmp_path, backend):
+    folder = tmp_path / "metrics"
+    folder.mkdir()
+    with open(folder / "agent1_metrics_collected.json", "w") as file:
+        json.dump([{"cpu_usage": float(i)} for i in range(91)], file)
+
+    storage = Storage(storage_folder=str(folder), backend=backend, retention_policy=RetentionPolicy(raw_retention=3600, block_rows=10))
+    now = time.time()
+    storage.store_metrics_batch_in_file("1", [{"cpu_usage": 100.0 + i, "timestamp": now - 7200 + i} for i in range(20)])
+    storage.store_metrics_batch_in_file("1", [{"cpu_usage": 200.0, "timestamp": now - 60}])
+    storage.compactor.compact(now=now)
+    storage.trim_journal("1", now - 3600, min_fraction=0)
+
+    # The expired timestamped samples are gone, the imported ones and the recent one are kept
+    stored = storage.retrieve_metrics_from_file("1")
+    assert [metrics["cpu_usage"] for metrics in stored] == [float(i) for i in range(91)] + [200.0]
+    assert [metrics["cpu_usage"] for metrics in storage.retrieve_metrics_range("1", now - 3600)] == [200.0]
+    assert len(list(storage.retrieve_metrics_range("1"))) == 92
+    storage.close()
+
+def test_database_with_zero_timestamps_is_migrated(tmp_path):
+    db_path = str(tmp_path / "metrics.db")
+    connection = sqlite3.connect(db_path)
+    connection.executescript(SQLiteBackend.SCHEMA.replace("timestamp REAL,", "timestamp REAL NOT NULL,"))
+    connection.executemany(SQLiteBackend.INSERT_SAMPLE, [(1, "1", 0.0, '{"cpu_usage":1.0}'), (2, "1", 50.0, '{"cpu_usage":2.0,"timestamp":50.0}')])
+    connection.executemany(SQLiteBackend.INSERT_VALUE, [(1, "1", 0.0, "cpu_usage", 1.0), (2, "1", 50.0, "cpu_usage", 2.0)])
+    connection.commit()
+    connection.close()
+
+    backend = SQLiteBackend(db_path)
+    backend.trim("1", 100.0)
+    assert backend.retrieve_metrics("1") == [{"cpu_usage": 1.0}]
+    assert backend.aggregate("cpu_usage", "count") == {"1": 1}
+    backend.close()
+
+def test_aggregates_run_per_agent_in_sql(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "metrics.db"))
+    backend.store_metrics_batch("1", [{"cpu_usage": 10.0, "timestamp": 100.0}, {"cpu_usage": 30.0, "timestamp": 200.0}])
+    backend.store_metrics_batch("2", [{"cpu_usage": 50.0, "timestamp": 150.0}, {"interface_stats": {"eth0": {"bytes_sent": 7}}, "timestamp": 160.0}])
+
+    assert backend.aggregate("cpu_usage", "avg") == {"1": 20.0, "2": 50.0}
+    assert backend.aggregate("cpu_usage", "max", since=120.0) == {"1": 30.0, "2": 50.0}
+    assert backend.aggregate("interface_stats.eth0.bytes_sent", "sum", agent_id="2") == {"2": 7.0}
+    assert [sample for _, sample in backend.read_page("1", backend.seek_time("1", 150.0), 10)] == [{"cpu_usage": 30.0, "timestamp": 200.0}]
+    backend.close()
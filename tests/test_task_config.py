@@ -0,0 +1,47 @@
+import json
+import asyncio
+from parse_json import TaskConfig, Device, DeviceMetrics, LinkMetrics, AlertFlowConditions
+
+def device(device_id, cpu_usage=True):
+    return Device(
+        device_id,
+        DeviceMetrics(cpu_usage, True, ["eth0"]),
+        LinkMetrics(None, None, None, None),
+        AlertFlowConditions(80, 90, 2000, 5, 10),
+    )
+
+def test_tasks_are_serialized_once_with_their_hash():
+    config = TaskConfig("task-1", 5, [device("1"), device("2", cpu_usage=False)], batch_size=3)
+    payload, task_hash = config.task("1")
+    task = json.loads(payload)
+    assert task["task_hash"] == task_hash
+    assert task["device_id"] == "1" and task["batch_size"] == 3 and task["frequency"] == 5
+    assert config.task("1") is config.task("1")
+    assert config.task("9") is None
+    assert config.device("2").device_metrics.cpu_usage is False
+
+def test_hash_depends_only_on_the_task_content():
+    first = TaskConfig("task-1", 5, [device("1"), device("2")])
+    second = TaskConfig("task-1", 5, [device("1")])
+    assert first.task("1") == second.task("1")
+    assert first.task("1")[1] != first.task("2")[1]
+    assert TaskConfig("task-1", 10, [device("1")]).task("1")[1] != first.task("1")[1]
+
+def test_agents_with_the_current_task_are_skipped(make_server, monkeypatch):
+    server = make_server()
+    server.task_config = TaskConfig("task-1", 5, [device("1"), device("2")])
+    for agent_id, address in (("1", ("127.0.0.1", 9001)), ("2", ("127.0.0.1", 9002))):
+        assert server.agent_registry.begin(address)[0] == agent_id
+        server.agent_registry.confirm(agent_id)
+    server.agent_registry.assign_task("1", server.task_config.task("1")[1])
+
+    dispatched = []
+
+    async def dispatch(tasks):
+        dispatched.extend(tasks)
+        return [True] * len(tasks)
+
+    monkeypatch.setattr(server.task_dispatcher, "dispatch", dispatch)
+    asyncio.run(server.send_task_to_agents())
+    assert [(agent_id, payload) for agent_id, _, _, payload, _ in dispatched] == [("2", server.task_config.task("2")[0])]
+    assert server.agent_registry.task_hash("2") == server.task_config.task("2")[1]
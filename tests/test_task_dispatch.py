@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from retransmission import RttEstimators
+from task_dispatch import TaskDispatcher
+
+class LoopbackNetTask:
+    """
+    The part of NetTask the dispatcher uses, recording sends instead of sending.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.rtt = RttEstimators(initial_rto=0.02, min_rto=0.01)
+        self.sent = []
+
+    def send_payload(self, payload, address):
+        self.sent.append((payload, self.loop.time()))
+
+def run(test):
+    async def main():
+        net_task = LoopbackNetTask(asyncio.get_running_loop())
+        return await test(net_task)
+    return asyncio.run(main())
+
+def task(agent_id, task_hash="h1"):
+    return (agent_id, ("127.0.0.1", 9000 + int(agent_id)), "t1", f"task {agent_id} {task_hash}".encode(), task_hash)
+
+def test_unacknowledged_tasks_back_off_then_fail():
+    async def test(net_task):
+        dispatcher = TaskDispatcher(net_task, logging.getLogger(), retries=3)
+        results = await dispatcher.dispatch([task("1"), task("2")])
+        return dispatcher, net_task, results
+
+    dispatcher, net_task, results = run(test)
+    assert results == [False, False]
+    assert len(net_task.sent) == 6
+
+    # Every agent is sent its task 3 times, each wait twice as long as the previous one
+    times = [sent_at for payload, sent_at in net_task.sent if payload == b"task 1 h1"]
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    assert len(times) == 3 and gaps[1] > 1.5 * gaps[0]
+    assert dispatcher.timers == [] and dispatcher.timer is None
+    assert dispatcher.stats()["failed"] == 2 and dispatcher.stats()["retransmitted"] == 4
+
+def test_in_flight_limit_queues_the_other_tasks():
+    async def test(net_task):
+        dispatcher = TaskDispatcher(net_task, logging.getLogger(), max_in_flight=2)
+        delivery = dispatcher.dispatch([task(str(agent_id)) for agent_id in range(1, 6)])
+        assert [payload for payload, _ in net_task.sent] == [b"task 1 h1", b"task 2 h1"]
+
+        dispatcher.acknowledge("1", "t1", "h1")
+        assert net_task.sent[-1][0] == b"task 3 h1"
+        for agent_id in range(2, 6):
+            dispatcher.acknowledge(str(agent_id), "t1", "h1")
+        return dispatcher, await delivery
+
+    dispatcher, results = run(test)
+    assert results == [True] * 5
+    assert dispatcher.in_flight == 0 and dispatcher.pending == {}
+    assert dispatcher.stats()["acknowledged"] == 5 and dispatcher.stats()["retransmitted"] == 0
+
+def test_acks_only_complete_their_own_task_version():
+    async def test(net_task):
+        dispatcher = TaskDispatcher(net_task, logging.getLogger())
+        old = dispatcher.dispatch([task("1", "h1")])
+        new = dispatcher.dispatch([task("1", "h2")])
+        assert await old == [False]
+
+        # The ACK of the old version arrives late and must not complete the new one
+        dispatcher.acknowledge("1", "t1", "h1")
+        assert not new.done()
+        dispatcher.acknowledge("1", "t1", "h2")
+        return dispatcher, net_task, await new
+
+    dispatcher, net_task, results = run(test)
+    assert results == [True]
+    assert [payload for payload, _ in net_task.sent][:2] == [b"task 1 h1", b"task 1 h2"]
+    assert net_task.rtt.get(("127.0.0.1", 9001)).samples == 1
+    assert "1" in dispatcher.agent_latencies()
+
+def test_dispatching_the_same_version_again_shares_the_handshake():
+    async def test(net_task):
+        dispatcher = TaskDispatcher(net_task, logging.getLogger())
+        first = dispatcher.dispatch([task("1")])
+        second = dispatcher.dispatch([task("1")])
+        dispatcher.acknowledge("1", "t1")
+        return net_task, await first, await second
+
+    net_task, first, second = run(test)
+    assert first == second == [True]
+    assert len(net_task.sent) == 1
@@ -0,0 +1,56 @@
+import json
+
+def device(device_id, cpu_usage=True):
+    return {
+        "device_id": device_id,
+        "device_metrics": {"cpu_usage": cpu_usage, "ram_usage": True, "interface_stats": ["eth0"]},
+        "link_metrics": {"bandwidth": None, "jitter": None, "packet_loss": None, "latency": None},
+        "alertflow_conditions": {"cpu_usage": 80, "ram_usage": 90, "interface_stats": 2000, "packet_loss": 5, "jitter": 10},
+    }
+
+def write_config(path, devices, **settings):
+    with open(path, "w") as file:
+        json.dump({"task_id": "task-1", "frequency": 5, "devices": devices, **settings}, file)
+
+def load(make_server, monkeypatch, path):
+    server = make_server()
+    server.task_path = str(path)
+    server.task_config = server.load_task_config(server.task_path)
+    sends = []
+    monkeypatch.setattr(server, "send_task_to_agents", lambda agent_ids=None: agent_ids)
+    monkeypatch.setattr(server.net_task, "spawn", sends.append)
+    return server, sends
+
+def test_only_changed_and_added_devices_get_the_new_task(make_server, monkeypatch, tmp_path):
+    path = tmp_path / "task.json"
+    write_config(path, [device("1"), device("2"), device("3")])
+    server, sends = load(make_server, monkeypatch, path)
+    unchanged = server.task_config.task("1")
+
+    write_config(path, [device("1"), device("2", cpu_usage=False), device("4")], batch_size=4)
+    server.reload_task_config()
+
+    # The batch settings are part of every task, so every remaining device changed
+    assert sends == [["1", "2", "4"]]
+    assert server.task_config.task("1") != unchanged
+    assert server.task_config.task("3") is None
+    assert server.max_backdate == 15 + server.backdate_margin
+
+    write_config(path, [device("1"), device("2"), device("4")], batch_size=4)
+    server.reload_task_config()
+    assert sends[-1] == ["2"]
+
+    # Reloading the same content sends nothing
+    server.reload_task_config()
+    assert len(sends) == 2
+
+def test_a_configuration_that_fails_to_parse_is_ignored(make_server, monkeypatch, tmp_path):
+    path = tmp_path / "task.json"
+    write_config(path, [device("1")])
+    server, sends = load(make_server, monkeypatch, path)
+    task_config = server.task_config
+
+    path.write_text("{\"task_id\": ")
+    server.reload_task_config()
+    assert server.task_config is task_config
+    assert sends == []
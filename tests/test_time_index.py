@@ -0,0 +1,63 @@
+import math
+import time
+from journal import Journal
+from time_index import TimeIndex
+
+def fill(tmp_path, count, every=8):
+    journal = Journal(str(tmp_path / "metrics.jsonl"))
+    index = TimeIndex(str(tmp_path / "metrics.idx"), journal, every=every)
+    offsets = journal.append_many([{"cpu_usage": float(i), "timestamp": 100.0 + i} for i in range(count)])
+    for i, offset in enumerate(offsets):
+        index.add(100.0 + i, offset)
+    return journal, index, offsets
+
+def test_seek_lands_before_the_first_matching_record(tmp_path):
+    journal, index, offsets = fill(tmp_path, 100)
+    assert len(index.offsets) == 13  # One entry every 8 records
+
+    for timestamp in (100.0, 117.0, 150.5, 199.0):
+        expected = math.ceil(timestamp - 100.0)
+        offset = index.seek(timestamp)
+        assert offsets[max(0, expected - 8)] <= offset <= offsets[expected]
+    assert index.seek(50.0) == 0
+    index.close()
+    journal.close()
+
+def test_index_is_reloaded_and_catches_up_with_the_journal(tmp_path):
+    journal, index, offsets = fill(tmp_path, 20)
+    index.close()
+
+    # Records appended while the index was not written, as after a crash
+    journal.append_many([{"cpu_usage": float(i), "timestamp": 100.0 + i} for i in range(20, 40)])
+    reloaded = TimeIndex(str(tmp_path / "metrics.idx"), journal, every=8)
+    assert reloaded.timestamps == [100.0, 108.0, 116.0, 124.0, 132.0]
+    assert journal.read_at(reloaded.seek(133.0))["timestamp"] == 132.0
+    reloaded.close()
+    journal.close()
+
+def test_shift_follows_a_journal_trim(tmp_path):
+    journal, index, offsets = fill(tmp_path, 40)
+    journal.trim(offsets[16])
+    index.shift(offsets[16])
+
+    assert index.timestamps == [116.0, 124.0, 132.0]
+    assert journal.read_at(index.seek(125.0))["timestamp"] == 124.0
+    index.close()
+    journal.close()
+
+def test_range_queries_use_the_server_timestamps(storage):
+    storage.store_metrics_batch_in_file("1", [{"cpu_usage": float(i), "timestamp": 1000.0 + i} for i in range(200)])
+    assert [metrics["cpu_usage"] for metrics in storage.retrieve_metrics_range("1", 1050.0, 1053.0)] == [50.0, 51.0, 52.0]
+    assert storage.seek_metrics_time("1", 1199.5) == storage.metrics_end_position("1")
+
+def test_records_without_timestamp_are_never_trimmed(storage):
+    journal = storage.get_journal("1")
+    for i in range(50):
+        journal.append({"cpu_usage": float(i)})
+    storage.store_metrics_batch_in_file("1", [{"cpu_usage": 50.0, "timestamp": 1.0}, {"cpu_usage": 51.0, "timestamp": time.time() + 60}])
+
+    # The expired sample is dropped from behind them, and the index still finds the recent one
+    storage.trim_journal("1", time.time(), min_fraction=0)
+    assert storage.retrieve_metrics_from_file("1")[:50] == [{"cpu_usage": float(i)} for i in range(50)]
+    assert [metrics["cpu_usage"] for metrics in storage.retrieve_metrics_from_file("1")[50:]] == [51.0]
+    assert [metrics["cpu_usage"] for metrics in storage.retrieve_metrics_range("1", time.time())] == [51.0]
@@ -0,0 +1,66 @@
+import json
+import pytest
+import wire_format
+
+SAMPLE = {
+    "cpu_usage": 42.5,
+    "ram_usage": 61,
+    "interface_stats": {"eth0": {"bytes_sent": 123456, "bytes_recv": 654321, "packets_sent": 10, "packets_recv": 12, "dropin": 0, "dropout": 0}},
+    "link_metrics": {"bandwidth": {"bandwidth": "9.4 Gbits/sec", "jitter": None, "packet_loss": None}, "latency": {"latency": 0.123}},
+}
+
+MESSAGES = {
+    1: {"agent_id": "1", "metrics": SAMPLE},
+    2: {"agent_id": "1", "metrics": SAMPLE, "seq": 7},
+    3: {"agent_id": "1", "seq": 7, "batch": [{**SAMPLE, "collected_at": 1700000000.25}, {"cpu_usage": -1.5}], "sent_at": 1700000001.5},
+    4: {"agent_id": "1", "seq": 8, "batch": [{"cpu_usage": 43.0}], "sent_at": 1700000002.5, "base": 7},
+    5: {"agent_id": "1", "seq": 9, "metrics": {"ram_usage": 60.2}, "sent_at": 1700000003.5, "base": 8, "window_start": 6},
+}
+
+@pytest.mark.parametrize("version", wire_format.SUPPORTED_VERSIONS)
+def test_binary_round_trip(version):
+    message = MESSAGES[version]
+    data = wire_format.encode(message, version)
+    assert wire_format.is_binary(data)
+    assert wire_format.decode(memoryview(data)) == message
+
+def test_floats_that_do_not_round_trip_as_decimals_are_exact():
+    message = {"agent_id": "1", "metrics": {"cpu_usage": 1 / 3, "ram_usage": 1e20}}
+    assert wire_format.decode(wire_format.encode(message, 1)) == message
+
+def test_fields_outside_the_schema_fall_back_to_json():
+    message = {"agent_id": "1", "metrics": {"cpu_usage": 1.0, "gpu_usage": 2.0}}
+    data = wire_format.encode(message, wire_format.SUPPORTED_VERSIONS[-1])
+    assert not wire_format.is_binary(data)
+    assert json.loads(data) == message
+
+@pytest.mark.parametrize("metrics", [
+    {"cpu_usage": True},
+    {"cpu_usage": "42"},
+    {"interface_stats": {"eth0": [1, 2]}},
+    {"link_metrics": {"bandwidth": {"bandwidth": 9.4}}},
+])
+def test_values_of_other_types_fall_back_to_json(metrics):
+    message = {"agent_id": "1", "metrics": metrics}
+    data = wire_format.encode(message, wire_format.SUPPORTED_VERSIONS[-1])
+    assert not wire_format.is_binary(data)
+    assert wire_format.decode(data) == message
+
+def test_multi_byte_varints_round_trip():
+    message = {"agent_id": "1" * 200, "metrics": {"cpu_usage": -(2 ** 40), "ram_usage": 123456.789, "timestamp": 1700000000.123456}}
+    assert wire_format.decode(wire_format.encode(message, 1)) == message
+
+def test_newer_fields_fall_back_to_json_on_older_versions():
+    data = wire_format.encode(MESSAGES[5], 4)
+    assert not wire_format.is_binary(data)
+    assert wire_format.decode(data) == MESSAGES[5]
+
+def test_truncated_datagram_is_rejected():
+    data = wire_format.encode(MESSAGES[2], 2)
+    with pytest.raises(wire_format.WireFormatError):
+        wire_format.decode(data[:-2])
+
+def test_negotiate_picks_highest_common_version():
+    assert wire_format.negotiate([1, 2, 99]) == 2
+    assert wire_format.negotiate([99]) is None
+    assert wire_format.negotiate(None) is None
@@ -0,0 +1,58 @@
+from write_behind import WriteBehindBuffer
+
+class RecordingStorage:
+    """
+    Records the batches written by the flusher, failing the writes of the agents in `failing`.
+    """
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.writes = []
+
+    def store_metrics_batch_in_file(self, agent_id, samples):
+        self.writes.append((agent_id, list(samples)))
+        return agent_id not in self.failing
+
+def test_ack_on_enqueue_acknowledges_before_the_write():
+    storage = RecordingStorage()
+    buffer = WriteBehindBuffer(storage, WriteBehindBuffer.ACK_ON_ENQUEUE)
+    acks = []
+    assert buffer.submit("1", {"cpu_usage": 1.0}, lambda: acks.append("1"))
+    assert acks == ["1"] and storage.writes == []
+
+    buffer.flush([buffer.queue.get_nowait()])
+    assert storage.writes == [("1", [{"cpu_usage": 1.0}])]
+
+def test_ack_on_commit_waits_for_the_write_and_reports_failures():
+    storage = RecordingStorage(failing={"2"})
+    buffer = WriteBehindBuffer(storage, WriteBehindBuffer.ACK_ON_COMMIT)
+    events = []
+    buffer.submit_batch("1", [{"cpu_usage": 1.0}, {"cpu_usage": 2.0}], lambda: events.append("ack 1"), lambda: events.append("failed 1"))
+    buffer.submit("2", {"cpu_usage": 3.0}, lambda: events.append("ack 2"), lambda: events.append("failed 2"))
+    buffer.submit("1", {"cpu_usage": 4.0}, lambda: events.append("ack 1 again"), lambda: events.append("failed 1 again"))
+    assert events == []
+
+    # One flush writes each agent's samples with a single call (group commit)
+    buffer.flush([buffer.queue.get_nowait() for _ in range(3)])
+    assert storage.writes == [("1", [{"cpu_usage": 1.0}, {"cpu_usage": 2.0}, {"cpu_usage": 4.0}]), ("2", [{"cpu_usage": 3.0}])]
+    assert events == ["ack 1", "failed 2", "ack 1 again"]
+
+def test_full_queue_rejects_without_acknowledging():
+    buffer = WriteBehindBuffer(RecordingStorage(), WriteBehindBuffer.ACK_ON_ENQUEUE, max_queue=1)
+    acks = []
+    assert buffer.submit("1", {"cpu_usage": 1.0}, lambda: acks.append(1))
+    assert not buffer.submit("1", {"cpu_usage": 2.0}, lambda: acks.append(2))
+    assert acks == [1] and buffer.stats()["rejected"] == 1
+
+def test_close_flushes_everything_still_queued():
+    storage = RecordingStorage()
+    buffer = WriteBehindBuffer(storage, WriteBehindBuffer.ACK_ON_COMMIT, flush_interval=0.05)
+    buffer.start()
+    acks = []
+    for i in range(100):
+        buffer.submit("1", {"cpu_usage": float(i)}, lambda i=i: acks.append(i))
+    buffer.close()
+
+    assert [sample["cpu_usage"] for _, samples in storage.writes for sample in samples] == [float(i) for i in range(100)]
+    assert acks == list(range(100))
+    assert buffer.stats()["samples_flushed"] == 100